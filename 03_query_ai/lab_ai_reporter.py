@@ -5,7 +5,9 @@ Pipeline:
 1) Query World Bank API with pagination
 2) Clean and aggregate data
 3) Build prompt (v1/v2/v3 kept for iteration record)
-4) Query local Ollama with model fallback
+4) Query local Ollama with model fallback (installed models only; the next
+   candidate is started if the current one has not started writing, and the first
+   good answer wins; see 04_deployment/live_dashboard_report/ollama_race.py)
 5) Save report.html
 
 Prompt iteration notes for submission:
@@ -17,11 +19,18 @@ Prompt iteration notes for submission:
 from __future__ import annotations
 
 import json
+import sys
+import time
 from datetime import datetime
 from html import escape
+from pathlib import Path
 
 import requests
 
+# The model race is shared with the deployed dashboard, which keeps it next to its app.py
+sys.path.append(str(Path(__file__).resolve().parent.parent / "04_deployment" / "live_dashboard_report"))
+from ollama_race import ModelHTTPError, race_models  # noqa: E402
+
 # World Bank query config (aligned with 01_query_api/wb_query.py)
 BASE = "https://api.worldbank.org/v2"
 COUNTRIES = "USA;CHN;IND;JPN;DEU"
@@ -33,6 +42,8 @@ PER_PAGE = 200
 OLLAMA_HOST = "http://localhost:11434"
 OLLAMA_CHAT_URL = f"{OLLAMA_HOST}/api/chat"
 MODEL_CANDIDATES = ["gemma3:latest", "smollm2:1.7b"]
+MODEL_TAGS_TTL = 300  # seconds to reuse the /api/tags list of installed models
+HEDGE_AFTER = 30.0  # seconds without a first token before also starting the next candidate model
 
 # Output
 OUTPUT_HTML = "03_query_ai/report.html"
@@ -205,33 +216,50 @@ DATA:
     return prompt_map[version]
 
 
-def query_ollama(prompt: str) -> tuple[str, str]:
-    last_error = None
+_model_tags: dict = {"checked_at": 0.0, "names": None}
 
-    for model in MODEL_CANDIDATES:
-        body = {
-            "model": model,
-            "messages": [{"role": "user", "content": prompt}],
-            "stream": False,
-        }
-        try:
-            print(f"[OLLAMA] trying model={model}")
-            response = requests.post(OLLAMA_CHAT_URL, json=body, timeout=120)
-            response.raise_for_status()
-            payload = response.json()
-            content = ((payload.get("message") or {}).get("content") or "").strip()
-            if not content:
-                raise RuntimeError("Empty model response")
-            print(f"[OLLAMA] success model={model}")
-            return content, model
-        except Exception as exc:  # pylint: disable=broad-except
-            last_error = exc
-            print(f"[OLLAMA] failed model={model} error={exc}")
-
-    raise RuntimeError(
-        "All candidate models failed. Please check `ollama list` and run a model first "
-        "(e.g., `ollama run gemma3:latest`)."
-    ) from last_error
+
+def installed_models(refresh: bool = False) -> set[str] | None:
+    """Names from Ollama's /api/tags, cached for MODEL_TAGS_TTL; None if it can't be checked."""
+    if not refresh and time.monotonic() - _model_tags["checked_at"] < MODEL_TAGS_TTL:
+        return _model_tags["names"]
+    try:
+        response = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=5)
+        response.raise_for_status()
+        names = {m.get("name") or m.get("model") for m in response.json().get("models", [])}
+    except (requests.RequestException, ValueError) as exc:
+        print(f"[OLLAMA] could not list models ({exc}); trying every candidate")
+        names = None
+    _model_tags.update(checked_at=time.monotonic(), names=names)
+    return names
+
+
+def _forget_missing_model(model: str, exc: Exception) -> None:
+    if isinstance(exc, ModelHTTPError) and exc.status == 404:
+        _model_tags["checked_at"] = 0.0  # model list is stale
+
+
+def query_ollama(prompt: str, hedge_after: float = HEDGE_AFTER) -> tuple[str, str]:
+    installed = installed_models()
+    candidates = [m for m in MODEL_CANDIDATES if installed is None or m in installed]
+    if not candidates:
+        raise RuntimeError(
+            f"None of {MODEL_CANDIDATES} is installed (found: {sorted(installed or [])}). "
+            "Run a model first (e.g., `ollama run gemma3:latest`)."
+        )
+
+    # Start the first candidate; start the next one when a model fails, or when
+    # no model has started writing within hedge_after seconds. The first good answer wins.
+    return race_models(
+        OLLAMA_CHAT_URL,
+        candidates,
+        prompt,
+        hedge_after,
+        log=lambda message: print(f"[OLLAMA] {message}"),
+        on_error=_forget_missing_model,
+        failed_message="All candidate models failed. Please check `ollama list` and run a model first "
+        "(e.g., `ollama run gemma3:latest`).",
+    )
 
 
 def markdownish_to_html(text: str) -> str:
@@ -1,15 +1,19 @@
 from __future__ import annotations
 
 import json
+import os
 import re
+import time
 from datetime import datetime
 from html import escape
 from pathlib import Path
+from urllib.parse import urlsplit
 
 import pandas as pd
 import requests
 from shiny import App, Inputs, Outputs, Session, reactive, render, ui
 
+from ollama_race import ModelHTTPError, race_models
 from wb_api import fetch_world_bank_data
 
 INDICATORS = {
@@ -34,8 +38,32 @@ COUNTRIES = {
     "AUS": "Australia",
 }
 
-OLLAMA_CHAT_URL = "http://localhost:11434/api/chat"
+
+def ollama_host_from_env(default: str = "http://localhost:11434") -> str:
+    """OLLAMA_HOST as a URL. Like Ollama's client, a bare "host" or "host:port" gets http:// and
+    (without a port) 11434, and the 0.0.0.0 listen address means this machine."""
+    host = os.getenv("OLLAMA_HOST", "").strip().rstrip("/")
+    if not host:
+        return default
+    parts = urlsplit(host if "://" in host else f"http://{host}")
+    name = parts.hostname or "localhost"
+    if name in ("0.0.0.0", "::"):
+        name = "localhost"
+    if ":" in name:
+        name = f"[{name}]"
+    if parts.port:
+        port = f":{parts.port}"
+    else:
+        port = "" if "://" in host else ":11434"
+    return f"{parts.scheme}://{name}{port}{parts.path}"
+
+
+# Set OLLAMA_HOST to use another Ollama server (or the LLM gateway in 06_agents/gateway)
+OLLAMA_HOST = ollama_host_from_env()
+OLLAMA_CHAT_URL = f"{OLLAMA_HOST}/api/chat"
 MODEL_CANDIDATES = ["gemma3:latest", "smollm2:1.7b"]
+MODEL_TAGS_TTL = 300  # seconds to reuse the /api/tags list of installed models
+HEDGE_AFTER = 30.0  # seconds without a first token before also starting the next candidate model
 PROMPT_VERSION = "v3"
 REPORT_PATH = Path(__file__).resolve().parent / "report.html"
 
@@ -165,24 +193,47 @@ DATA:
     return prompt_v3
 
 
-def query_ollama(prompt: str) -> tuple[str, str]:
-    last_error = None
-    for model in MODEL_CANDIDATES:
-        try:
-            body = {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": False}
-            response = requests.post(OLLAMA_CHAT_URL, json=body, timeout=120)
-            response.raise_for_status()
-            payload = response.json()
-            content = ((payload.get("message") or {}).get("content") or "").strip()
-            if not content:
-                raise RuntimeError("Empty model response")
-            return content, model
-        except Exception as exc:  # pylint: disable=broad-except
-            last_error = exc
-    raise RuntimeError(
-        "All candidate models failed. Start Ollama and ensure one model exists, "
-        "for example: `ollama run gemma3:latest`."
-    ) from last_error
+_model_tags: dict = {"checked_at": 0.0, "names": None}
+
+
+def installed_models(refresh: bool = False) -> set[str] | None:
+    """Names from Ollama's /api/tags, cached for MODEL_TAGS_TTL; None if it can't be checked."""
+    if not refresh and time.monotonic() - _model_tags["checked_at"] < MODEL_TAGS_TTL:
+        return _model_tags["names"]
+    try:
+        response = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=5)
+        response.raise_for_status()
+        names = {m.get("name") or m.get("model") for m in response.json().get("models", [])}
+    except (requests.RequestException, ValueError):
+        names = None  # unknown: try every candidate
+    _model_tags.update(checked_at=time.monotonic(), names=names)
+    return names
+
+
+def _forget_missing_model(model: str, exc: Exception) -> None:
+    if isinstance(exc, ModelHTTPError) and exc.status == 404:
+        _model_tags["checked_at"] = 0.0  # model list is stale
+
+
+def query_ollama(prompt: str, hedge_after: float = HEDGE_AFTER) -> tuple[str, str]:
+    installed = installed_models()
+    candidates = [m for m in MODEL_CANDIDATES if installed is None or m in installed]
+    if not candidates:
+        raise RuntimeError(
+            f"None of {MODEL_CANDIDATES} is installed in Ollama. Pull or run one first, "
+            "for example: `ollama run gemma3:latest`."
+        )
+    # Try the candidates in order; the next one also starts if none has started writing
+    # within hedge_after seconds. The first good answer wins (see ollama_race.py).
+    return race_models(
+        OLLAMA_CHAT_URL,
+        candidates,
+        prompt,
+        hedge_after,
+        on_error=_forget_missing_model,
+        failed_message="All candidate models failed. Start Ollama and ensure one model exists, "
+        "for example: `ollama run gemma3:latest`.",
+    )
 
 
 def markdownish_to_html(text: str) -> str:
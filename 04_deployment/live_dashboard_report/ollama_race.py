@@ -0,0 +1,166 @@
+"""
+Ask several candidate Ollama models for one chat reply and keep the first good answer.
+
+Shared by app.py (deployed from this folder, so the module lives next to it) and
+03_query_ai/lab_ai_reporter.py (which adds this folder to sys.path).
+
+Each request streams over its own http.client connection, so a request that lost the
+race can be cut off from another thread, even while Ollama is still loading the model.
+"""
+
+from __future__ import annotations
+
+import http.client
+import json
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+from urllib.parse import urlsplit
+
+
+class Cancelled(Exception):
+    pass
+
+
+class ModelHTTPError(RuntimeError):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+def ask_model(chat_url: str, model: str, prompt: str, cancel: threading.Event, attempt: dict) -> str:
+    """Stream one chat reply on its own connection, kept in attempt["conn"] so it can be cut off.
+
+    attempt["first_token"] (a threading.Event) is set once the model has started writing.
+    """
+    url = urlsplit(chat_url)
+    conn_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+    conn = attempt["conn"] = conn_class(url.hostname, url.port, timeout=5)
+    first_token = attempt.setdefault("first_token", threading.Event())
+    body = {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": True}
+    pieces = []
+    try:
+        conn.connect()
+        if cancel.is_set():
+            raise Cancelled(model)
+        conn.sock.settimeout(120)
+        conn.request("POST", url.path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()  # waits while Ollama loads the model and reads the prompt
+        if response.status >= 400:
+            raise ModelHTTPError(response.status, response.read().decode(errors="replace").strip())
+        for line in response:
+            if cancel.is_set():
+                raise Cancelled(model)
+            if not line.strip():
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise RuntimeError(chunk["error"])
+            piece = (chunk.get("message") or {}).get("content") or ""
+            if piece:
+                first_token.set()
+            pieces.append(piece)
+            if chunk.get("done"):
+                break
+    except (OSError, http.client.HTTPException) as exc:
+        if cancel.is_set():
+            raise Cancelled(model) from exc
+        raise
+    finally:
+        conn.close()
+    content = "".join(pieces).strip()
+    if not content:
+        raise RuntimeError("Empty model response")
+    return content
+
+
+def abort(attempt: dict) -> None:
+    """Cut off a request from another thread, even before Ollama has sent a byte.
+
+    Closing the connection is how Ollama learns to stop loading or generating.
+    shutdown() (unlike close()) also wakes the thread blocked reading from it.
+    """
+    conn = attempt.get("conn")
+    sock = conn.sock if conn is not None else None
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # already closed
+
+
+def race_models(
+    chat_url: str,
+    candidates: list[str],
+    prompt: str,
+    hedge_after: float,
+    log: Callable[[str], None] | None = None,
+    on_error: Callable[[str, Exception], None] | None = None,
+    failed_message: str = "All candidate models failed.",
+) -> tuple[str, str]:
+    """Return (content, model) from the first candidate that answers.
+
+    The first candidate starts right away. The next one starts when a model fails, or
+    when no running model has started writing (first token) within hedge_after seconds.
+    Once a model is writing, it is left to finish: a long answer is not a stuck one.
+    The other requests are cut off as soon as one answer is in.
+    """
+    cancel = threading.Event()
+    waiting = iter(candidates)
+    running = {}
+    attempts = {}  # future -> {"conn": ..., "first_token": ...}, so losers can be cut off
+    last_error = None
+    hedge_at = None  # when to start the next candidate if nothing is writing yet (None: none left)
+    pool = ThreadPoolExecutor(max_workers=max(1, len(candidates)))
+
+    def start_next(hedge: bool = False) -> None:
+        nonlocal hedge_at
+        model = next(waiting, None)
+        if model is None:
+            hedge_at = None
+            return
+        if log is not None:
+            log(f"no first token after {hedge_after:g}s; hedging with model={model}" if hedge else f"trying model={model}")
+        attempt = {"first_token": threading.Event()}
+        future = pool.submit(ask_model, chat_url, model, prompt, cancel, attempt)
+        running[future], attempts[future] = model, attempt
+        hedge_at = time.monotonic() + hedge_after
+
+    try:
+        start_next()
+        while running:
+            writing = any(attempts[f]["first_token"].is_set() for f in running)
+            timeout = None if writing or hedge_at is None else max(0.0, hedge_at - time.monotonic())
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Time is up: hedge, unless a model started writing while we waited
+                if not any(attempts[f]["first_token"].is_set() for f in running):
+                    start_next(hedge=True)
+                continue
+            for future in done:
+                model = running.pop(future)
+                try:
+                    content = future.result()
+                except Exception as exc:  # pylint: disable=broad-except
+                    last_error = exc
+                    if log is not None:
+                        log(f"failed model={model} error={exc}")
+                    if on_error is not None:
+                        on_error(model, exc)
+                    start_next()
+                    continue
+                if log is not None:
+                    log(f"success model={model}")
+                    for other in running.values():
+                        log(f"cancelling model={other}")
+                return content, model
+    finally:
+        cancel.set()
+        for attempt in attempts.values():
+            abort(attempt)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    raise RuntimeError(failed_message) from last_error
@@ -20,13 +20,17 @@ import requests      # for HTTP requests
 ## 0.2 Load Functions #################################
 
 # Load helper functions for agent orchestration
-from functions import agent_run, get_shortages, df_as_text
+from functions import agent_run, get_shortages, df_as_text, warm_models
 
 # 1. CONFIGURATION ###################################
 
 # Select model of interest
 MODEL = "smollm2:1.7b"
 
+# Load the model into memory now (and keep it there for 30 minutes),
+# so the first agent_run() below doesn't wait for the model to load
+print(warm_models([MODEL], keep_alive="30m"))
+
 # 2. LOAD RULES FROM YAML ###################################
 
 # Rules are structured guidance that can be incorporated into agent prompts
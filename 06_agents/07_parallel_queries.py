@@ -10,18 +10,21 @@
 # clean the outputs into standardized labels we can analyze.
 
 # If you haven't already, install these packages...
-# pip install requests pandas
+# pip install requests pandas httpx
 
 # 0. SETUP ###################################
 
 ## 0.1 Load Packages #################################
 
+import asyncio  # for running many requests concurrently
 import time  # for timing parallel requests
-from concurrent.futures import ThreadPoolExecutor  # for parallel API calls
 
 import pandas as pd  # for reading and sampling feedback data
 import requests  # for HTTP requests
 
+# Async agent helpers from functions.py (in this folder)
+from functions import agent_gather, agent_map, agent_run_async, coalesce_stats, CascadeRouter, regex_check
+
 ## 0.2 Read Data #################################
 
 # Text to classify:
@@ -46,6 +49,19 @@ texts = pd.read_csv("06_agents/07_feedback.csv").sample(n=10, random_state=42)
 # it can help us do this classification at scale.
 
 
+# The output format as a JSON schema. Passed as Ollama's `format`, it constrains
+# the model to valid JSON with one of our three labels.
+SENTIMENT_SCHEMA = {
+    "type": "object",
+    "properties": {"sentiment": {"type": "string", "enum": ["positive", "negative", "other"]}},
+    "required": ["sentiment"],
+}
+
+# Coding is a lookup, not creative writing: temperature 0 makes the model pick its most likely
+# label every time, so the same review always gets the same code.
+SENTIMENT_OPTIONS = {"temperature": 0}
+
+
 def get_request(content, prompt, model):
     """Build URL + request body for a local Ollama chat call."""
     port = 11434
@@ -60,6 +76,9 @@ def get_request(content, prompt, model):
             {"role": "system", "content": prompt},
             {"role": "user", "content": content},
         ],
+        # Structured output: Ollama must reply with JSON matching this schema
+        "format": SENTIMENT_SCHEMA,
+        "options": SENTIMENT_OPTIONS,
         "stream": False,
     }
     return url, body
@@ -98,13 +117,23 @@ print()
 
 feedback_list = texts["feedback"].astype(str).tolist()
 
-# Send all requests in parallel and time the operation.
+# Send all requests concurrently and time the operation.
+# Instead of one thread per request, asyncio keeps many requests "in flight"
+# from a single thread while we wait on Ollama. agent_gather() caps how many
+# run at once and returns the responses in the same order as feedback_list.
 start_time = time.time()
-with ThreadPoolExecutor(max_workers=min(10, len(feedback_list))) as executor:
-    responses = list(executor.map(lambda text: req_perform(text, prompt, model), feedback_list))
+tasks = [
+    agent_run_async(role=prompt, task=text, model=model, format=SENTIMENT_SCHEMA, options=SENTIMENT_OPTIONS)
+    for text in feedback_list
+]
+responses = asyncio.run(agent_gather(tasks, max_concurrency=10))
 elapsed = time.time() - start_time
 
 print(f"Time taken to send {len(feedback_list)} requests: {elapsed:.2f} seconds")
+# Duplicate texts sent at the same moment share one Ollama call ("coalescing"). That only
+# happens when the reply is deterministic (temperature 0 or a seed), which is why every
+# request above sends SENTIMENT_OPTIONS.
+print(f"Ollama calls saved by coalescing duplicates: {coalesce_stats()['saved_calls']}")
 
 # View the results.
 print("Raw responses:")
@@ -112,12 +141,50 @@ print(responses)
 
 # 4. CLEAN SENTIMENT LABELS ############################
 
-# Usually there are a few formatting deviations,
-# so we use string extraction to get clean labels.
+# The schema keeps replies in shape, but without it there are usually a few
+# formatting deviations, so we use string extraction to get clean labels.
 # In regex pattern matching, "|" means OR.
 sentiments = (
     pd.Series(responses, name="response")
     .str.lower()
     .str.extract(r"(positive|negative|other)", expand=False)
 )
-print(sentiments)
\ No newline at end of file
+print(sentiments)
+
+# 5. LARGE BATCHES WITH agent_map() ############################
+
+# For bigger batches, agent_map() adds safety rails around the same idea:
+# it caps requests per second, retries busy (429) or failing (5xx) servers
+# with randomized waits, and records errors per item instead of crashing.
+# Results come back as a DataFrame, in the same order as feedback_list.
+# adaptive=True lets agent_map() find a good number of parallel requests itself
+# (up to max_workers): more while Ollama keeps up, fewer once requests start queueing.
+# schema=... turns on structured output: each reply is parsed and validated against
+# SENTIMENT_SCHEMA, and only the replies that fail are sent back (up to schema_retries more rounds).
+batch = agent_map(
+    role=prompt, tasks=feedback_list, model=model,
+    max_workers=32, rps_limit=20, retries=3, adaptive=True,
+    schema=SENTIMENT_SCHEMA, schema_retries=2, options=SENTIMENT_OPTIONS,
+    progress=lambda done, total, row: print(f"{done}/{total} done", end="\r"),
+)
+print()
+print(batch[["result", "error", "attempts", "seconds"]])
+print(f"Concurrency settled at {batch.attrs['concurrency']['settled_limit']} parallel requests")
+
+# Validated results are already parsed JSON, so the label needs no cleanup
+batch["sentiment"] = batch["result"].map(lambda r: r["sentiment"] if isinstance(r, dict) else None)
+print(batch["sentiment"].value_counts(dropna=False))
+print(f"Re-queued {batch.attrs['structured']['requeued']} replies; {batch.attrs['structured']['invalid']} still invalid")
+
+# 6. SMALL MODEL FIRST, BIGGER MODEL IF NEEDED ############################
+
+# A CascadeRouter sends each review to the smallest model first, and checks the reply
+# (here: does it contain one of our labels?). Only the reviews whose reply fails the check
+# go on to the bigger model. stats() shows how often we had to escalate.
+router = CascadeRouter(
+    models=["smollm2:135m", "smollm2:1.7b"],
+    check=regex_check(r"(positive|negative|other)"),
+)
+cascade = router.map(role=prompt, tasks=feedback_list, name="sentiment", max_workers=10)
+print(cascade[["result", "model", "error"]])
+print(router.stats())
@@ -0,0 +1,298 @@
+# bench_agents.py
+# Benchmark Suite: Agent Helpers Against a Mock Ollama Server
+# Pairs with mock_ollama.py, ../functions.py, and the fixer/agentpy loops in 10_data_management
+# Tim Fraser
+
+# How fast are our agent helpers when the model itself is predictable?
+# We start mock_ollama.py with a known latency and token rate, then time
+# sequential, threaded, async and streaming calls, plus the fixer and agentpy chat loops,
+# and threaded calls spread over one vs. several hosts with an EndpointPool.
+# For each scenario we report throughput (calls/sec) and p50/p95/p99 latency.
+# With --check, the script exits with an error if a helper adds too much overhead
+# or if a concurrent scenario stops running in parallel — that's what CI runs.
+# With --repeat N, every scenario runs N times and the median of each number is
+# reported (and checked), so one slow run on a busy machine doesn't fail the check.
+
+# Run from the repository root:
+# python 06_agents/bench/bench_agents.py
+# python 06_agents/bench/bench_agents.py --latency 0.1 --distribution lognormal --calls 200
+# python 06_agents/bench/bench_agents.py --check --repeat 3
+
+# 0. SETUP ###################################
+
+## 0.1 Load Packages #################################
+
+import argparse  # for command-line options
+import asyncio  # for the async scenario
+import importlib.util  # for loading the fixer helpers under their own name
+import json  # for --json output
+import statistics  # for quantiles
+import sys  # for import paths and exit codes
+import time  # for timing calls
+from pathlib import Path  # for file paths
+
+# Import ../functions.py and the mock server next to this script
+bench_dir = Path(__file__).resolve().parent
+repo_dir = bench_dir.parent.parent
+sys.path.insert(0, str(bench_dir.parent))
+sys.path.insert(0, str(bench_dir))
+
+import functions  # shared agent helpers (06_agents/functions.py)
+from mock_ollama import start_mock_server
+
+## 0.2 Configuration #################################
+
+ROLE = "Classify the sentiment of the text as positive, negative, or neutral."
+TOOL_CALLS = [{"function": {"name": "add_numbers", "arguments": {"x": 1, "y": 2}}}]
+
+
+def add_numbers(x, y):
+    """Tool used by the fixer scenario's canned tool call."""
+    return x + y
+
+
+# 1. HELPERS ###################################
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile (q between 0 and 100)."""
+    values = sorted(values)
+    if not values: return float("nan")
+    if len(values) == 1: return values[0]
+    pos = (len(values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def summarize(name, latencies, seconds, concurrency):
+    """Turn per-call latencies (seconds) and total wall time into one result row."""
+    ms = [x * 1000 for x in latencies]
+    return {
+        "scenario": name,
+        "calls": len(latencies),
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        "throughput": round(len(latencies) / seconds, 1) if seconds > 0 else float("nan"),
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "mean_ms": round(statistics.mean(ms), 2),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def load_fixer():
+    """Load 10_data_management/fixer/functions.py as 'fixer_functions' (avoids clashing with ours)."""
+    path = repo_dir / "10_data_management" / "fixer" / "functions.py"
+    spec = importlib.util.spec_from_file_location("fixer_functions", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_agentpy_loop():
+    """Import the agentpy research loop; returns None if its optional packages are missing."""
+    sys.path.insert(0, str(repo_dir / "10_data_management" / "agentpy"))
+    try:
+        from app import loop
+    except ImportError as e:
+        print(f"Skipping agentpy loop: {e}")
+        return None
+    return loop
+
+
+# 2. SCENARIOS ###################################
+
+
+def bench_sequential(n):
+    """agent_run() one call at a time."""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(n):
+        latencies.append(timed(functions.agent_run, role=ROLE, task=f"text {i}"))
+    return summarize("agent_run sequential", latencies, time.perf_counter() - start, 1)
+
+
+def bench_threaded(n, workers):
+    """agent_map() over a thread pool."""
+    start = time.perf_counter()
+    df = functions.agent_map(ROLE, [f"text {i}" for i in range(n)], max_workers=workers, retries=0)
+    seconds = time.perf_counter() - start
+    errors = df["error"].notna().sum()
+    if errors: raise RuntimeError(f"agent_map had {errors} errors, e.g. {df['error'].dropna().iloc[0]}")
+    return summarize("agent_map threaded", list(df["seconds"]), seconds, workers)
+
+
+def bench_async(n, workers):
+    """agent_run_async() calls gathered with a concurrency limit."""
+    latencies = []
+
+    async def one(i):
+        start = time.perf_counter()
+        await functions.agent_run_async(role=ROLE, task=f"text {i}")
+        latencies.append(time.perf_counter() - start)
+
+    async def main():
+        await functions.agent_gather([one(i) for i in range(n)], max_concurrency=workers)
+        # Close this loop's client before asyncio.run() closes the loop
+        await functions.get_async_client().aclose()
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return summarize("agent_gather async", latencies, time.perf_counter() - start, workers)
+
+
+def bench_hosts(n, n_hosts, parallel, mock_config):
+    """
+    agent_map() through an EndpointPool of n_hosts mock servers that each run `parallel` requests at once.
+    We start exactly as many threads as the hosts can serve, so any uneven routing shows up as queueing.
+    """
+    servers = [start_mock_server(parallel=parallel, **mock_config) for _ in range(n_hosts)]
+    functions.use_endpoints([host for _, host in servers])
+    try:
+        start = time.perf_counter()
+        df = functions.agent_map(ROLE, [f"text {i}" for i in range(n)], max_workers=parallel * n_hosts, retries=0)
+        seconds = time.perf_counter() - start
+    finally:
+        functions.use_endpoints([])
+        for server, _ in servers: server.shutdown()
+    errors = df["error"].notna().sum()
+    if errors: raise RuntimeError(f"agent_map had {errors} errors, e.g. {df['error'].dropna().iloc[0]}")
+    # Capacity is what the hosts can run at once, not how many threads we start
+    return summarize(f"agent_map {n_hosts} host(s)", list(df["seconds"]), seconds, parallel * n_hosts)
+
+
+def bench_stream(n):
+    """agent(stream=True): latency here is time to first token."""
+    ttft = []
+    start = time.perf_counter()
+    for i in range(n):
+        stream = functions.agent([{"role": "user", "content": f"text {i}"}], stream=True)
+        for _ in stream: pass
+        ttft.append(stream.stats["time_to_first_token"])
+    return summarize("agent stream (TTFT)", ttft, time.perf_counter() - start, 1)
+
+
+def bench_fixer(n, host):
+    """fixer ollama_chat_once() with a tool call, as in fixer_csv.py."""
+    fixer = load_fixer()
+    tools = [{"type": "function", "function": {"name": "add_numbers", "parameters": {"type": "object"}}}]
+    messages = [{"role": "user", "content": "fix this row"}]
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(n):
+        latencies.append(timed(fixer.ollama_chat_once, host, None, functions.DEFAULT_MODEL, messages, tools=tools, site="bench"))
+    return summarize("fixer ollama_chat_once", latencies, time.perf_counter() - start, 1)
+
+
+def bench_agentpy(n, host, loop):
+    """agentpy loop._chat_once() over one shared httpx client, as in run_research_loop()."""
+    import httpx
+    messages = [{"role": "user", "content": "brief me"}]
+    latencies = []
+    start = time.perf_counter()
+    with httpx.Client() as client:
+        for _ in range(n):
+            latencies.append(timed(loop._chat_once, client, host, "", functions.DEFAULT_MODEL, messages, None, []))
+    return summarize("agentpy _chat_once", latencies, time.perf_counter() - start, 1)
+
+
+# 3. RUN ###################################
+
+
+def median_rows(runs):
+    """Combine repeated runs (lists of rows, same scenarios in the same order) into median rows."""
+    rows = []
+    for same in zip(*runs):
+        row = dict(same[0])
+        for key in ("seconds", "throughput", "p50_ms", "p95_ms", "p99_ms", "mean_ms"):
+            row[key] = round(statistics.median(r[key] for r in same), 2)
+        rows.append(row)
+    return rows
+
+
+def check(rows, expected_ms, max_overhead_ms, min_efficiency):
+    """Return a list of failure messages; empty means every scenario passed."""
+    failures = []
+    for row in rows:
+        name = row["scenario"]
+        overhead = row["p50_ms"] - expected_ms
+        if overhead > max_overhead_ms:
+            failures.append(f"{name}: p50 overhead {overhead:.1f} ms > {max_overhead_ms} ms")
+        if row["concurrency"] > 1:
+            ideal = row["concurrency"] / (expected_ms / 1000)
+            efficiency = row["throughput"] / ideal
+            if efficiency < min_efficiency:
+                failures.append(f"{name}: {efficiency:.0%} of ideal throughput < {min_efficiency:.0%}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark agent helpers against a mock Ollama server.")
+    parser.add_argument("--calls", type=int, default=100, help="calls per scenario (default: 100)")
+    parser.add_argument("--workers", type=int, default=10, help="concurrency for threaded/async scenarios")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean seconds before the first token")
+    parser.add_argument("--distribution", default="fixed", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--token-rate", type=float, default=200, help="tokens/sec generated by the mock")
+    parser.add_argument("--hosts", type=int, default=3, help="mock hosts for the endpoint pool scenario")
+    parser.add_argument("--parallel", type=int, default=2, help="requests each pooled mock host runs at once")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scenario; report the median (default: 1)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    parser.add_argument("--check", action="store_true", help="exit 1 if overhead or efficiency regress")
+    parser.add_argument("--max-overhead-ms", type=float, default=25.0)
+    parser.add_argument("--min-efficiency", type=float, default=0.4)
+    args = parser.parse_args()
+
+    reply = "positive"
+    mock_config = {"latency": args.latency, "distribution": args.distribution,
+                   "token_rate": args.token_rate, "reply": reply, "tool_calls": TOOL_CALLS}
+    server, host = start_mock_server(**mock_config)
+    functions.CHAT_URL = f"{host}/api/chat"
+    gen_ms = len(reply.split()) / args.token_rate * 1000
+    expected_ms = args.latency * 1000 + gen_ms
+
+    # Warm up once so imports and the first socket don't skew results
+    functions.agent_run(role="warm up", task="warm up")
+
+    loop = load_agentpy_loop()
+    runs = []
+    for _ in range(max(1, args.repeat)):
+        rows = [
+            bench_sequential(args.calls),
+            bench_threaded(args.calls, args.workers),
+            bench_async(args.calls, args.workers),
+            bench_stream(args.calls),
+            bench_fixer(args.calls, host),
+            bench_hosts(args.calls, 1, args.parallel, mock_config),
+            bench_hosts(args.calls, args.hosts, args.parallel, mock_config),
+        ]
+        if loop is not None: rows.append(bench_agentpy(args.calls, host, loop))
+        runs.append(rows)
+    server.shutdown()
+    rows = median_rows(runs)
+
+    if args.json:
+        for row in rows: print(json.dumps(row))
+    else:
+        print(f"Mock: {args.distribution} latency {args.latency * 1000:.0f} ms, {args.token_rate:g} tokens/sec "
+              f"(expected {expected_ms:.1f} ms per call)" + (f", median of {len(runs)} runs" if len(runs) > 1 else ""))
+        print(f"{'scenario':<24} {'calls':>5} {'conc':>4} {'calls/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for r in rows:
+            print(f"{r['scenario']:<24} {r['calls']:>5} {r['concurrency']:>4} {r['throughput']:>8} "
+                  f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8}")
+
+    if args.check:
+        failures = check(rows, expected_ms, args.max_overhead_ms, args.min_efficiency)
+        for f in failures: print(f"FAIL {f}")
+        if failures: sys.exit(1)
+        print("All benchmark checks passed.")
+
+
+if __name__ == "__main__":
+    main()
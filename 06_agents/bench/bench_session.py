@@ -0,0 +1,74 @@
+# bench_session.py
+# Microbenchmark: Pooled Keep-Alive Session vs. New Connection Per Call
+# Pairs with mock_ollama.py and ../functions.py
+# Tim Fraser
+
+# How much time does connection reuse save per agent() call?
+# We start a local stand-in for Ollama, then time agent_run() with keep-alive
+# turned off (one new connection per call) and on (connections reused from the pool).
+
+# Run from the repository root:
+# python 06_agents/bench/bench_session.py
+
+# 0. SETUP ###################################
+
+## 0.1 Load Packages #################################
+
+import statistics  # for median and mean
+import sys  # for import paths
+import time  # for timing calls
+from pathlib import Path  # for file paths
+
+# Import ../functions.py and the mock server next to this script
+bench_dir = Path(__file__).resolve().parent
+sys.path.insert(0, str(bench_dir.parent))
+sys.path.insert(0, str(bench_dir))
+
+import functions  # shared agent helpers
+from mock_ollama import start_mock_server
+
+## 0.2 Configuration #################################
+
+N_CALLS = 300  # calls per scenario
+
+# 1. BENCHMARK ###################################
+
+
+def time_calls(n):
+    """Run agent_run() n times and return per-call latencies in milliseconds."""
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        functions.agent_run(role="Classify sentiment.", task="booo")
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(label, latencies):
+    print(f"{label:<28} mean {statistics.mean(latencies):7.3f} ms | median {statistics.median(latencies):7.3f} ms")
+
+
+# Point the helpers at the mock server
+server, host = start_mock_server()
+functions.CHAT_URL = f"{host}/api/chat"
+
+# Warm up once so imports and the first socket don't skew results
+functions.agent_run(role="warm up", task="warm up")
+
+# No keep-alive: every call opens and closes its own TCP connection
+functions.configure_session(keep_alive=False)
+cold = time_calls(N_CALLS)
+
+# Keep-alive: calls reuse connections from the shared pool
+functions.configure_session(keep_alive=True)
+pooled = time_calls(N_CALLS)
+
+server.shutdown()
+
+# 2. RESULTS ###################################
+
+print(f"{N_CALLS} agent_run() calls against {host}")
+summarize("new connection per call", cold)
+summarize("pooled keep-alive session", pooled)
+saved = statistics.median(cold) - statistics.median(pooled)
+print(f"Median latency saved per call: {saved:.3f} ms")
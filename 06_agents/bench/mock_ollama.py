@@ -0,0 +1,229 @@
+# mock_ollama.py
+# Local Stand-In for the Ollama Server
+# Pairs with bench_session.py and bench_agents.py
+# Tim Fraser
+
+# A small HTTP server that answers /api/chat, /api/generate and /api/tags the way Ollama does.
+# It lets us test and benchmark our agent helpers offline, without a GPU or network.
+# Replies are canned, but their timing is realistic: each call waits for a random
+# "prompt processing" latency, then "generates" tokens at a set rate.
+# It can also return canned tool_calls, stream replies as NDJSON, and fail on purpose.
+
+# 0. SETUP ###################################
+
+## 0.1 Load Packages #################################
+
+import json  # for working with JSON
+import math  # for the lognormal latency distribution
+import random  # for random latencies and errors
+import threading  # for running the server in the background
+import time  # for simulated delays
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # built-in HTTP server
+
+## 0.2 Default Settings #################################
+
+DEFAULT_CONFIG = {
+    "models": ["smollm2:1.7b", "smollm2:135m"],
+    "reply": "positive",     # text of every reply
+    # Latency before the first token: "fixed" (always latency seconds),
+    # "uniform" (0 to 2 x latency), or "lognormal" (mean latency, long right tail)
+    "latency": 0.0,
+    "distribution": "fixed",
+    "sigma": 0.5,            # spread of the lognormal distribution
+    "model_latency": None,   # {model: seconds} to make some models slower (fixed latency)
+    "token_rate": None,      # tokens per second while "generating" (None = instant)
+    "load_seconds": 0.0,     # reported load_duration for each call
+    "tool_calls": None,      # list of tool calls to return when the request includes tools
+    "error_rate": 0.0,       # share of /api/chat calls that fail
+    "error_status": 503,     # HTTP status used for those failures
+    "parallel": None,        # max requests generating at once, like OLLAMA_NUM_PARALLEL (None = no limit)
+}
+
+# 1. REQUEST HANDLER ###################################
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    """Answer Ollama-style requests with canned JSON."""
+
+    # HTTP/1.1 lets clients keep the connection open between requests (keep-alive)
+    protocol_version = "HTTP/1.1"
+    # Send small responses right away instead of waiting to batch them (Nagle's algorithm)
+    disable_nagle_algorithm = True
+    # Settings for this server (set by start_mock_server)
+    config = DEFAULT_CONFIG
+
+    def log_message(self, format, *args):
+        # Stay quiet; benchmarks print their own output
+        pass
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        # Echo "Connection: close" like a real server when the client opts out of keep-alive
+        if self.close_connection: self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, payload):
+        # Chunked transfer encoding: "<size in hex>\r\n<data>\r\n"
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _first_token_delay(self, model=None):
+        cfg = self.config
+        if cfg["model_latency"] and model in cfg["model_latency"]: return cfg["model_latency"][model]
+        mean = cfg["latency"]
+        if mean <= 0: return 0.0
+        if cfg["distribution"] == "uniform": return random.uniform(0, 2 * mean)
+        if cfg["distribution"] == "lognormal":
+            # Choose mu so the distribution's mean equals `latency`
+            sigma = cfg["sigma"]
+            return random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+        return mean
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": m, "model": m} for m in self.config["models"]]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path not in ("/api/chat", "/api/generate"):
+            self._send_json({"error": "not found"}, status=404)
+            return
+        generate = self.path == "/api/generate"
+        cfg = self.config
+        model = body.get("model", "")
+
+        # Unknown model or injected failure
+        if model not in cfg["models"]:
+            self._send_json({"error": f"model '{model}' not found"}, status=404)
+            return
+        if cfg["error_rate"] > 0 and random.random() < cfg["error_rate"]:
+            self._send_json({"error": "server busy"}, status=cfg["error_status"])
+            return
+
+        # An empty messages list (or prompt) just loads the model
+        if not body.get("prompt" if generate else "messages"):
+            reply = {"response": ""} if generate else {"message": {"role": "assistant", "content": ""}}
+            self._send_json({"model": model, **reply, "done": True, "done_reason": "load",
+                             "load_duration": int(cfg["load_seconds"] * 1e9)})
+            return
+
+        # Like Ollama, only `parallel` requests generate at once; the rest wait their turn
+        slots = cfg.get("_slots")
+        if slots is None:
+            self._generate(body, model, generate)
+            return
+        with slots:
+            self._generate(body, model, generate)
+
+    def _generate(self, body, model, generate=False):
+        cfg = self.config
+        # /api/generate replies carry text in "response"; /api/chat in "message"
+        wrap = (lambda text: {"response": text}) if generate else (lambda text: {"message": {"role": "assistant", "content": text}})
+        # Simulate reading the prompt
+        prompt_seconds = self._first_token_delay(model)
+        time.sleep(prompt_seconds)
+
+        # Decide what to "generate": canned tool calls if tools were offered, else the reply text
+        tool_calls = cfg["tool_calls"] if body.get("tools") and cfg["tool_calls"] else None
+        pieces = [] if tool_calls else _split_tokens(cfg["reply"])
+        per_token = 1 / cfg["token_rate"] if cfg["token_rate"] else 0.0
+        stats = {
+            "load_duration": int(cfg["load_seconds"] * 1e9),
+            "prompt_eval_count": (len(str(body.get("prompt", "")).split()) if generate else
+                                  sum(len(str(m.get("content", "")).split()) for m in body["messages"])),
+            "prompt_eval_duration": int(prompt_seconds * 1e9),
+            "eval_count": max(1, len(pieces)),
+            "eval_duration": int(max(1, len(pieces)) * per_token * 1e9),
+        }
+        stats["total_duration"] = stats["load_duration"] + stats["prompt_eval_duration"] + stats["eval_duration"]
+
+        if body.get("stream", True):
+            # Stream one NDJSON line per token, then a final "done" line with the stats
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for piece in pieces:
+                    time.sleep(per_token)
+                    self._send_chunk({"model": model, **wrap(piece), "done": False})
+                if tool_calls:
+                    self._send_chunk({"model": model, "message": {"role": "assistant", "content": "", "tool_calls": tool_calls}, "done": False})
+                self._send_chunk({"model": model, **wrap(""), "done": True, "done_reason": "stop", **stats})
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # Like Ollama, stop generating when the client hangs up (e.g. a cancelled request)
+                self.close_connection = True
+            return
+
+        time.sleep(len(pieces) * per_token)
+        if generate:
+            self._send_json({"model": model, "response": "".join(pieces), "done": True, "done_reason": "stop", **stats})
+            return
+        message = {"role": "assistant", "content": "".join(pieces)}
+        if tool_calls: message["tool_calls"] = tool_calls
+        self._send_json({"model": model, "message": message, "done": True, "done_reason": "stop", **stats})
+
+
+def _split_tokens(text):
+    """Rough tokens: words, each keeping its leading space."""
+    words = text.split(" ")
+    return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+
+# 2. SERVER HELPERS ###################################
+
+
+class MockServer(ThreadingHTTPServer):
+    # One thread per connection; daemon threads so the benchmark can exit
+    daemon_threads = True
+    # Accept many simultaneous connections for concurrency benchmarks
+    request_queue_size = 1024
+
+
+def start_mock_server(port=0, delay=0.0, **config):
+    """
+    Start the mock server on a background thread.
+
+    Parameters:
+    -----------
+    port : int
+        Port to listen on (default: 0, meaning any free port)
+    delay : float
+        Fixed seconds before each reply (shortcut for latency=..., distribution="fixed")
+    **config :
+        Any DEFAULT_CONFIG setting, e.g. latency=0.05, distribution="lognormal",
+        token_rate=200, tool_calls=[...], error_rate=0.1, parallel=4
+
+    Returns:
+    --------
+    tuple
+        (server, host) where host is like "http://127.0.0.1:54321"
+    """
+    settings = {**DEFAULT_CONFIG, **config}
+    if delay and "latency" not in config: settings["latency"] = delay
+    if settings["parallel"]: settings["_slots"] = threading.BoundedSemaphore(settings["parallel"])
+    handler = type("Handler", (MockOllamaHandler,), {"config": settings})
+    server = MockServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = f"http://127.0.0.1:{server.server_address[1]}"
+    return server, host
+
+
+if __name__ == "__main__":
+    # Run standalone: python 06_agents/bench/mock_ollama.py
+    # Then point OLLAMA_HOST / CHAT_URL at http://127.0.0.1:11435
+    server, host = start_mock_server(port=11435, latency=0.05, distribution="lognormal", token_rate=200)
+    print(f"Mock Ollama listening at {host} (Ctrl+C to stop)")
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
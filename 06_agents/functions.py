@@ -11,23 +11,895 @@
 
 import requests  # for HTTP requests
 import json      # for working with JSON
+import os        # for reading environment variables
+import threading # for a thread-safe shared session
+import hashlib   # for hashing cache keys
+import sqlite3   # for the on-disk response cache
+import time      # for timing streamed tokens
+import asyncio   # for async (concurrent) agent calls
+import random    # for jittered retry delays
+import bisect    # for histogram buckets
+import copy      # for sharing coalesced replies
+import functools # for binding a streamed request's release callback
+import re        # for regex output checks
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED  # for parallel batches and workflows
 import pandas as pd  # for data manipulation
 from datetime import datetime  # for date parsing
+from urllib.parse import urlsplit  # for reading OLLAMA_HOST
+
+# httpx is only needed for the async helpers (agent_async, agent_gather, ...)
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# jsonschema is optional; without it, structured outputs are checked with a small built-in validator
+try:
+    import jsonschema
+except ImportError:
+    jsonschema = None
 
 # If you haven't already, install these packages...
-# pip install requests pandas
+# pip install requests pandas httpx
 
 ## 0.2 Configuration #################################
 
 # Default model and Ollama connection
 DEFAULT_MODEL = "smollm2:1.7b"
 PORT = 11434
-OLLAMA_HOST = f"http://localhost:{PORT}"
+
+
+def ollama_host_from_env(default=f"http://localhost:{PORT}"):
+    """
+    Read OLLAMA_HOST as a URL, so every script can be pointed at another server (or a gateway)
+    without editing it. Ollama's own setting may be just "host" or "host:port" (e.g. "0.0.0.0"),
+    so, like Ollama's client: add http:// when it's missing, use port 11434 when no scheme or
+    port is given, and connect to localhost instead of 0.0.0.0.
+    """
+    host = os.getenv("OLLAMA_HOST", "").strip().rstrip("/")
+    if not host: return default
+    parts = urlsplit(host if "://" in host else f"http://{host}")
+    name = parts.hostname or "localhost"
+    if name in ("0.0.0.0", "::"): name = "localhost"
+    if ":" in name: name = f"[{name}]"  # IPv6 address
+    if parts.port: port = f":{parts.port}"
+    else: port = "" if "://" in host else f":{PORT}"  # "http://host" means port 80, as in Ollama
+    return f"{parts.scheme}://{name}{port}{parts.path}"
+
+
+OLLAMA_HOST = ollama_host_from_env()
 CHAT_URL = f"{OLLAMA_HOST}/api/chat"
 
+## 0.3 Pooled HTTP Session #################################
+
+# Opening a brand-new connection for every chat turn is slow.
+# A requests.Session keeps connections open ("keep-alive") and reuses them,
+# so repeated agent() calls skip the TCP (and, for Ollama Cloud, TLS) handshake.
+# Set OLLAMA_POOL_SIZE to change how many connections stay open per host.
+POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "20"))
+KEEP_ALIVE = True
+
+_session = None
+_session_lock = threading.Lock()  # so parallel threads share one session
+
+
+def _new_session():
+    """Build a requests.Session with a connection pool of POOL_SIZE."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Ask the server to close the socket after each request when keep-alive is off
+    if not KEEP_ALIVE: session.headers["Connection"] = "close"
+    return session
+
+
+def get_session():
+    """Return the shared pooled HTTP session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _new_session()
+        return _session
+
+
+def configure_session(pool_size=None, keep_alive=None):
+    """
+    Rebuild the shared HTTP session with new pool settings.
+    
+    Parameters:
+    -----------
+    pool_size : int, optional
+        Maximum number of open connections kept per host (default: POOL_SIZE)
+    keep_alive : bool, optional
+        If False, close each connection after its request (default: True)
+    
+    Returns:
+    --------
+    requests.Session
+        The new shared session
+    """
+    global _session, POOL_SIZE, KEEP_ALIVE
+    if pool_size is not None: POOL_SIZE = int(pool_size)
+    if keep_alive is not None: KEEP_ALIVE = bool(keep_alive)
+    with _session_lock:
+        old, _session = _session, _new_session()
+    if old is not None: old.close()
+    return _session
+
+## 0.4 Response Cache #################################
+
+# Re-running a script often sends the exact same request to Ollama again,
+# and we pay the full generation time every time. The (opt-in) response cache
+# saves each reply in a small SQLite file, keyed on a hash of the request body,
+# so an identical request is answered from disk instead. Only requests that ask for a
+# repeatable answer are cached, e.g. agent_run(role, task, options={"temperature": 0})
+# (or a seed); without options Ollama samples, and those requests always go to the server.
+# Turn it on with enable_cache(); see how much it saved with cache_stats().
+
+CACHE_PATH = os.getenv("AGENT_CACHE_PATH", ".agent_cache.db")
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of /api/chat replies.
+    
+    - Keys are a SHA-256 hash of the canonical JSON request body (model, messages, tools, options, ...)
+    - Entries older than ttl seconds are ignored and removed
+    - When the file grows past max_bytes, the least recently used entries are evicted
+    - Only deterministic requests are cached: options.temperature set to 0, or a seed.
+      Anything else (including no temperature at all, which means Ollama's default of 0.8)
+      gives different answers each time, so it skips the cache unless cache_random=True
+    """
+    
+    def __init__(self, path=CACHE_PATH, max_bytes=100_000_000, ttl=7 * 24 * 3600, cache_random=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_random = cache_random
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_seconds = 0.0  # Ollama time we did not have to spend
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, result TEXT NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+    
+    @staticmethod
+    def key(body):
+        """Hash the request body; sorted keys make the JSON text canonical."""
+        body = {k: v for k, v in body.items() if k not in ("stream", "keep_alive")}
+        text = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+    
+    def cacheable(self, body):
+        """Return True for requests that pin their sampling (temperature 0 or a seed), or any request if cache_random."""
+        if body.get("stream"): return False
+        return self.cache_random or is_deterministic(body)
+    
+    def get(self, body):
+        """Return the cached reply for this body, or None."""
+        if not self.cacheable(body):
+            with self._lock: self.bypassed += 1
+            return None
+        key = self.key(body)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT result, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None: self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            result = json.loads(row[0])
+            self.saved_seconds += (result.get("total_duration") or 0) / 1e9
+        return result
+    
+    def put(self, body, result):
+        """Save a reply, then evict expired and least recently used entries."""
+        if not self.cacheable(body): return
+        text = json.dumps(result, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, result, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (self.key(body), text, len(text), now, now)
+            )
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                # Walk from least to most recently used, dropping entries until we fit
+                stale = []
+                for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                    if total <= self.max_bytes: break
+                    stale.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+            self._conn.commit()
+    
+    def stats(self):
+        """Return hit/miss counters and the current cache size."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            hits, misses, bypassed, saved = self.hits, self.misses, self.bypassed, self.saved_seconds
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "bypassed": bypassed,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "saved_seconds": saved,
+            "entries": entries,
+            "size_bytes": size,
+        }
+    
+    def clear(self):
+        """Delete every cached reply."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+_cache = None  # the active ResponseCache, or None when caching is off
+
+
+def enable_cache(path=CACHE_PATH, max_bytes=100_000_000, ttl=7 * 24 * 3600, cache_random=False):
+    """
+    Turn on the response cache for agent() and agent_run().
+    
+    Parameters:
+    -----------
+    path : str
+        SQLite file for cached replies (default: ".agent_cache.db", or AGENT_CACHE_PATH)
+    max_bytes : int
+        Evict least recently used replies past this total size (default: 100 MB)
+    ttl : float
+        Seconds before a cached reply expires (default: 7 days)
+    cache_random : bool
+        If True, also cache sampled requests: no temperature (Ollama's default) or one above 0 (default: False)
+    
+    Returns:
+    --------
+    ResponseCache
+        The active cache
+    """
+    global _cache
+    _cache = ResponseCache(path=path, max_bytes=max_bytes, ttl=ttl, cache_random=cache_random)
+    return _cache
+
+
+def disable_cache():
+    """Turn off the response cache (the file on disk is kept)."""
+    global _cache
+    _cache = None
+
+
+def cache_stats():
+    """Return hits, misses, bypassed, hit_rate, saved_seconds, entries and size_bytes (or None if off)."""
+    return None if _cache is None else _cache.stats()
+
+
+# Set AGENT_CACHE=1 to turn the cache on for every script without editing it
+if os.getenv("AGENT_CACHE", "").strip().lower() in ("1", "true", "yes", "on"): enable_cache()
+
+
+def post_chat(body):
+    """
+    POST a non-streaming /api/chat request body and return the parsed JSON reply.
+    Uses the response cache when it is turned on, and coalesces identical requests in flight.
+    """
+    if MODEL_KEEP_ALIVE is not None: body.setdefault("keep_alive", MODEL_KEEP_ALIVE)
+    cache = _cache
+    if cache is not None:
+        cached = cache.get(body)
+        if cached is not None: return cached
+    
+    def call():
+        start = time.perf_counter()
+        result = send_chat(body).json()
+        METRICS.record(result, model=body.get("model"), site="agent", wall_seconds=time.perf_counter() - start)
+        if cache is not None: cache.put(body, result)
+        return result
+    
+    # Identical deterministic requests already in flight share one Ollama call
+    if COALESCE and is_deterministic(body): return SINGLE_FLIGHT.do(ResponseCache.key(body), call)
+    return call()
+
+## 0.5 Call Metrics #################################
+
+# Every /api/chat reply from Ollama includes timings (in nanoseconds) and token counts:
+# total_duration, load_duration (loading the model into memory),
+# prompt_eval_count/prompt_eval_duration (reading the prompt) and
+# eval_count/eval_duration (generating the reply).
+# METRICS keeps small histograms of these per (model, call site), so we can see
+# where the time goes. Set AGENT_METRICS_PATH to also append every call to a JSONL file.
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, float("inf"))
+# wall = time measured by us (includes network); the rest come from Ollama
+PHASES = ("wall", "total", "load", "prompt_eval", "eval")
+
+
+class OllamaMetrics:
+    """In-memory latency histograms and token counts for Ollama calls, grouped by (model, site)."""
+    
+    def __init__(self, jsonl_path=None):
+        self.jsonl_path = jsonl_path
+        self._groups = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # keeps JSONL lines whole without blocking record()/summary()
+    
+    def record(self, data, model, site, wall_seconds=None):
+        """Record one /api/chat reply (the parsed JSON) and return the sample that was stored."""
+        ns = lambda key: (data.get(key) or 0) / 1e9
+        sample = {
+            "ts": time.time(), "model": model, "site": site,
+            "wall_s": wall_seconds, "total_s": ns("total_duration"), "load_s": ns("load_duration"),
+            "prompt_eval_s": ns("prompt_eval_duration"), "eval_s": ns("eval_duration"),
+            "prompt_tokens": data.get("prompt_eval_count") or 0, "eval_tokens": data.get("eval_count") or 0,
+        }
+        with self._lock:
+            group = self._groups.get((model, site))
+            if group is None:
+                group = {"calls": 0, "prompt_tokens": 0, "eval_tokens": 0,
+                         "phases": {p: {"n": 0, "sum": 0.0, "max": 0.0, "counts": [0] * len(LATENCY_BUCKETS)} for p in PHASES}}
+                self._groups[(model, site)] = group
+            group["calls"] += 1
+            group["prompt_tokens"] += sample["prompt_tokens"]
+            group["eval_tokens"] += sample["eval_tokens"]
+            for phase in PHASES:
+                value = sample[f"{phase}_s"]
+                if value is None: continue
+                hist = group["phases"][phase]
+                hist["n"] += 1
+                hist["sum"] += value
+                hist["max"] = max(hist["max"], value)
+                hist["counts"][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        # Write to disk after releasing the lock, so a slow disk never stalls other calls' bookkeeping
+        if self.jsonl_path:
+            line = json.dumps(sample) + "\n"
+            with self._write_lock, open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return sample
+    
+    @staticmethod
+    def _percentile(hist, q):
+        """Approximate percentile: the upper bound of the bucket holding the q-th value."""
+        if hist["n"] == 0: return None
+        target, seen = q * hist["n"], 0
+        for bound, count in zip(LATENCY_BUCKETS, hist["counts"]):
+            seen += count
+            if seen >= target: return min(bound, hist["max"])
+        return hist["max"]
+    
+    def summary(self):
+        """Return one dict per (model, site) with call counts, tokens, and mean/p50/p95 seconds per phase."""
+        rows = []
+        with self._lock:
+            for (model, site), group in self._groups.items():
+                row = {"model": model, "site": site, "calls": group["calls"],
+                       "prompt_tokens": group["prompt_tokens"], "eval_tokens": group["eval_tokens"]}
+                for phase in PHASES:
+                    hist = group["phases"][phase]
+                    row[f"{phase}_mean_s"] = hist["sum"] / hist["n"] if hist["n"] else None
+                    row[f"{phase}_p50_s"] = self._percentile(hist, 0.50)
+                    row[f"{phase}_p95_s"] = self._percentile(hist, 0.95)
+                eval_s = group["phases"]["eval"]["sum"]
+                row["eval_tokens_per_s"] = group["eval_tokens"] / eval_s if eval_s else None
+                rows.append(row)
+        return rows
+    
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._groups = {}
+
+
+METRICS = OllamaMetrics(os.getenv("AGENT_METRICS_PATH") or None)
+
+
+def metrics_summary():
+    """Return METRICS.summary() as a DataFrame, one row per (model, call site)."""
+    return pd.DataFrame(METRICS.summary())
+
+## 0.6 Model Warm-Up #################################
+
+# Ollama loads a model into memory on its first request, and unloads it after
+# 5 idle minutes by default. That first call (and the first call after a break)
+# pays the model's load time. warm_models() loads models ahead of time, in parallel,
+# and "pins" them by sending a keep_alive duration with every later request too
+# (each request resets Ollama's unload timer to its own keep_alive value).
+
+def parse_keep_alive(value):
+    """Turn a keep_alive setting into what Ollama expects: a number of seconds ("-1" -> -1), a duration ("30m"), or None."""
+    if value is None or isinstance(value, (int, float)): return value
+    value = str(value).strip()
+    if not value: return None
+    try: return int(value)  # Ollama reads the string "-1" as a bad duration
+    except ValueError: pass
+    try: return float(value)
+    except ValueError: return value
+
+
+# e.g. "30m", "2h", or -1 (keep loaded until Ollama stops); None = Ollama's default
+MODEL_KEEP_ALIVE = parse_keep_alive(os.getenv("AGENT_MODEL_KEEP_ALIVE"))
+
+
+def warm_models(models, keep_alive="30m", pin=True):
+    """
+    Load models into Ollama's memory before the first real request.
+    
+    Parameters:
+    -----------
+    models : list
+        Model names, e.g. ["smollm2:1.7b", "smollm2:135m"]
+    keep_alive : str or int
+        How long Ollama should keep each model loaded, e.g. "30m" or -1 for forever (default: "30m")
+    pin : bool
+        If True, also send this keep_alive with every later agent() request,
+        so normal traffic doesn't shorten it back to the default (default: True)
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per model and host: model, host, ok, load_seconds (Ollama's load_duration), wall_seconds, error.
+        With an endpoint pool (use_endpoints), each model is loaded on every host that has it.
+    """
+    global MODEL_KEEP_ALIVE
+    keep_alive = parse_keep_alive(keep_alive)
+    if pin: MODEL_KEEP_ALIVE = keep_alive
+    
+    def warm_one(job):
+        # A chat request with no messages just loads the model
+        model, chat_url = job
+        start = time.perf_counter()
+        row = {"model": model, "host": chat_url.rsplit("/api/", 1)[0]}
+        try:
+            response = get_session().post(chat_url, json={"model": model, "messages": [], "keep_alive": keep_alive, "stream": False})
+            response.raise_for_status()
+            data = response.json()
+            return {**row, "ok": True, "load_seconds": (data.get("load_duration") or 0) / 1e9,
+                    "wall_seconds": time.perf_counter() - start, "error": None}
+        except Exception as e:
+            return {**row, "ok": False, "load_seconds": None,
+                    "wall_seconds": time.perf_counter() - start, "error": str(e)}
+    
+    models = list(dict.fromkeys(models))  # drop duplicates, keep order
+    if ENDPOINTS is None:
+        jobs = [(model, CHAT_URL) for model in models]
+    else:
+        ENDPOINTS.check_all()
+        now = time.monotonic()
+        jobs = [(model, e.chat_url) for model in models for e in ENDPOINTS.endpoints
+                if now >= e.drained_until and e.models is not None and e.has_model(model)]
+    with ThreadPoolExecutor(max_workers=max(1, len(jobs))) as executor:
+        rows = list(executor.map(warm_one, jobs))
+    return pd.DataFrame(rows, columns=["model", "host", "ok", "load_seconds", "wall_seconds", "error"])
+
+## 0.7 Multiple Ollama Hosts #################################
+
+# One Ollama server can only run a few requests at a time. If we have several
+# Ollama machines, an EndpointPool spreads requests across them:
+# - each request goes to the host with the fewest requests in flight ("least outstanding")
+# - only hosts that have the requested model (from their /api/tags list) are used
+# - a host that fails (connection error or 5xx) is "drained": skipped for a while,
+#   then health-checked again before it gets traffic; the request fails over to another host
+# Turn it on with use_endpoints(["http://gpu1:11434", "http://gpu2:11434"]),
+# or set OLLAMA_HOSTS to a comma-separated list of hosts.
+
+HEALTH_TTL = 30      # seconds before a host's model list is re-checked
+HEALTH_TIMEOUT = 3   # seconds to wait for a health check
+DRAIN_SECONDS = 10   # first drain period; doubles with each failure in a row
+MAX_DRAIN_SECONDS = 300
+
+
+def endpoint_failed(err):
+    """True if an error means the host itself is unhealthy (connection problem, timeout or 5xx)."""
+    if isinstance(err, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)): return True
+    if httpx is not None and isinstance(err, httpx.TransportError): return True
+    response = getattr(err, "response", None)
+    status = getattr(response, "status_code", None)
+    return status is not None and status >= 500
+
+
+class OllamaEndpoint:
+    """One Ollama host: its model list, requests in flight, and health."""
+    
+    def __init__(self, host):
+        self.host = host.rstrip("/")
+        self.chat_url = f"{self.host}/api/chat"
+        self.models = None        # model names from /api/tags (None = not checked yet)
+        self.outstanding = 0      # requests in flight
+        self.calls = 0            # requests sent so far
+        self.failures = 0         # failures in a row
+        self.drained_until = 0.0  # time.monotonic() until which the host is skipped
+        self.checked_at = None    # time.monotonic() of the last health check
+        self.last_error = None
+        self.checking = threading.Lock()
+    
+    def has_model(self, model):
+        if self.models is None or model is None: return True
+        return model in self.models or f"{model}:latest" in self.models
+
+
+class EndpointPool:
+    """
+    Route Ollama requests across several hosts.
+    
+    Example:
+    --------
+    pool = EndpointPool(["http://gpu1:11434", "http://gpu2:11434"])
+    response = pool.post({"model": "smollm2:1.7b", "messages": [...], "stream": False})
+    print(pool.status())
+    """
+    
+    def __init__(self, hosts, health_ttl=HEALTH_TTL, drain_seconds=DRAIN_SECONDS, max_drain_seconds=MAX_DRAIN_SECONDS):
+        self.endpoints = [OllamaEndpoint(h) for h in dict.fromkeys(hosts)]
+        if not self.endpoints: raise ValueError("EndpointPool needs at least one host.")
+        self.health_ttl = health_ttl
+        self.drain_seconds = drain_seconds
+        self.max_drain_seconds = max_drain_seconds
+        self._lock = threading.Lock()
+    
+    def check(self, endpoint):
+        """Health-check one host by listing its models. Returns True if it answered."""
+        try:
+            response = get_session().get(f"{endpoint.host}/api/tags", timeout=HEALTH_TIMEOUT)
+            response.raise_for_status()
+            names = {m.get("name") or m.get("model") for m in response.json().get("models", [])}
+        except Exception as e:
+            self.drain(endpoint, e)
+            return False
+        with self._lock:
+            endpoint.models = names
+            endpoint.drained_until = 0.0
+            endpoint.checked_at = time.monotonic()
+            endpoint.last_error = None
+        return True
+    
+    def check_all(self):
+        """Health-check every host in parallel and return status()."""
+        with ThreadPoolExecutor(max_workers=len(self.endpoints)) as executor:
+            list(executor.map(self.check, self.endpoints))
+        return self.status()
+    
+    def drain(self, endpoint, err):
+        """Take a failing host out of rotation for a growing period."""
+        with self._lock:
+            endpoint.failures += 1
+            wait = min(self.max_drain_seconds, self.drain_seconds * 2 ** (endpoint.failures - 1))
+            endpoint.drained_until = time.monotonic() + wait
+            endpoint.checked_at = None  # health-check again before it gets traffic
+            endpoint.last_error = str(err)
+    
+    def _refresh(self, exclude):
+        """Health-check hosts whose model list is stale or whose drain period is over."""
+        now = time.monotonic()
+        for endpoint in self.endpoints:
+            if endpoint in exclude or now < endpoint.drained_until: continue
+            stale = endpoint.checked_at is None or now - endpoint.checked_at > self.health_ttl
+            # Only one thread checks a host at a time; the others use what we know so far
+            if stale and endpoint.checking.acquire(blocking=False):
+                try:
+                    self.check(endpoint)
+                finally:
+                    endpoint.checking.release()
+    
+    def choose(self, model=None, exclude=()):
+        """
+        Reserve the healthy host with the fewest requests in flight that has `model`.
+        Call release() when the request is done.
+        """
+        self._refresh(exclude)
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints
+                          if e not in exclude and now >= e.drained_until and e.has_model(model)]
+            if candidates:
+                # Fewest in flight first; ties go to the host that has had fewer calls
+                endpoint = min(candidates, key=lambda e: (e.outstanding, e.calls))
+                endpoint.outstanding += 1
+                endpoint.calls += 1
+                return endpoint
+        raise RuntimeError(f"No healthy Ollama host has model '{model}'. Host status:\n{self.status()}")
+    
+    def release(self, endpoint, err=None, model=None):
+        """Finish a request reserved with choose(); drains the host if err shows it is unhealthy."""
+        with self._lock:
+            endpoint.outstanding -= 1
+            # A request that worked ends the host's run of failures
+            if err is None: endpoint.failures = 0
+        if err is None: return
+        if endpoint_failed(err):
+            self.drain(endpoint, err)
+        elif getattr(getattr(err, "response", None), "status_code", None) == 404 and endpoint.models is not None:
+            # "model not found": stop sending this model here until the next health check
+            with self._lock:
+                endpoint.models.discard(model)
+                endpoint.models.discard(f"{model}:latest")
+    
+    def _should_fail_over(self, err):
+        return endpoint_failed(err) or getattr(getattr(err, "response", None), "status_code", None) == 404
+    
+    def _post(self, body, stream):
+        """POST a /api/chat body, failing over to other hosts. Returns (endpoint, response), still reserved."""
+        model = body.get("model")
+        tried = []
+        while True:
+            try:
+                endpoint = self.choose(model, exclude=tried)
+            except RuntimeError:
+                if tried: raise last_error  # every host that had the model failed
+                raise
+            try:
+                response = get_session().post(endpoint.chat_url, json=body, stream=stream)
+                response.raise_for_status()
+            except Exception as e:
+                self.release(endpoint, e, model)
+                if not self._should_fail_over(e): raise
+                tried.append(endpoint)
+                last_error = e
+                continue
+            return endpoint, response
+    
+    def post(self, body):
+        """POST a /api/chat body, failing over to other hosts. Returns the requests response."""
+        endpoint, response = self._post(body, stream=False)
+        self.release(endpoint)
+        return response
+    
+    def post_stream(self, body):
+        """
+        Streaming version of post(). Returns (response, release): the host stays "in flight"
+        until release(err=None) is called, with the error if reading the stream failed.
+        """
+        endpoint, response = self._post(body, stream=True)
+        return response, functools.partial(self.release, endpoint, model=body.get("model"))
+    
+    async def post_async(self, client, body):
+        """Async version of post() using an httpx.AsyncClient (no streaming)."""
+        model = body.get("model")
+        tried = []
+        while True:
+            try:
+                endpoint = await asyncio.to_thread(self.choose, model, tried)
+            except RuntimeError:
+                if tried: raise last_error
+                raise
+            try:
+                response = await client.post(endpoint.chat_url, json=body)
+                response.raise_for_status()
+            except Exception as e:
+                self.release(endpoint, e, model)
+                if not self._should_fail_over(e): raise
+                tried.append(endpoint)
+                last_error = e
+                continue
+            self.release(endpoint)
+            return response
+    
+    def status(self):
+        """Return one row per host: healthy, outstanding, calls, failures, models, last_error."""
+        now = time.monotonic()
+        with self._lock:
+            rows = [{"host": e.host, "healthy": now >= e.drained_until, "outstanding": e.outstanding,
+                     "calls": e.calls, "failures": e.failures,
+                     "models": None if e.models is None else sorted(e.models), "last_error": e.last_error}
+                    for e in self.endpoints]
+        return pd.DataFrame(rows, columns=["host", "healthy", "outstanding", "calls", "failures", "models", "last_error"])
+
+
+ENDPOINTS = None  # the active EndpointPool, or None to use CHAT_URL only
+
+
+def use_endpoints(hosts=None, **kwargs):
+    """
+    Send every agent request through an EndpointPool of several Ollama hosts.
+    
+    Parameters:
+    -----------
+    hosts : list, optional
+        Host URLs like "http://gpu1:11434" (default: the comma-separated OLLAMA_HOSTS variable).
+        Pass an empty list to go back to the single CHAT_URL host.
+    **kwargs :
+        Passed to EndpointPool, e.g. health_ttl=60, drain_seconds=5
+    
+    Returns:
+    --------
+    EndpointPool or None
+        The active pool
+    """
+    global ENDPOINTS
+    if hosts is None: hosts = [h.strip() for h in os.getenv("OLLAMA_HOSTS", "").split(",") if h.strip()]
+    ENDPOINTS = EndpointPool(hosts, **kwargs) if hosts else None
+    return ENDPOINTS
+
+
+def endpoint_status():
+    """Return ENDPOINTS.status() as a DataFrame (None if no pool is in use)."""
+    return None if ENDPOINTS is None else ENDPOINTS.status()
+
+
+def send_chat(body):
+    """POST a /api/chat body to CHAT_URL or the endpoint pool and return the checked response."""
+    if ENDPOINTS is not None: return ENDPOINTS.post(body)
+    response = get_session().post(CHAT_URL, json=body)
+    response.raise_for_status()
+    return response
+
+
+def send_chat_stream(body):
+    """Streaming version of send_chat(). Returns (response, release); release is None without a pool."""
+    if ENDPOINTS is not None: return ENDPOINTS.post_stream(body)
+    response = get_session().post(CHAT_URL, json=body, stream=True)
+    response.raise_for_status()
+    return response, None
+
+
+async def send_chat_async(body):
+    """Async version of send_chat() (no streaming)."""
+    client = get_async_client()
+    if ENDPOINTS is not None: return await ENDPOINTS.post_async(client, body)
+    response = await client.post(CHAT_URL, json=body)
+    response.raise_for_status()
+    return response
+
+
+# Set OLLAMA_HOSTS=http://gpu1:11434,http://gpu2:11434 to use a pool in every script
+if os.getenv("OLLAMA_HOSTS", "").strip(): use_endpoints()
+
+## 0.8 Request Coalescing #################################
+
+# When we classify many texts in parallel, some are exact duplicates ("booo", "booo", ...).
+# Without coalescing, each duplicate sends its own request to Ollama at the same moment.
+# With "single-flight" coalescing, the first request goes to Ollama and identical requests
+# that arrive while it is still running wait for it and share its reply.
+# Only deterministic requests are shared (options.temperature set to 0, or a fixed seed), since
+# random ones are supposed to give different answers. Ollama samples at temperature 0.8
+# unless told otherwise, so a request with no options is random too.
+# Set AGENT_COALESCE=0 to turn it off.
+
+COALESCE = os.getenv("AGENT_COALESCE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def is_deterministic(body):
+    """
+    True if the same request body should always give the same reply: it sets a seed,
+    or sets options.temperature to 0. A missing temperature means Ollama's default (0.8), which samples.
+    """
+    options = body.get("options") or {}
+    if options.get("seed") is not None: return True
+    return options.get("temperature") is not None and options["temperature"] == 0
+
+
+class _LeaderCancelled(Exception):
+    """Tells SingleFlight.do_async() followers that the shared call was cancelled, not answered."""
+
+
+class SingleFlight:
+    """
+    Share one upstream call among identical requests that are in flight at the same time.
+    Each caller gets its own copy of the reply, so tool outputs added later don't leak between callers.
+    """
+    
+    def __init__(self):
+        self.upstream = 0   # calls that went to Ollama
+        self.coalesced = 0  # calls answered by another caller's request
+        self._calls = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key, fn):
+        """Return fn(), or the result of an identical call (same key) that is already running."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+                self.upstream += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None: raise call["error"]
+            return copy.deepcopy(call["result"])
+        try:
+            call["result"] = fn()
+            return copy.deepcopy(call["result"])
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock: del self._calls[key]
+            call["done"].set()
+    
+    async def do_async(self, key, fn):
+        """
+        Async version of do(): fn is a zero-argument function returning an awaitable.
+        If the caller making the request is cancelled, a waiting caller takes over and runs its own fn.
+        """
+        # asyncio futures belong to one event loop, so keep each loop's calls apart
+        key = (id(asyncio.get_running_loop()), key)
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = self._calls[key] = asyncio.get_running_loop().create_future()
+                    self.upstream += 1
+                else:
+                    self.coalesced += 1
+            if leader: break
+            try:
+                return copy.deepcopy(await asyncio.shield(future))
+            except _LeaderCancelled:
+                # Nobody answered this one after all; try again (probably as the new leader)
+                with self._lock: self.coalesced -= 1
+        try:
+            result = await fn()
+            future.set_result(result)
+            return copy.deepcopy(result)
+        except BaseException as e:
+            # Cancelling the leader must not cancel the callers waiting on it
+            future.set_exception(_LeaderCancelled() if isinstance(e, asyncio.CancelledError) else e)
+            future.exception()  # mark as retrieved, even if nobody else was waiting
+            raise
+        finally:
+            with self._lock: del self._calls[key]
+    
+    def stats(self):
+        """Return upstream calls, coalesced calls (= calls saved) and the share of calls saved."""
+        total = self.upstream + self.coalesced
+        return {"upstream_calls": self.upstream, "saved_calls": self.coalesced,
+                "saved_rate": self.coalesced / total if total else 0.0}
+    
+    def reset(self):
+        with self._lock:
+            self.upstream = 0
+            self.coalesced = 0
+
+
+SINGLE_FLIGHT = SingleFlight()
+
+
+def coalesce_stats():
+    """Return SINGLE_FLIGHT.stats(): upstream_calls, saved_calls and saved_rate."""
+    return SINGLE_FLIGHT.stats()
+
+
 # 1. AGENT FUNCTION ###################################
 
-def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
+def tool_args(raw):
+    """Parse tool call arguments, which Ollama may send as a JSON string or a dict."""
+    if raw is None: return {}
+    if isinstance(raw, str): return json.loads(raw) if raw.strip() else {}
+    return raw
+
+
+def run_tool_calls(tool_calls):
+    """Execute each tool call and store its result in tool_call["output"]."""
+    for tool_call in tool_calls:
+        # Execute the tool function
+        # Note: Tool functions must be defined in the global scope
+        func_name = tool_call["function"]["name"]
+        func_args = tool_args(tool_call["function"].get("arguments"))
+        
+        # Get the function from globals and execute it
+        func = globals().get(func_name)
+        if func:
+            tool_call["output"] = func(**func_args)
+    return tool_calls
+
+
+def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False, stream=False, format=None,
+          options=None):
     """
     Agent wrapper function that runs a single agent, with or without tools.
     
@@ -44,6 +916,14 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
         List of tool metadata dictionaries for function calling
     all : bool
         If True, return all responses. If False, return only the last response.
+    stream : bool
+        If True, return an AgentStream that yields the reply piece by piece (default: False).
+        Can't be combined with all=True or another output; read the stream's .message instead
+    format : dict or str, optional
+        A JSON schema (or "json") that Ollama must follow when writing the reply
+    options : dict, optional
+        Ollama model options, e.g. {"temperature": 0}. With temperature 0 (or a seed),
+        identical requests can share one call and be cached
     
     Returns:
     --------
@@ -51,6 +931,11 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
         The agent's response(s)
     """
     
+    # Streaming mode: hand back an iterator of text pieces instead of waiting for the full reply
+    if stream:
+        _check_stream_args(all, output)
+        return agent_stream(messages, model=model, tools=tools, options=options, format=format)
+    
     # If the agent has NO tools, perform a standard chat
     if tools is None:
         body = {
@@ -58,10 +943,10 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
             "messages": messages,
             "stream": False
         }
+        if format is not None: body["format"] = format
+        if options: body["options"] = options
         
-        response = requests.post(CHAT_URL, json=body)
-        response.raise_for_status()
-        result = response.json()
+        result = post_chat(body)
         
         return result["message"]["content"]
     else:
@@ -72,25 +957,15 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
             "tools": tools,
             "stream": False
         }
+        if format is not None: body["format"] = format
+        if options: body["options"] = options
         
-        response = requests.post(CHAT_URL, json=body)
-        response.raise_for_status()
-        result = response.json()
+        result = post_chat(body)
         
         # For any given tool call, execute the tool call
         if "tool_calls" in result.get("message", {}):
             tool_calls = result["message"]["tool_calls"]
-            for tool_call in tool_calls:
-                # Execute the tool function
-                # Note: Tool functions must be defined in the global scope
-                func_name = tool_call["function"]["name"]
-                func_args = json.loads(tool_call["function"]["arguments"])
-                
-                # Get the function from globals and execute it
-                func = globals().get(func_name)
-                if func:
-                    output = func(**func_args)
-                    tool_call["output"] = output
+            run_tool_calls(tool_calls)
         
         if all:
             return result
@@ -101,7 +976,7 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
             return result["message"]["content"]
 
 
-def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL):
+def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL, stream=False, format=None, options=None):
     """
     Run an agent with a specific role and task.
     
@@ -117,6 +992,13 @@ def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL):
         Output format (default: "text")
     model : str
         Model to use (default: DEFAULT_MODEL)
+    stream : bool
+        If True, return an AgentStream of text pieces (default: False)
+    format : dict or str, optional
+        A JSON schema (or "json") that Ollama must follow when writing the reply
+    options : dict, optional
+        Ollama model options, e.g. {"temperature": 0}. With temperature 0 (or a seed),
+        identical requests can share one call and be cached
     
     Returns:
     --------
@@ -131,34 +1013,845 @@ def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL):
     ]
     
     # Run the agent
-    resp = agent(messages=messages, model=model, output=output, tools=tools)
+    resp = agent(messages=messages, model=model, output=output, tools=tools, stream=stream, format=format,
+                 options=options)
     return resp
 
 
-# 2. DATA CONVERSION FUNCTION ###################################
+# 2. ASYNC AGENT FUNCTIONS ###################################
+
+# agent() waits for each reply before sending the next request.
+# With asyncio, one Python process can keep hundreds of requests "in flight" at once,
+# without needing one thread per request. Call these from async code,
+# or from a regular script with asyncio.run(...).
+
+# Maximum number of open connections for the async client
+ASYNC_MAX_CONNECTIONS = int(os.getenv("OLLAMA_ASYNC_MAX_CONNECTIONS", "200"))
+ASYNC_TIMEOUT = 300  # seconds
+
+_async_clients = {}  # one pooled httpx.AsyncClient per event loop
 
-def df_as_text(df):
+
+def get_async_client():
+    """Return the pooled httpx.AsyncClient for the running event loop."""
+    if httpx is None:
+        raise ImportError("The async agent helpers need httpx. Install it with: pip install httpx")
+    loop = asyncio.get_running_loop()
+    # Async clients belong to one event loop, so forget clients from finished loops
+    for old_loop in [l for l in _async_clients if l.is_closed()]:
+        del _async_clients[old_loop]
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_MAX_CONNECTIONS)
+        client = httpx.AsyncClient(limits=limits, timeout=ASYNC_TIMEOUT)
+        _async_clients[loop] = client
+    return client
+
+
+async def run_tool_calls_async(tool_calls):
+    """
+    Async version of run_tool_calls().
+    Async tool functions are awaited; regular ones run in a worker thread
+    so a slow tool does not block other requests.
+    """
+    for tool_call in tool_calls:
+        func = globals().get(tool_call["function"]["name"])
+        if func:
+            func_args = tool_args(tool_call["function"].get("arguments"))
+            if asyncio.iscoroutinefunction(func):
+                tool_call["output"] = await func(**func_args)
+            else:
+                tool_call["output"] = await asyncio.to_thread(func, **func_args)
+    return tool_calls
+
+
+async def agent_async(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False, stream=False, format=None,
+                      options=None):
     """
-    Convert a pandas DataFrame to a markdown table string.
+    Async version of agent(). Same parameters and return values.
+    Tool functions are looked up in the global scope, like agent().
+    
+    With stream=True, returns an AsyncAgentStream to use with `async for`.
+    
+    Returns:
+    --------
+    str or dict
+        The agent's response (or the full result if all=True)
+    """
+    
+    if stream:
+        _check_stream_args(all, output)
+        return AsyncAgentStream(stream_body(messages, model, tools, options, format), tools=tools)
+    
+    body = {"model": model, "messages": messages, "stream": False}
+    if tools is not None: body["tools"] = tools
+    if format is not None: body["format"] = format
+    if options: body["options"] = options
+    if MODEL_KEEP_ALIVE is not None: body["keep_alive"] = MODEL_KEEP_ALIVE
+    
+    # Check the response cache first (when turned on)
+    cache = _cache
+    result = cache.get(body) if cache is not None else None
+    if result is None:
+        async def call():
+            start = time.perf_counter()
+            result = (await send_chat_async(body)).json()
+            METRICS.record(result, model=model, site="agent_async", wall_seconds=time.perf_counter() - start)
+            if cache is not None: cache.put(body, result)
+            return result
+        
+        # Identical deterministic requests already in flight share one Ollama call
+        if COALESCE and is_deterministic(body): result = await SINGLE_FLIGHT.do_async(ResponseCache.key(body), call)
+        else: result = await call()
+    
+    # No tools: just return the text
+    if tools is None:
+        return result["message"]["content"]
+    
+    # For any given tool call, execute the tool call
+    tool_calls = result.get("message", {}).get("tool_calls")
+    await run_tool_calls_async(tool_calls or [])
+    
+    if all:
+        return result
+    # Return the last tool call output or the message content
+    if tool_calls:
+        return tool_calls[-1].get("output", result["message"]["content"])
+    return result["message"]["content"]
+
+
+async def agent_run_async(role, task, tools=None, output="text", model=DEFAULT_MODEL, stream=False, format=None,
+                          options=None):
+    """Async version of agent_run(). Same parameters and return value."""
+    messages = [
+        {"role": "system", "content": role},
+        {"role": "user", "content": task}
+    ]
+    return await agent_async(messages=messages, model=model, output=output, tools=tools, stream=stream, format=format,
+                             options=options)
+
+
+async def agent_gather(tasks, max_concurrency=50, return_exceptions=False):
+    """
+    Run many async agent calls concurrently and return results in input order.
+    
+    Parameters:
+    -----------
+    tasks : list
+        Awaitables like agent_run_async(...), or zero-argument functions that return one
+    max_concurrency : int
+        Maximum number of requests in flight at the same time (default: 50)
+    return_exceptions : bool
+        If True, failed tasks return their exception instead of raising (default: False)
+    
+    Returns:
+    --------
+    list
+        One result per task, in the same order as tasks
+    
+    Example:
+    --------
+    results = asyncio.run(agent_gather([agent_run_async(role, t) for t in texts], max_concurrency=100))
+    """
+    
+    # A semaphore lets only max_concurrency tasks run at once; the rest wait their turn
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def limited(task):
+        async with semaphore:
+            return await (task() if callable(task) else task)
+    
+    return await asyncio.gather(*(limited(t) for t in tasks), return_exceptions=return_exceptions)
+
+
+# 3. STREAMING AGENT FUNCTIONS ###################################
+
+# By default, agent() waits until the model has written its whole reply.
+# With stream=True, Ollama sends the reply in small pieces, one JSON object per line ("NDJSON"),
+# so we can print (or render in a dashboard) each piece as soon as it arrives.
+
+
+def stream_body(messages, model=DEFAULT_MODEL, tools=None, options=None, format=None):
+    """Build the /api/chat request body for a streaming call."""
+    body = {"model": model, "messages": messages, "stream": True}
+    if tools is not None: body["tools"] = tools
+    if options: body["options"] = options
+    if format is not None: body["format"] = format
+    if MODEL_KEEP_ALIVE is not None: body["keep_alive"] = MODEL_KEEP_ALIVE
+    return body
+
+
+class AgentStream:
+    """
+    Iterator over the text pieces of a streaming agent reply.
+    
+    After the loop finishes:
+    - .message is the full assistant message (content, plus tool_calls with their outputs)
+    - .text is the full reply text
+    - .stats has time_to_first_token (s), tokens_per_sec, eval_count and total_time (s)
+    
+    The stream holds an open connection (and, with an endpoint pool, a host's slot) until
+    it is read to the end, fails, or is closed. If you may stop early, call .close()
+    or use it as a context manager; it is also closed when garbage collected.
+    
+    Example:
+    --------
+    with agent_run(role, task, stream=True) as stream:
+        for piece in stream: print(piece, end="", flush=True)
+    print(stream.stats)
+    """
+    
+    def __init__(self, lines=None, tools=None, start=None, response=None, release=None):
+        self.lines = lines if lines is not None or response is None else response.iter_lines()
+        self.tools = tools
+        self._response = response
+        self._release = release
+        self.message = {"role": "assistant", "content": ""}
+        self.stats = {}
+        self._start = start if start is not None else time.perf_counter()
+        self._first = None
+        self._n_pieces = 0
+    
+    @property
+    def text(self):
+        return self.message["content"]
+    
+    def _add_chunk(self, line):
+        """Fold one NDJSON line into .message and return its new text ("" if none)."""
+        if not line: return ""
+        chunk = json.loads(line)
+        if "error" in chunk: raise RuntimeError(f"Ollama stream error: {chunk['error']}")
+        msg = chunk.get("message") or {}
+        # Tool calls arrive whole inside a chunk; collect them across chunks
+        if msg.get("tool_calls"):
+            self.message.setdefault("tool_calls", []).extend(msg["tool_calls"])
+        piece = msg.get("content") or ""
+        if piece:
+            if self._first is None: self._first = time.perf_counter()
+            self._n_pieces += 1
+            self.message["content"] += piece
+        # The last chunk carries Ollama's own token counts and timings
+        if chunk.get("done"): self._finish(chunk)
+        return piece
+    
+    def _finish(self, final):
+        end = time.perf_counter()
+        eval_count = final.get("eval_count") or self._n_pieces
+        # Prefer Ollama's generation time (nanoseconds); otherwise time it ourselves
+        eval_seconds = (final.get("eval_duration") or 0) / 1e9
+        if eval_seconds <= 0 and self._first is not None: eval_seconds = end - self._first
+        self.stats = {
+            "time_to_first_token": None if self._first is None else self._first - self._start,
+            "tokens_per_sec": eval_count / eval_seconds if eval_seconds > 0 else None,
+            "eval_count": eval_count,
+            "total_time": end - self._start,
+        }
+        METRICS.record(final, model=final.get("model"), site="agent_stream", wall_seconds=end - self._start)
+    
+    def close(self, error=None):
+        """Close the HTTP response and free its pool slot; error (if any) counts against the host."""
+        response, self._response = getattr(self, "_response", None), None
+        release, self._release = getattr(self, "_release", None), None
+        try:
+            if response is not None: response.close()
+        finally:
+            if release is not None: release(error)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def __del__(self):
+        self.close()
+    
+    def __iter__(self):
+        try:
+            for line in self.lines:
+                piece = self._add_chunk(line)
+                if piece: yield piece
+        except Exception as e:
+            self.close(e)
+            raise
+        finally:
+            self.close()
+        if self.message.get("tool_calls"): run_tool_calls(self.message["tool_calls"])
+
+
+class AsyncAgentStream(AgentStream):
+    """Async version of AgentStream. Use with `async for piece in stream:`."""
+    
+    def __init__(self, body, tools=None):
+        super().__init__(tools=tools)
+        self.body = body
+    
+    def __iter__(self):
+        raise TypeError("AsyncAgentStream must be read with `async for`.")
+    
+    async def __aiter__(self):
+        self._start = time.perf_counter()
+        endpoint = await asyncio.to_thread(ENDPOINTS.choose, self.body.get("model")) if ENDPOINTS is not None else None
+        error = None
+        try:
+            url = endpoint.chat_url if endpoint is not None else CHAT_URL
+            async with get_async_client().stream("POST", url, json=self.body) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    piece = self._add_chunk(line)
+                    if piece: yield piece
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if endpoint is not None: ENDPOINTS.release(endpoint, error, self.body.get("model"))
+        if self.message.get("tool_calls"): await run_tool_calls_async(self.message["tool_calls"])
+
+
+def _check_stream_args(all, output):
+    """Streams always yield text pieces, so reject the agent() settings that ask for something else."""
+    if all or output != "text":
+        raise ValueError("stream=True returns an AgentStream of text pieces and can't be combined with "
+                         "all=True or output other than 'text'; read stream.message after the loop instead.")
+
+
+def agent_stream(messages, model=DEFAULT_MODEL, tools=None, options=None, format=None):
+    """
+    Start a streaming chat and return an AgentStream of text pieces.
+    Same as agent(messages, model=model, tools=tools, stream=True, options=options, format=format).
+    
+    Returns:
+    --------
+    AgentStream
+        Iterate over it to get the reply piece by piece; see .message and .stats afterwards
+    """
+    start = time.perf_counter()
+    response, release = send_chat_stream(stream_body(messages, model, tools, options, format))
+    return AgentStream(tools=tools, start=start, response=response, release=release)
+
+
+# 4. BATCH AGENT FUNCTIONS ###################################
+
+# Classifying hundreds of texts means hundreds of agent_run() calls.
+# agent_map() runs them on a pool of threads, while:
+# - a "token bucket" caps how many requests start per second (rps_limit)
+# - busy (429) or failing (5xx) servers are retried with randomized, growing waits
+# - one failed item records its error instead of stopping the whole batch
+# - optionally (adaptive=True), an AdaptiveLimiter finds how many requests
+#   Ollama can take at once: it adds parallelism while latency stays flat,
+#   and backs off when latency rises or the server says it's busy
+# - optionally (schema=...), Ollama must answer in JSON that matches a schema;
+#   replies that don't are sent back for another try, and good ones are kept
+
+
+class TokenBucket:
+    """
+    Rate limiter: holds up to `capacity` tokens, refilled at `rate` tokens per second.
+    Each request takes one token, waiting if the bucket is empty.
+    """
+    
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_retryable(err):
+    """True for errors worth retrying: connection problems, timeouts, 429 and 5xx responses."""
+    if isinstance(err, (requests.ConnectionError, requests.Timeout)): return True
+    if httpx is not None and isinstance(err, httpx.TransportError): return True
+    response = getattr(err, "response", None)
+    status = getattr(response, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def retry_delay(err, attempt, base=0.5, cap=30.0):
+    """Seconds to wait before retry number `attempt` (1, 2, ...): the server's Retry-After, or jittered backoff."""
+    response = getattr(err, "response", None)
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit(): return min(cap, float(retry_after))
+    # "Full jitter": a random wait up to an exponentially growing cap,
+    # so many threads don't all retry at the same moment
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_overload(err):
+    """True for errors that mean the server is overloaded: 429, 503, 504 or a timeout."""
+    if isinstance(err, requests.Timeout): return True
+    if httpx is not None and isinstance(err, httpx.TimeoutException): return True
+    response = getattr(err, "response", None)
+    return getattr(response, "status_code", None) in (429, 503, 504)
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that adapts to the server, like TCP congestion control.
+    
+    Latency is averaged over windows of requests (single LLM calls vary too much to compare).
+    - While the window's average latency stays within `tolerance` x the fastest window so far,
+      the limit grows (by about sqrt(limit) per window)
+    - As latency rises (requests are queueing inside Ollama), the limit shrinks in proportion
+    - A 429, 503, 504 or timeout cuts the limit in half right away
+    
+    Use it around each request: limiter.acquire() before, limiter.release(seconds, error) after,
+    or wrap a function with limiter.wrap(fn). Start the thread pool with max_workers=max_limit;
+    the limiter decides how many of those threads may call the server at once.
+    """
+    
+    def __init__(self, initial=2, min_limit=1, max_limit=32, tolerance=1.3, smoothing=0.5, backoff=0.5, window=10):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance  # latency may grow to tolerance x the baseline before we shrink
+        self.smoothing = smoothing  # how far the limit moves toward its new target each window
+        self.backoff = backoff      # multiply the limit by this on overload
+        self.window = window        # minimum requests per latency window
+        self.inflight = 0
+        self.min_latency = None     # fastest window average: the "no queueing" baseline
+        self.avg_latency = None     # latest window average
+        self.completed = 0
+        self.overloads = 0
+        self.history = []           # limit after each window
+        self._samples = []
+        self._peak = 0              # most requests in flight during this window
+        self._cond = threading.Condition()
+    
+    def acquire(self):
+        """Wait until fewer than `limit` requests are in flight, then take a slot."""
+        with self._cond:
+            while self.inflight >= max(self.min_limit, int(self.limit)):
+                self._cond.wait()
+            self.inflight += 1
+            self._peak = max(self._peak, self.inflight)
+    
+    def release(self, seconds, error=None):
+        """Give back a slot and update the limit from this request's latency (seconds) or error."""
+        with self._cond:
+            self.inflight -= 1
+            if error is not None:
+                if is_overload(error):
+                    self.overloads += 1
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._samples, self._peak = [], self.inflight
+                    self.history.append(self.limit)
+            else:
+                self.completed += 1
+                self._samples.append(seconds)
+                if len(self._samples) >= max(self.window, int(self.limit)): self._update()
+            self._cond.notify_all()
+    
+    def _update(self):
+        """End a window: compare its average latency with the baseline and move the limit."""
+        self.avg_latency = sum(self._samples) / len(self._samples)
+        # Let the baseline drift up slowly, so it can follow a server that got slower
+        self.min_latency = self.avg_latency if self.min_latency is None else min(self.avg_latency, self.min_latency * 1.002)
+        gradient = max(0.5, min(1.0, self.tolerance * self.min_latency / self.avg_latency))
+        target = self.limit * gradient + self.limit ** 0.5
+        # Only grow if we actually used most of the current limit
+        if self._peak < self.limit / 2: target = min(target, self.limit)
+        self.limit += self.smoothing * (target - self.limit)
+        self.limit = min(self.max_limit, max(self.min_limit, self.limit))
+        self.history.append(self.limit)
+        self._samples, self._peak = [], self.inflight
+    
+    def wrap(self, fn):
+        """Return a version of fn that runs inside the limiter."""
+        def limited(*args, **kwargs):
+            self.acquire()
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.release(time.perf_counter() - start, e)
+                raise
+            self.release(time.perf_counter() - start)
+            return result
+        return limited
+    
+    def stats(self):
+        """Return the current and settled limit (median of the last 20 windows), latencies and counters."""
+        with self._cond:
+            recent = sorted(self.history[-20:])
+            return {
+                "limit": int(self.limit),
+                "settled_limit": int(recent[len(recent) // 2]) if recent else int(self.limit),
+                "max_limit_seen": int(max(self.history)) if self.history else int(self.limit),
+                "baseline_ms": None if self.min_latency is None else round(self.min_latency * 1000, 1),
+                "recent_ms": None if self.avg_latency is None else round(self.avg_latency * 1000, 1),
+                "completed": self.completed,
+                "overloads": self.overloads,
+            }
+
+
+# Structured output: pass a JSON schema as Ollama's `format`, and the model is constrained
+# to write JSON with that shape. Small models still slip sometimes (a missing field,
+# a label outside the enum), so agent_map() checks every reply with a validator compiled
+# once per batch. Only the items that fail go back in the queue, with the model's bad reply
+# and the list of problems, for at most schema_retries more rounds.
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a reply is not JSON that matches the requested schema."""
+
+
+def _type_ok(value, kind):
+    """Check one value against a JSON schema type name."""
+    if kind == "integer": return isinstance(value, int) and not isinstance(value, bool) or (isinstance(value, float) and value.is_integer())
+    if kind == "number": return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind == "string": return isinstance(value, str)
+    if kind == "boolean": return isinstance(value, bool)
+    if kind == "array": return isinstance(value, list)
+    if kind == "object": return isinstance(value, dict)
+    if kind == "null": return value is None
+    return True  # unknown types are not checked
+
+
+def compile_validator(schema, root="value"):
+    """
+    Turn a JSON schema into a function that returns a list of error messages (empty = valid).
+    Uses the jsonschema package when it is installed; otherwise checks type, required,
+    properties, enum, minimum/maximum and items, which covers tool and output schemas.
+    `root` names the checked value in messages (e.g. "arguments" or "output").
+    The same validator is in 08_function_calling/functions.py; keep the two copies in sync.
+    """
+    if jsonschema is not None:
+        checker = jsonschema.validators.validator_for(schema)(schema)
+        return lambda value: [e.message for e in checker.iter_errors(value)]
+    
+    def build(sub, path):
+        checks = []
+        kinds = sub.get("type")
+        if kinds is not None:
+            kinds = kinds if isinstance(kinds, list) else [kinds]
+            checks.append(lambda v: [] if any(_type_ok(v, k) for k in kinds) else [f"{path}: expected {' or '.join(kinds)}, got {type(v).__name__}"])
+        if "enum" in sub:
+            options = sub["enum"]
+            checks.append(lambda v: [] if v in options else [f"{path}: {v!r} is not one of {options}"])
+        if "minimum" in sub or "maximum" in sub:
+            lo, hi = sub.get("minimum"), sub.get("maximum")
+            def check_range(v):
+                if not _type_ok(v, "number"): return []
+                if lo is not None and v < lo: return [f"{path}: {v} is less than the minimum of {lo}"]
+                if hi is not None and v > hi: return [f"{path}: {v} is greater than the maximum of {hi}"]
+                return []
+            checks.append(check_range)
+        required = sub.get("required") or []
+        props = {k: build(s, f"{path}.{k}") for k, s in (sub.get("properties") or {}).items()}
+        if required or props:
+            def check_object(v):
+                if not isinstance(v, dict): return []
+                errs = [f"{path}: missing required field '{k}'" for k in required if k not in v]
+                for k, check in props.items():
+                    if k in v: errs += check(v[k])
+                return errs
+            checks.append(check_object)
+        if "items" in sub:
+            check_item = build(sub["items"], f"{path}[]")
+            checks.append(lambda v: [e for item in v for e in check_item(item)] if isinstance(v, list) else [])
+        return lambda v: [e for check in checks for e in check(v)]
+    
+    return build(schema, root)
+
+
+def parse_structured(text, validate):
+    """Parse a JSON reply and check it with validate(); returns the value or raises StructuredOutputError."""
+    try:
+        value = json.loads(text)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise StructuredOutputError(f"reply is not valid JSON: {e}") from None
+    errors = validate(value)
+    if errors: raise StructuredOutputError("; ".join(errors))
+    return value
+
+
+def repair_messages(role, task, reply, err):
+    """Messages for another try: the original request, the model's bad reply, and what was wrong with it."""
+    return [
+        {"role": "system", "content": role},
+        {"role": "user", "content": task},
+        {"role": "assistant", "content": str(reply)},
+        {"role": "user", "content": f"That reply did not match the required JSON schema ({err}). "
+                                    "Answer again with JSON only."},
+    ]
+
+
+def agent_map(role, tasks, model=DEFAULT_MODEL, max_workers=10, rps_limit=None, retries=3,
+              tools=None, output="text", progress=None, adaptive=False, schema=None, schema_retries=2,
+              format=None, options=None):
+    """
+    Run agent_run(role, task) for every task in parallel and return results in input order.
+    
+    Parameters:
+    -----------
+    role : str
+        The system prompt shared by every task
+    tasks : list
+        The user messages/tasks, one per item
+    model : str
+        Model to use (default: DEFAULT_MODEL)
+    max_workers : int
+        Number of threads sending requests at the same time (default: 10);
+        with adaptive=True, the most the limiter may use
+    rps_limit : float, optional
+        Maximum requests started per second, across all threads (default: no limit)
+    retries : int
+        Extra attempts for an item after a 429, 5xx or connection error (default: 3)
+    tools : list, optional
+        List of tool metadata for function calling
+    output : str
+        Output format (default: "text")
+    progress : function, optional
+        Called as progress(n_done, n_total, row) after each item finishes
+    adaptive : bool or AdaptiveLimiter
+        If True, adapt the number of requests in flight (up to max_workers) to Ollama's latency.
+        Pass an AdaptiveLimiter to choose its settings or reuse it across batches (default: False)
+    schema : dict, optional
+        JSON schema for structured output. It is sent as Ollama's `format`, every reply is parsed
+        and validated, and result holds the parsed JSON instead of text (default: None)
+    schema_retries : int
+        Extra rounds for items whose reply did not match the schema (default: 2).
+        Items that still don't match keep a StructuredOutputError in error.
+    format : dict or str, optional
+        Sent as Ollama's `format` without checking the replies (schema=... sets it for you)
+    options : dict, optional
+        Ollama model options for every request, e.g. {"temperature": 0} so repeated tasks
+        share one call (and hit the cache, when it is on)
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per task, in input order, with columns:
+        task, result, error (None if it worked), attempts, seconds.
+        With adaptive, df.attrs["concurrency"] holds the limiter's stats(), including settled_limit.
+        With schema, df.attrs["structured"] counts the items that were re-queued and that stayed invalid.
+    """
+    
+    tasks = list(tasks)
+    bucket = TokenBucket(rps_limit) if rps_limit else None
+    limiter = adaptive if isinstance(adaptive, AdaptiveLimiter) else AdaptiveLimiter(max_limit=max_workers) if adaptive else None
+    validate = compile_validator(schema, root="output") if schema is not None else None
+    format = schema if schema is not None else format
+    rows = [None] * len(tasks)
+    repairs = {}  # item -> messages for its next try, after a reply that didn't match the schema
+    done = [0]
+    done_lock = threading.Lock()
+    
+    def ask(i):
+        if i in repairs: return agent(messages=repairs[i], model=model, output=output, tools=tools, format=format,
+                                      options=options)
+        return agent_run(role=role, task=tasks[i], tools=tools, output=output, model=model, format=format,
+                         options=options)
+    
+    call = limiter.wrap(ask) if limiter is not None else ask
+    
+    def run_one(i, last=True):
+        start = time.perf_counter()
+        row = rows[i] or {"task": tasks[i], "result": None, "error": None, "attempts": 0, "seconds": 0.0}
+        for attempt in range(retries + 1):
+            if bucket is not None: bucket.acquire()
+            row["attempts"] += 1
+            try:
+                row["result"] = call(i)
+                row["error"] = None
+                break
+            except Exception as e:
+                row["error"] = e
+                if attempt == retries or not is_retryable(e): break
+                time.sleep(retry_delay(e, attempt + 1))
+        if validate is not None and row["error"] is None:
+            try:
+                row["result"] = parse_structured(row["result"], validate)
+            except StructuredOutputError as e:
+                row["error"] = e
+                repairs[i] = repair_messages(role, tasks[i], row["result"], e)
+        row["seconds"] += time.perf_counter() - start
+        rows[i] = row
+        # An item that will be re-queued isn't finished yet
+        if progress is not None and (last or not isinstance(row["error"], StructuredOutputError)):
+            with done_lock:
+                done[0] += 1
+                progress(done[0], len(tasks), row)
+    
+    # Round 0 runs every item; later rounds re-queue only the items whose reply didn't match the schema
+    rounds = 1 + (schema_retries if validate is not None else 0)
+    pending = list(range(len(tasks)))
+    requeued = set()
+    for r in range(rounds):
+        if r > 0: requeued.update(pending)
+        last = r == rounds - 1
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending) or 1))) as executor:
+            list(executor.map(lambda i: run_one(i, last), pending))
+        pending = [i for i in pending if isinstance(rows[i]["error"], StructuredOutputError)]
+        if not pending: break
+    
+    df = pd.DataFrame(rows, columns=["task", "result", "error", "attempts", "seconds"])
+    if limiter is not None: df.attrs["concurrency"] = limiter.stats()
+    if validate is not None:
+        df.attrs["structured"] = {"requeued": len(requeued), "invalid": len(pending)}
+    return df
+
+
+# 5. DATA CONVERSION FUNCTION ###################################
+
+# Markdown tables are easy to read, but the padding spaces, pipes and dashes
+# cost prompt tokens, and every token makes Ollama's prompt evaluation slower.
+# df_as_text() can also write more compact encodings:
+# - "csv" / "tsv": one line per row, no padding
+# - "json": column-oriented JSON, {"column": [values, ...], ...}
+# - "dict": TSV where repeated text values (like a category) are replaced by short codes,
+#   with a small dictionary of codes above the table
+# With max_tokens, rows are sampled (or summarized) until the text fits the budget.
+# df_text_report() compares the estimated tokens of every encoding for a DataFrame.
+
+TEXT_FORMATS = ("markdown", "csv", "tsv", "json", "dict")
+CHARS_PER_TOKEN = 4  # rough average for English text and numbers
+
+
+def estimate_tokens(text):
+    """Rough token count for a string (about 4 characters per token)."""
+    return -(-len(text) // CHARS_PER_TOKEN)  # round up
+
+
+def _dict_encode(df, max_share=0.5):
+    """Replace repeated text values with integer codes; return (code legend text, coded DataFrame)."""
+    coded = df.copy()
+    legend = []
+    for col in df.columns:
+        values = df[col]
+        if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)
+                or isinstance(values.dtype, pd.CategoricalDtype)):
+            continue
+        n_unique = values.nunique(dropna=True)
+        # Only worth it when values repeat
+        if n_unique == 0 or n_unique > max_share * len(values): continue
+        codes = {v: i for i, v in enumerate(pd.unique(values.dropna()))}
+        coded[col] = values.map(codes).astype("Int64")
+        legend.append(f"{col}: " + "; ".join(f"{i}={v}" for v, i in codes.items()))
+    return "\n".join(legend), coded
+
+
+def _encode(df, format):
+    """Write a DataFrame as text in one of TEXT_FORMATS."""
+    if format == "markdown": return df.to_markdown(index=False)
+    if format == "csv": return df.to_csv(index=False).strip()
+    if format == "tsv": return df.to_csv(index=False, sep="\t").strip()
+    if format == "json":
+        return json.dumps({col: df[col].tolist() for col in df.columns},
+                          default=str, ensure_ascii=False, separators=(",", ":"))
+    if format == "dict":
+        legend, coded = _dict_encode(df)
+        table = coded.to_csv(index=False, sep="\t").strip()
+        return f"Codes:\n{legend}\n\n{table}" if legend else table
+    raise ValueError(f"format must be one of {TEXT_FORMATS}, not {format!r}")
+
+
+def _summarize_df(df):
+    """Aggregate a DataFrame into a short summary: numeric statistics plus the top text values."""
+    parts = [f"{len(df)} rows summarized."]
+    numeric = df.select_dtypes("number")
+    if not numeric.empty:
+        parts.append(numeric.describe().T[["count", "mean", "min", "max"]].round(3).reset_index(names="column"))
+    for col in df.columns.drop(numeric.columns):
+        top = df[col].astype(str).value_counts().head(5)
+        parts.append(f"{col} (top values): " + "; ".join(f"{v} ({n})" for v, n in top.items()))
+    return parts
+
+
+def df_as_text(df, format="markdown", max_tokens=None, reduce="sample"):
+    """
+    Convert a pandas DataFrame to a text table for a prompt.
     
     Parameters:
     -----------
     df : pandas.DataFrame
         The DataFrame to convert to text
+    format : str
+        One of "markdown" (default), "csv", "tsv", "json" (column-oriented) or "dict" (coded categories)
+    max_tokens : int, optional
+        Estimated token budget for the text (default: no limit)
+    reduce : str
+        How to fit max_tokens: "sample" keeps evenly spaced rows, "aggregate" summarizes the columns
+        (only the first ones, if the summary of every column is still too long)
     
     Returns:
     --------
     str
-        A markdown-formatted table string
+        The table as text (with a note saying how many rows are shown, if it was reduced)
+    """
+    
+    text = _encode(df, format)
+    if max_tokens is None or estimate_tokens(text) <= max_tokens: return text
+    
+    if reduce == "aggregate":
+        # A wide frame's summary can itself be too long: then summarize only the first columns
+        def summarized(n):
+            parts = _summarize_df(df.iloc[:, :n])
+            summary = "\n".join(_encode(p, format) if isinstance(p, pd.DataFrame) else p for p in parts)
+            if n == len(df.columns): return summary
+            return f"(summarizing {n} of {len(df.columns)} columns)\n{summary}"
+        
+        summary = summarized(len(df.columns))
+        if estimate_tokens(summary) <= max_tokens: return summary
+        return _largest_fit(summarized, len(df.columns) - 1, max_tokens)
+    if reduce != "sample": raise ValueError("reduce must be 'sample' or 'aggregate'")
+    if len(df) < 2: return text
+    
+    def sampled(n):
+        rows = sorted({round(i * (len(df) - 1) / max(1, n - 1)) for i in range(n)}) if n > 1 else [0]
+        note = f"(showing {n} of {len(df)} rows, evenly sampled)"
+        return f"{note}\n{_encode(df.iloc[rows], format)}"
+    
+    return _largest_fit(sampled, len(df) - 1, max_tokens)
+
+
+def _largest_fit(build, n_max, max_tokens):
+    """Binary search for the largest n (1..n_max) whose build(n) fits max_tokens; build(1) if none does."""
+    lo, hi, best = 1, n_max, build(1)
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        candidate = build(mid)
+        if estimate_tokens(candidate) <= max_tokens:
+            best, lo = candidate, mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+
+def df_text_report(df, formats=TEXT_FORMATS):
     """
+    Compare the estimated prompt tokens of each text encoding of a DataFrame.
     
-    # Convert DataFrame to markdown table
-    # pandas to_markdown() method creates markdown tables
-    tab = df.to_markdown(index=False)
-    return tab
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per format: format, chars, est_tokens, vs_markdown (share of the markdown tokens)
+    """
+    rows = []
+    for format in formats:
+        text = _encode(df, format)
+        rows.append({"format": format, "chars": len(text), "est_tokens": estimate_tokens(text)})
+    report = pd.DataFrame(rows)
+    base = estimate_tokens(_encode(df, "markdown"))
+    report["vs_markdown"] = (report["est_tokens"] / base).round(3) if base else None
+    return report.sort_values("est_tokens", ignore_index=True)
 
 
-# 3. API FUNCTION ###################################
+# 6. API FUNCTION ###################################
 
 def get_shortages(category="Psychiatry", limit=500):
     """
@@ -188,7 +1881,7 @@ def get_shortages(category="Psychiatry", limit=500):
     }
     
     # Perform the request
-    response = requests.get(url, params=params, headers={"Accept": "application/json"})
+    response = get_session().get(url, params=params, headers={"Accept": "application/json"})
     response.raise_for_status()
     
     # Parse the response as JSON
@@ -216,3 +1909,328 @@ def get_shortages(category="Psychiatry", limit=500):
         df["update_date"] = pd.to_datetime(df["update_date"], format="%m/%d/%Y", errors="coerce")
     
     return df
+
+
+# 7. AGENT WORKFLOWS ###################################
+
+# Multi-agent pipelines are usually written one step after another.
+# But many steps don't depend on each other: fetching 3 categories of data,
+# or analyzing each category, could all happen at the same time.
+# A Workflow is a small graph ("DAG") of steps:
+# - each node is a function, with the names of the results it needs (inputs)
+#   and the names of the results it produces (outputs)
+# - nodes whose inputs are ready run at the same time, on a thread pool
+# - results are remembered, so running the workflow again only runs what's missing
+# - .timings() shows how long each node took
+
+
+class Workflow:
+    """
+    A graph of agent steps that runs independent steps in parallel.
+    
+    Example:
+    --------
+    wf = Workflow()
+    for cat in ["Oncology", "Psychiatry"]:
+        wf.node(f"data_{cat}", get_shortages, kwargs={"category": cat})
+    wf.node("table", lambda a, b: df_as_text(pd.concat([a, b])), inputs=["data_Oncology", "data_Psychiatry"])
+    wf.node("summary", lambda text: agent_run(role="Summarize this table.", task=text), inputs=["table"])
+    results = wf.run()
+    print(results["summary"])
+    print(wf.timings())
+    """
+    
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self.nodes = {}     # node name -> {"fn", "inputs", "outputs", "kwargs"}
+        self.producer = {}  # result name -> node name that produces it
+        self.results = {}   # result name -> value (memoized across runs)
+        self.times = {}     # node name -> {"seconds", "status", "error"}
+    
+    def node(self, name, fn, inputs=(), outputs=None, kwargs=None):
+        """
+        Add a step to the workflow.
+        
+        Parameters:
+        -----------
+        name : str
+            Unique name for this step
+        fn : function
+            Called as fn(*input_values, **kwargs)
+        inputs : list
+            Names of results this step needs, passed to fn in this order (default: none)
+        outputs : list, optional
+            Names for the results; with more than one, fn must return that many values (default: [name])
+        kwargs : dict, optional
+            Extra keyword arguments for fn
+        
+        Returns:
+        --------
+        Workflow
+            The workflow, so calls can be chained
+        """
+        if name in self.nodes: raise ValueError(f"Workflow already has a node named '{name}'")
+        outputs = [name] if outputs is None else list(outputs)
+        for out in outputs:
+            if out in self.producer: raise ValueError(f"Result '{out}' is already produced by node '{self.producer[out]}'")
+        self.nodes[name] = {"fn": fn, "inputs": list(inputs), "outputs": outputs, "kwargs": kwargs or {}}
+        for out in outputs: self.producer[out] = name
+        return self
+    
+    def _upstream(self, name):
+        """Node names that `name` needs (directly) to run."""
+        deps = []
+        for inp in self.nodes[name]["inputs"]:
+            if inp not in self.producer: raise ValueError(f"Node '{name}' needs '{inp}', which no node produces")
+            deps.append(self.producer[inp])
+        return deps
+    
+    def _needed(self, targets):
+        """All nodes required for targets (result or node names), checking for cycles."""
+        needed, visiting = set(), set()
+        
+        def visit(name):
+            if name in needed: return
+            if name in visiting: raise ValueError(f"Workflow has a cycle through node '{name}'")
+            visiting.add(name)
+            for dep in self._upstream(name): visit(dep)
+            visiting.discard(name)
+            needed.add(name)
+        
+        for target in targets: visit(self.producer.get(target, target))
+        return needed
+    
+    def invalidate(self, name):
+        """Forget the memoized results of a node and of every node downstream of it."""
+        stale = {name}
+        changed = True
+        while changed:
+            changed = False
+            for node in self.nodes:
+                if node not in stale and any(self.producer.get(i) in stale for i in self.nodes[node]["inputs"]):
+                    stale.add(node)
+                    changed = True
+        for node in stale:
+            for out in self.nodes[node]["outputs"]: self.results.pop(out, None)
+    
+    def _run_node(self, name):
+        spec = self.nodes[name]
+        args = [self.results[i] for i in spec["inputs"]]
+        start = time.perf_counter()
+        value = spec["fn"](*args, **spec["kwargs"])
+        return value, time.perf_counter() - start
+    
+    def run(self, targets=None):
+        """
+        Run every node needed for targets (default: all nodes), in parallel where possible.
+        Nodes whose results are already memoized are skipped.
+        
+        Returns:
+        --------
+        dict
+            Result name -> value, for every result computed so far
+        
+        Raises the first node error after the other branches finish;
+        nodes downstream of a failed node are skipped.
+        """
+        needed = self._needed(targets if targets is not None else list(self.nodes))
+        done = lambda n: all(out in self.results for out in self.nodes[n]["outputs"])
+        pending = {n for n in needed if not done(n)}
+        for n in needed - pending: self.times[n] = {"seconds": 0.0, "status": "cached", "error": None}
+        failed = set()
+        first_error = None
+        running = {}
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in sorted(pending):
+                    deps = self._upstream(name)
+                    if any(d in failed for d in deps):
+                        # Can't run: something it needs failed
+                        pending.discard(name)
+                        failed.add(name)
+                        self.times[name] = {"seconds": 0.0, "status": "skipped", "error": None}
+                    elif all(done(d) for d in deps):
+                        pending.discard(name)
+                        running[executor.submit(self._run_node, name)] = name
+                if not running: break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    outputs = self.nodes[name]["outputs"]
+                    try:
+                        value, seconds = future.result()
+                        values = [value] if len(outputs) == 1 else list(value)
+                        if len(values) != len(outputs):
+                            raise ValueError(f"Node '{name}' returned {len(values)} values for outputs {outputs}")
+                        self.results.update(zip(outputs, values))
+                        self.times[name] = {"seconds": seconds, "status": "ok", "error": None}
+                    except Exception as e:
+                        failed.add(name)
+                        first_error = first_error or e
+                        self.times[name] = {"seconds": None, "status": "error", "error": str(e)}
+        
+        if first_error is not None: raise first_error
+        return dict(self.results)
+    
+    def timings(self):
+        """Return a DataFrame with one row per node: node, inputs, status, seconds, error."""
+        rows = [{"node": n, "inputs": ", ".join(self.nodes[n]["inputs"]), **self.times[n]}
+                for n in self.nodes if n in self.times]
+        return pd.DataFrame(rows, columns=["node", "inputs", "status", "seconds", "error"])
+
+
+# 8. MODEL CASCADE ###################################
+
+# Small models are fast, and for most tasks (labels, short JSON) their answer is fine.
+# Switching every call to a big model by hand wastes time; a cascade does it per call:
+# - run the cheapest model first
+# - check its reply with a validator: a function that returns the accepted result,
+#   or raises ValueError if the reply isn't good enough (see json_check() and regex_check())
+# - only if the check fails (or the call errors), try the next, larger model
+# The router counts, per task name, how often each model answered and how often calls
+# had to escalate, so we can confirm most traffic stays on the fast model.
+# Set AGENT_CASCADE to a comma-separated list of models to change the default order.
+
+CASCADE_MODELS = [m.strip() for m in os.getenv("AGENT_CASCADE", "smollm2:135m,smollm2:1.7b,gpt-oss:20b-cloud").split(",") if m.strip()]
+
+
+class CascadeError(RuntimeError):
+    """Raised when every model in the cascade failed its check (or errored)."""
+
+
+def json_check(schema=None):
+    """
+    Validator that parses the reply as JSON (and checks it against schema, if given).
+    The schema is also sent to Ollama as `format`, so each model is asked for the right shape.
+    """
+    validate = compile_validator(schema, root="output") if schema is not None else (lambda value: [])
+    check = lambda text: parse_structured(text, validate)
+    check.format = schema if schema is not None else "json"
+    return check
+
+
+def regex_check(pattern, flags=re.IGNORECASE):
+    """Validator that accepts a reply containing pattern, returning its first group (or the whole match)."""
+    compiled = re.compile(pattern, flags)
+    
+    def check(text):
+        match = compiled.search(text or "")
+        if match is None: raise ValueError(f"reply does not match {pattern!r}")
+        return match.group(1) if compiled.groups else match.group(0)
+    return check
+
+
+def nonempty_check(text):
+    """Default validator: any reply with some text in it."""
+    if not (text or "").strip(): raise ValueError("empty reply")
+    return text
+
+
+class CascadeRouter:
+    """
+    Run each call on the cheapest model whose reply passes a check.
+    
+    Example:
+    --------
+    router = CascadeRouter(["smollm2:135m", "smollm2:1.7b"], check=regex_check(r"positive|negative|other"))
+    label = router.run(role=prompt, task="booo", name="sentiment")
+    df = router.map(role=prompt, tasks=feedback_list, name="sentiment")
+    router.stats()
+    """
+    
+    def __init__(self, models=None, check=None):
+        self.models = list(models or CASCADE_MODELS)
+        if not self.models: raise ValueError("CascadeRouter needs at least one model")
+        self.check = check or nonempty_check
+        self._lock = threading.Lock()
+        self._counts = {}  # task name -> {"calls", "escalations", "failed", "answered": {model: n}}
+    
+    def _record(self, name, model_index):
+        """Count one finished call for task `name`: answered by models[model_index], or failed (None)."""
+        with self._lock:
+            c = self._counts.setdefault(name, {"calls": 0, "escalations": 0, "failed": 0, "answered": {}})
+            c["calls"] += 1
+            if model_index is None:
+                c["failed"] += 1
+                c["escalations"] += 1
+            else:
+                model = self.models[model_index]
+                c["answered"][model] = c["answered"].get(model, 0) + 1
+                if model_index > 0: c["escalations"] += 1
+    
+    def run(self, role, task, name="default", check=None, tools=None):
+        """
+        Run one task through the cascade and return the checked result.
+        Raises CascadeError if no model's reply passes the check.
+        """
+        check = check or self.check
+        errors = []
+        for i, model in enumerate(self.models):
+            try:
+                text = agent_run(role=role, task=task, tools=tools, model=model, format=getattr(check, "format", None))
+                result = check(text)
+            except Exception as e:  # a failed check or a failed call both escalate
+                errors.append(f"{model}: {e}")
+                continue
+            self._record(name, i)
+            return result
+        self._record(name, None)
+        raise CascadeError("every model failed: " + " | ".join(errors))
+    
+    def map(self, role, tasks, name="default", check=None, **kwargs):
+        """
+        Run many tasks through the cascade, one model at a time: the whole batch goes to the
+        first model with agent_map(), then only the items that failed go to the next model.
+        Extra keyword arguments (max_workers, rps_limit, retries, ...) go to agent_map().
+        
+        Returns:
+        --------
+        pandas.DataFrame
+            One row per task, in input order, with columns:
+            task, result (checked result), model (that answered, or None), error, attempts, seconds.
+        """
+        check = check or self.check
+        tasks = list(tasks)
+        rows = [{"task": t, "result": None, "model": None, "error": None, "attempts": 0, "seconds": 0.0} for t in tasks]
+        pending = list(range(len(tasks)))
+        for i, model in enumerate(self.models):
+            if not pending: break
+            df = agent_map(role, [tasks[j] for j in pending], model=model, format=getattr(check, "format", None), **kwargs)
+            failed = []
+            for j, out in zip(pending, df.itertuples(index=False)):
+                row = rows[j]
+                row["attempts"] += out.attempts
+                row["seconds"] += out.seconds
+                try:
+                    if out.error is not None: raise out.error
+                    row["result"], row["model"], row["error"] = check(out.result), model, None
+                    self._record(name, i)
+                except Exception as e:
+                    row["error"] = e
+                    failed.append(j)
+            pending = failed
+        for j in pending:
+            self._record(name, None)
+        return pd.DataFrame(rows, columns=["task", "result", "model", "error", "attempts", "seconds"])
+    
+    def stats(self):
+        """
+        Return a DataFrame with one row per task name: calls, escalations, escalation_rate,
+        failed, and one answered_<model> column per model (the share of calls it answered).
+        """
+        with self._lock:
+            counts = copy.deepcopy(self._counts)
+        rows = []
+        for name, c in counts.items():
+            row = {"task": name, "calls": c["calls"], "escalations": c["escalations"],
+                   "escalation_rate": c["escalations"] / c["calls"] if c["calls"] else 0.0, "failed": c["failed"]}
+            for model in self.models:
+                row[f"answered_{model}"] = c["answered"].get(model, 0) / c["calls"] if c["calls"] else 0.0
+            rows.append(row)
+        return pd.DataFrame(rows, columns=["task", "calls", "escalations", "escalation_rate", "failed"]
+                            + [f"answered_{m}" for m in self.models])
+    
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
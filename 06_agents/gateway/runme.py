@@ -0,0 +1,21 @@
+# runme.py
+# Run the LLM gateway locally (pairs with server.py)
+# Tim Fraser
+
+# From repo root or this folder:
+#   python 06_agents/gateway/runme.py
+#   GATEWAY_UPSTREAMS=http://gpu1:11434,http://gpu2:11434 python runme.py
+# Then point your scripts at it:
+#   export OLLAMA_HOST=http://127.0.0.1:8080
+
+import os
+import sys
+
+import uvicorn
+
+if __name__ == "__main__":
+    _here = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(_here)
+    sys.path.insert(0, _here)
+    port = int(os.getenv("GATEWAY_PORT", "8080"))
+    uvicorn.run("server:app", host="127.0.0.1", port=port)
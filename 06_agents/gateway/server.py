@@ -0,0 +1,390 @@
+# server.py
+# LLM Gateway — One Shared Path from Every Script to Ollama (FastAPI)
+# Pairs with ../functions.py
+# Tim Fraser
+
+# What this file is:
+#   A FastAPI app that speaks Ollama's API (/api/chat, /api/tags, /api/embed, ...),
+#   so any Ollama client can use it by changing only OLLAMA_HOST.
+#   Every request goes through one place that:
+#   - routes to the least busy healthy upstream Ollama host (EndpointPool from ../functions.py)
+#   - keeps pooled keep-alive connections to those hosts
+#   - answers repeated deterministic requests from a response cache (opt-in)
+#   - shares one upstream call among identical requests in flight (coalescing)
+#   - caps how many requests run upstream at once, serving waiting requests by priority
+#   - rate-limits each client (429 with Retry-After, which our helpers already retry)
+#   - records latency and token metrics per model and client
+#
+# How to run locally:
+#   python 06_agents/gateway/runme.py       (listens on http://127.0.0.1:8080)
+#   then, in the shell that runs your scripts:
+#   export OLLAMA_HOST=http://127.0.0.1:8080
+#
+# Settings (environment variables):
+#   GATEWAY_UPSTREAMS     comma-separated Ollama hosts (default: http://localhost:11434)
+#   GATEWAY_MAX_INFLIGHT  requests sent upstream at once, across all hosts (default: 8)
+#   GATEWAY_RPS           requests/sec allowed per client; 0 = no limit (default: 0)
+#   GATEWAY_BURST         extra requests a client may send at once before it is limited (default: 20)
+#   GATEWAY_CACHE         1 to turn on the response cache (default: 0)
+#   GATEWAY_CACHE_PATH    SQLite file for the cache (default: .gateway_cache.db)
+#   GATEWAY_COALESCE      0 to turn off coalescing (default: 1)
+#   GATEWAY_TIMEOUT       seconds to wait for an upstream reply (default: 300)
+#
+# Request headers (optional; plain Ollama clients don't need them):
+#   X-Priority   "high", "normal" (default) or "low" — who goes first when requests queue
+#   X-Client     a name for the caller, used for rate limits and metrics (default: client IP)
+#
+# Packages:
+#   pip install fastapi uvicorn httpx requests pandas
+
+import asyncio  # for the priority queue
+import heapq  # for ordering waiting requests
+import itertools  # for first-come order within a priority
+import json  # for NDJSON streams
+import math  # for Retry-After
+import os  # for settings
+import sys  # for importing ../functions.py
+import time  # for rate limits and timings
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+# Reuse the agent helpers' building blocks (06_agents/functions.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import functions  # noqa: E402
+
+# ── Settings ────────────────────────────────────────────────
+
+UPSTREAMS = [h.strip() for h in os.getenv("GATEWAY_UPSTREAMS", "http://localhost:11434").split(",") if h.strip()]
+MAX_INFLIGHT = int(os.getenv("GATEWAY_MAX_INFLIGHT", "8"))
+RATE_LIMIT = float(os.getenv("GATEWAY_RPS", "0"))
+BURST = int(os.getenv("GATEWAY_BURST", "20"))
+CACHE = os.getenv("GATEWAY_CACHE", "0").strip().lower() in ("1", "true", "yes", "on")
+CACHE_PATH = os.getenv("GATEWAY_CACHE_PATH", ".gateway_cache.db")
+COALESCE = os.getenv("GATEWAY_COALESCE", "1").strip().lower() not in ("0", "false", "no", "off")
+TIMEOUT = float(os.getenv("GATEWAY_TIMEOUT", "300"))
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+# ── Shared state ────────────────────────────────────────────
+
+
+class PriorityGate:
+    """
+    Let at most `limit` requests run upstream at once. Requests that have to wait
+    are let in by priority (lower number first), then in arrival order.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waited = 0
+        self._queue = []  # (priority, order, future)
+        self._order = itertools.count()
+
+    async def acquire(self, priority=1):
+        if self.active < self.limit and not self._queue:
+            self.active += 1
+            return
+        self.waited += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The caller gave up; if a slot was already handed to it, pass the slot on
+            if future.done() and not future.cancelled(): self.release()
+            raise
+
+    def release(self):
+        # Hand the slot straight to the next waiting request, skipping ones that gave up
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {"limit": self.limit, "active": self.active, "queued": len(self._queue), "waited": self.waited}
+
+
+class ClientRateLimiter:
+    """A token bucket per client: `rate` requests/sec on average, up to `burst` at once."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.limited = 0
+        self._buckets = {}  # client -> [tokens, last refill time]
+
+    def wait_seconds(self, client):
+        """Take a token and return 0, or return the seconds until one is free (the request is refused)."""
+        if self.rate <= 0: return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.setdefault(client, [float(self.burst), now])
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        self.limited += 1
+        return (1 - bucket[0]) / self.rate
+
+
+class UpstreamError(Exception):
+    """An upstream error to pass back to the client as-is (status code and JSON body)."""
+
+    def __init__(self, status, payload):
+        super().__init__(payload.get("error", status))
+        self.status = status
+        self.payload = payload
+
+
+POOL = functions.EndpointPool(UPSTREAMS)
+GATE = PriorityGate(MAX_INFLIGHT)
+LIMITER = ClientRateLimiter(RATE_LIMIT, BURST)
+SINGLE_FLIGHT = functions.SingleFlight()
+METRICS = functions.OllamaMetrics()
+RESPONSE_CACHE = functions.ResponseCache(CACHE_PATH) if CACHE else None
+CLIENT = None  # the pooled httpx.AsyncClient, opened at startup
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global CLIENT
+    limits = httpx.Limits(max_connections=max(MAX_INFLIGHT * 2, 20), max_keepalive_connections=max(MAX_INFLIGHT * 2, 20))
+    CLIENT = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(TIMEOUT, connect=5))
+    yield
+    await CLIENT.aclose()
+
+
+app = FastAPI(title="LLM Gateway", lifespan=lifespan)
+
+# ── Helpers ─────────────────────────────────────────────────
+
+
+def client_name(request):
+    return request.headers.get("x-client") or (request.client.host if request.client else "unknown")
+
+
+def priority_of(request):
+    value = (request.headers.get("x-priority") or "normal").strip().lower()
+    return PRIORITIES.get(value, int(value) if value.lstrip("-").isdigit() else 1)
+
+
+def forward_headers(request):
+    """Pass the caller's API key along (e.g. for Ollama Cloud upstreams)."""
+    auth = request.headers.get("authorization")
+    return {"Authorization": auth} if auth else {}
+
+
+def error_payload(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {"error": response.text or f"upstream returned {response.status_code}"}
+
+
+async def open_upstream(path, body, headers, stream=False):
+    """
+    Send a request to the least busy healthy host that has body["model"], failing over
+    to other hosts when a host can't be connected to or replies 5xx (or 404 for the model).
+    Once a host may have started on the request (e.g. a read timeout), it is not sent again:
+    that would run the same generation twice. A timeout is a 504, other errors a 502.
+    Returns (endpoint, response); call POOL.release(endpoint) when done with the response.
+    """
+    model = body.get("model")
+    tried = []
+    last_error = None
+    while True:
+        try:
+            endpoint = await asyncio.to_thread(POOL.choose, model, tried)
+        except RuntimeError:
+            if last_error is not None: raise last_error
+            raise no_host_error(model)
+        try:
+            request = CLIENT.build_request("POST", f"{endpoint.host}{path}", json=body, headers=headers)
+            response = await CLIENT.send(request, stream=stream)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            # The request never reached this host, so another host can safely take it
+            POOL.release(endpoint, e, model)
+            tried.append(endpoint)
+            last_error = UpstreamError(502, {"error": f"{endpoint.host}: {e!r}"})
+            continue
+        except httpx.TransportError as e:
+            POOL.release(endpoint, e, model)
+            status = 504 if isinstance(e, httpx.TimeoutException) else 502
+            raise UpstreamError(status, {"error": f"{endpoint.host}: {e!r}"}) from e
+        if response.status_code < 400:
+            return endpoint, response
+        if stream: await response.aread()
+        err = httpx.HTTPStatusError(f"{response.status_code}", request=request, response=response)
+        POOL.release(endpoint, err, model)
+        last_error = UpstreamError(response.status_code, error_payload(response))
+        if response.status_code >= 500 or response.status_code == 404:
+            tried.append(endpoint)  # another host may be healthy or have the model
+            continue
+        raise last_error
+
+
+def no_host_error(model):
+    """Like Ollama, a model no healthy host has is a 404; no healthy host at all is a 503."""
+    now = time.monotonic()
+    if any(now >= e.drained_until for e in POOL.endpoints):
+        return UpstreamError(404, {"error": f"model '{model}' not found"})
+    return UpstreamError(503, {"error": "no healthy upstream Ollama host"})
+
+
+async def post_json(path, body, headers, priority, site):
+    """Run one non-streaming request upstream, inside the priority gate, and return its JSON."""
+    await GATE.acquire(priority)
+    start = time.perf_counter()
+    try:
+        endpoint, response = await open_upstream(path, body, headers)
+        POOL.release(endpoint)
+    finally:
+        GATE.release()
+    result = response.json()
+    if path == "/api/chat":
+        METRICS.record(result, model=body.get("model"), site=site, wall_seconds=time.perf_counter() - start)
+    return result
+
+
+def too_many_requests(wait):
+    return JSONResponse({"error": "rate limit exceeded"}, status_code=429,
+                        headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+
+# ── Routes ──────────────────────────────────────────────────
+
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    body = await request.json()
+    site = client_name(request)
+    wait = LIMITER.wait_seconds(site)
+    if wait: return too_many_requests(wait)
+    priority, headers = priority_of(request), forward_headers(request)
+
+    if body.get("stream", True):
+        return await stream_upstream("/api/chat", body, headers, priority, site)
+
+    cache = RESPONSE_CACHE
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, body)
+        if cached is not None: return JSONResponse(cached)
+
+    async def call():
+        result = await post_json("/api/chat", body, headers, priority, site)
+        if cache is not None: await asyncio.to_thread(cache.put, body, result)
+        return result
+
+    try:
+        # Identical deterministic requests in flight share one upstream call
+        if COALESCE and functions.is_deterministic(body):
+            key = functions.ResponseCache.key({**body, "_auth": headers.get("Authorization")})
+            result = await SINGLE_FLIGHT.do_async(key, call)
+        else:
+            result = await call()
+    except UpstreamError as e:
+        return JSONResponse(e.payload, status_code=e.status)
+    return JSONResponse(result)
+
+
+async def stream_upstream(path, body, headers, priority, site):
+    """
+    Proxy a streaming /api/chat or /api/generate reply as NDJSON, from a host that has the model
+    and inside the priority gate; the upstream request is closed if the client hangs up.
+    """
+    await GATE.acquire(priority)
+    start = time.perf_counter()
+    try:
+        endpoint, response = await open_upstream(path, body, headers, stream=True)
+    except UpstreamError as e:
+        GATE.release()
+        return JSONResponse(e.payload, status_code=e.status)
+    except BaseException:
+        GATE.release()
+        raise
+
+    async def relay():
+        err = None
+        try:
+            async for line in response.aiter_lines():
+                if not line: continue
+                chunk = json.loads(line)
+                if chunk.get("done"):
+                    METRICS.record(chunk, model=body.get("model"), site=site, wall_seconds=time.perf_counter() - start)
+                yield line + "\n"
+        except httpx.TransportError as e:
+            err = e
+            raise
+        finally:
+            await response.aclose()
+            POOL.release(endpoint, err, body.get("model"))
+            GATE.release()
+
+    return StreamingResponse(relay(), media_type="application/x-ndjson")
+
+
+@app.get("/api/tags")
+async def tags():
+    """Every model that at least one healthy upstream host has."""
+    status = await asyncio.to_thread(POOL.check_all)
+    names = sorted({m for ok, models in zip(status["healthy"], status["models"]) if ok and models for m in models})
+    return {"models": [{"name": n, "model": n} for n in names]}
+
+
+@app.get("/gateway/metrics")
+async def gateway_metrics():
+    """Latency/token metrics per (model, client), plus queue, coalescing, cache, rate-limit and host stats."""
+    return {
+        "metrics": METRICS.summary(),
+        "queue": GATE.stats(),
+        "coalesce": SINGLE_FLIGHT.stats(),
+        "cache": None if RESPONSE_CACHE is None else RESPONSE_CACHE.stats(),
+        "rate_limited": LIMITER.limited,
+        "endpoints": json.loads(POOL.status().to_json(orient="records")),
+    }
+
+
+@app.get("/")
+async def health():
+    return {"status": "ok", "upstreams": UPSTREAMS}
+
+
+@app.api_route("/api/{path:path}", methods=["GET", "POST", "DELETE"])
+async def passthrough(path: str, request: Request):
+    """Other Ollama endpoints (/api/embed, /api/generate, /api/show, ...), sent to a host that has the model."""
+    site = client_name(request)
+    if request.method == "POST":
+        body = await request.json()
+        wait = LIMITER.wait_seconds(site)
+        if wait: return too_many_requests(wait)
+        if path == "generate" and body.get("stream", True):
+            # Streamed like a chat: a host that has the model, through the gate, piece by piece
+            return await stream_upstream("/api/generate", body, forward_headers(request), priority_of(request), site)
+        if not body.get("stream", True) or path not in ("pull", "push", "create"):
+            try:
+                return JSONResponse(await post_json(f"/api/{path}", body, forward_headers(request), priority_of(request), site))
+            except UpstreamError as e:
+                return JSONResponse(e.payload, status_code=e.status)
+    # Anything else (GETs, streamed pull/push/create) is relayed as-is to the least busy host
+    try:
+        endpoint = await asyncio.to_thread(POOL.choose, None)
+    except RuntimeError:
+        e = no_host_error(None)
+        return JSONResponse(e.payload, status_code=e.status)
+    try:
+        response = await CLIENT.request(request.method, f"{endpoint.host}/api/{path}",
+                                        content=await request.body(), headers=forward_headers(request))
+    except httpx.TransportError as e:
+        POOL.release(endpoint, e)
+        return JSONResponse({"error": f"{endpoint.host}: {e!r}"}, status_code=502)
+    POOL.release(endpoint)
+    return Response(response.content, status_code=response.status_code,
+                    media_type=response.headers.get("content-type"))
@@ -0,0 +1,107 @@
+# testme.py
+# Smoke-test the LLM gateway against two mock Ollama hosts (no GPU needed)
+# Pairs with server.py and ../bench/mock_ollama.py
+# Tim Fraser
+
+# Run from the repository root:
+#   python 06_agents/gateway/testme.py
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+import requests
+import uvicorn
+
+here = Path(__file__).resolve().parent
+sys.path.insert(0, str(here.parent / "bench"))
+sys.path.insert(0, str(here.parent))
+sys.path.insert(0, str(here))
+
+from mock_ollama import start_mock_server  # noqa: E402
+
+# 1. Two mock upstream hosts, each running 2 requests at a time
+mocks = [start_mock_server(latency=0.05, token_rate=200, reply="positive", parallel=2) for _ in range(2)]
+os.environ["GATEWAY_UPSTREAMS"] = ",".join(host for _, host in mocks)
+os.environ["GATEWAY_MAX_INFLIGHT"] = "4"
+
+import server  # noqa: E402  (reads the settings above)
+import functions  # noqa: E402
+
+# 2. Start the gateway on a free port
+config = uvicorn.Config(server.app, host="127.0.0.1", port=0, log_level="warning")
+gateway = uvicorn.Server(config)
+gateway_thread = threading.Thread(target=gateway.run, daemon=True)
+gateway_thread.start()
+while not gateway.started: time.sleep(0.05)
+port = gateway.servers[0].sockets[0].getsockname()[1]
+gateway_url = f"http://127.0.0.1:{port}"
+print(f"Gateway at {gateway_url} -> {server.UPSTREAMS}")
+
+# 3. Plain Ollama-style requests
+tags = requests.get(f"{gateway_url}/api/tags", timeout=10).json()
+print("Models:", [m["name"] for m in tags["models"]])
+body = {"model": "smollm2:1.7b", "messages": [{"role": "user", "content": "hi"}], "stream": False}
+print("Chat:", requests.post(f"{gateway_url}/api/chat", json=body, timeout=10).json()["message"])
+missing = requests.post(f"{gateway_url}/api/chat", json={**body, "model": "nope:1b"}, timeout=10)
+print("Unknown model:", missing.status_code, missing.json())
+generate = {"model": "smollm2:1.7b", "prompt": "hi"}  # streams by default, like Ollama
+with requests.post(f"{gateway_url}/api/generate", json=generate, stream=True, timeout=10) as reply:
+    chunks = [json.loads(line) for line in reply.iter_lines() if line]
+print("Generate (streamed):", len(chunks), "chunks ->", "".join(c.get("response", "") for c in chunks))
+missing = requests.post(f"{gateway_url}/api/generate", json={**generate, "model": "nope:1b"}, timeout=10)
+print("Generate, unknown model:", missing.status_code, missing.json())
+
+# 4. The agent helpers, switched over by changing only the host.
+# agent() sends no temperature, so Ollama samples: the gateway must NOT coalesce these.
+functions.CHAT_URL = f"{gateway_url}/api/chat"
+functions.COALESCE = False  # let the gateway decide
+tasks = [f"text {i % 10}" for i in range(40)]  # 10 distinct texts, each 4 times
+start = time.perf_counter()
+df = functions.agent_map("Classify the sentiment.", tasks, max_workers=20)
+print(f"agent_map: {len(df)} calls, {df['error'].notna().sum()} errors, {time.perf_counter() - start:.2f}s")
+sampled = requests.get(f"{gateway_url}/gateway/metrics", timeout=10).json()["coalesce"]
+assert sampled["saved_calls"] == 0, f"sampled requests were coalesced: {sampled}"
+stream = functions.agent([{"role": "user", "content": "hi"}], stream=True)
+print("Stream:", "".join(stream))
+
+# Deterministic requests (temperature 0) that are identical and in flight together share one call
+pinned = {**body, "options": {"temperature": 0}}
+with ThreadPoolExecutor(max_workers=8) as executor:
+    list(executor.map(lambda _: requests.post(f"{gateway_url}/api/chat", json=pinned, timeout=10), range(8)))
+
+# 5. What the gateway saw
+stats = requests.get(f"{gateway_url}/gateway/metrics", timeout=10).json()
+print("Queue:", stats["queue"])
+print("Coalesced:", stats["coalesce"])
+print("Calls per host:", {e["host"]: e["calls"] for e in stats["endpoints"]})
+print("Calls per model/client:", [(m["model"], m["site"], m["calls"]) for m in stats["metrics"]])
+
+gateway.should_exit = True
+gateway_thread.join(10)  # its shutdown closes server.CLIENT
+
+# 6. A host that times out after taking a request is not sent it again: the client gets a 504
+slows = [start_mock_server(latency=30) for _ in range(2)]
+
+
+async def send_to_slow_host():
+    server.POOL = functions.EndpointPool([host for _, host in slows])
+    server.CLIENT = httpx.AsyncClient(timeout=httpx.Timeout(0.3, connect=5))
+    try:
+        await server.open_upstream("/api/chat", body, {})
+    except server.UpstreamError as e:
+        return e.status, server.POOL.status()["calls"].sum()
+    finally:
+        await server.CLIENT.aclose()
+
+
+status, calls = asyncio.run(send_to_slow_host())
+print("Read timeout:", status, f"after {calls} call(s)")
+assert status == 504 and calls == 1, (status, calls)
+for mock, _ in mocks + slows: mock.shutdown()
@@ -5,39 +5,53 @@
 # 0. SETUP ###################################
 
 import pandas as pd
-from functions import agent_run, get_shortages, df_as_text
+from functions import agent_run, get_shortages, df_as_text, warm_models, Workflow
 
 # Select model
 MODEL = "smollm2:1.7b"
 
+# Load the model up front, so Agent 1 doesn't pay the model load time
+print(warm_models([MODEL], keep_alive="30m"))
+
 # 1. GET DATA ###################################
 
-# Fetch drug shortage data for multiple categories
+# The pipeline is a Workflow: a graph of steps, where each step names the results it needs.
+# The 3 category fetches don't depend on each other, so they run at the same time;
+# the agents below depend on each other, so they still run in order.
+wf = Workflow()
+
+# Fetch drug shortage data for multiple categories (one node per category)
 categories_to_check = ["Oncology", "Psychiatry", "Cardiovascular"]
-all_data = []
 
-for cat in categories_to_check:
+
+def fetch_category(cat):
     try:
         df = get_shortages(category=cat, limit=500)
         df["category"] = cat
-        all_data.append(df)
+        return df
     except Exception as e:
         print(f"Warning: Could not fetch data for {cat}: {e}")
+        return None
 
-data = pd.concat(all_data, ignore_index=True)
 
-# Get most recent record per drug, filter for unavailable
-stat = (data
-        .groupby("generic_name")
-        .apply(lambda x: x.loc[x["update_date"].idxmax()])
-        .reset_index(drop=True)
-        .query("availability == 'Unavailable'"))
+for cat in categories_to_check:
+    wf.node(f"data_{cat}", fetch_category, kwargs={"cat": cat})
 
-raw_text = df_as_text(stat)
 
-print("=== Raw Data ===")
-print(raw_text)
-print()
+def summarize_unavailable(*dfs):
+    data = pd.concat([df for df in dfs if df is not None], ignore_index=True)
+    # Get most recent record per drug, filter for unavailable
+    stat = (data
+            .groupby("generic_name")
+            .apply(lambda x: x.loc[x["update_date"].idxmax()])
+            .reset_index(drop=True)
+            .query("availability == 'Unavailable'"))
+    # Compact "dict" encoding: repeated categories become short codes, and
+    # max_tokens samples rows if the table is still too long for a quick prompt
+    return df_as_text(stat, format="dict", max_tokens=2000)
+
+
+wf.node("raw_text", summarize_unavailable, inputs=[f"data_{cat}" for cat in categories_to_check])
 
 # 2. AGENT 1 - Data Analyst ###################################
 # Analyzes raw shortage data and identifies key patterns
@@ -51,11 +65,7 @@ role1 = (
     "Return your analysis as a structured bullet-point list."
 )
 
-result1 = agent_run(role=role1, task=raw_text, model=MODEL, output="text")
-
-print("=== Agent 1 (Data Analyst) Output ===")
-print(result1)
-print()
+wf.node("result1", lambda text: agent_run(role=role1, task=text, model=MODEL, output="text"), inputs=["raw_text"])
 
 # 3. AGENT 2 - Risk Assessor ###################################
 # Evaluates severity and impact based on the analysis
@@ -69,12 +79,28 @@ role2 = (
     "Keep your assessment to one paragraph for each point."
 )
 
-result2 = agent_run(role=role2, task=result1, model=MODEL, output="text")
+wf.node("result2", lambda analysis: agent_run(role=role2, task=analysis, model=MODEL, output="text"), inputs=["result1"])
+
+# Run the graph: fetches in parallel, then the agents in order
+results = wf.run()
+raw_text, result1, result2 = results["raw_text"], results["result1"], results["result2"]
+
+print("=== Raw Data ===")
+print(raw_text)
+print()
+
+print("=== Agent 1 (Data Analyst) Output ===")
+print(result1)
+print()
 
 print("=== Agent 2 (Risk Assessor) Output ===")
 print(result2)
 print()
 
+# How long each step took
+print(wf.timings())
+print()
+
 # 4. AGENT 3 - Report Writer ###################################
 # Produces a final executive summary combining all findings
 
@@ -89,7 +115,13 @@ role3 = (
     "Keep the total length under 200 words."
 )
 
-result3 = agent_run(role=role3, task=result2, model=MODEL, output="text")
-
 print("=== Agent 3 (Report Writer) Output ===")
-print(result3)
+
+# Stream the summary so it prints piece by piece as the model writes it
+stream3 = agent_run(role=role3, task=result2, model=MODEL, output="text", stream=True)
+for piece in stream3: print(piece, end="", flush=True)
+print()
+result3 = stream3.text
+
+# Time to first token and generation speed
+print(stream3.stats)
@@ -0,0 +1,197 @@
+# Offline tests for functions.py: deterministic-request detection + SingleFlight + df_as_text budgets + ResponseCache + EndpointPool failover + AgentStream release (mock Ollama, no network)
+# Run: python 06_agents/tests/test_agent_helpers.py
+
+from __future__ import annotations
+
+import asyncio
+import gc
+import sys
+import tempfile
+from pathlib import Path
+
+agents_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(agents_root))
+sys.path.insert(0, str(agents_root / "bench"))
+
+import functions
+from mock_ollama import start_mock_server
+
+MODEL = "smollm2:1.7b"
+
+
+def chat_body(**options) -> dict:
+    body = {"model": MODEL, "messages": [{"role": "user", "content": "Is this good?"}], "stream": False}
+    if options:
+        body["options"] = options
+    return body
+
+
+def upstream_calls() -> int:
+    """Calls that reached the (mock) server, as counted by post_chat()."""
+    return sum(row["calls"] for row in functions.METRICS.summary() if row["site"] == "agent")
+
+
+def test_is_deterministic() -> None:
+    print("test_agent_helpers: is_deterministic ...")
+    assert not functions.is_deterministic(chat_body())  # Ollama's default temperature samples
+    assert not functions.is_deterministic(chat_body(temperature=0.7))
+    assert not functions.is_deterministic(chat_body(num_predict=10))
+    assert functions.is_deterministic(chat_body(temperature=0))
+    assert functions.is_deterministic(chat_body(temperature=0.0, num_predict=10))
+    assert functions.is_deterministic(chat_body(seed=0))
+    assert functions.is_deterministic(chat_body(temperature=0.9, seed=42))
+    print("   OK")
+
+
+def test_single_flight_cancel() -> None:
+    print("test_agent_helpers: SingleFlight survives a cancelled leader ...")
+    flight = functions.SingleFlight()
+
+    async def main():
+        async def call(answer):
+            await asyncio.sleep(0.1)
+            return {"answer": answer}
+
+        leader = asyncio.create_task(flight.do_async("key", lambda: call("leader")))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flight.do_async("key", lambda: call("follower")))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        # The follower is not cancelled with the leader: it runs its own call instead
+        assert (await follower) == {"answer": "follower"}
+        assert leader.cancelled()
+
+    asyncio.run(main())
+    assert flight.stats()["upstream_calls"] == 2 and flight.stats()["saved_calls"] == 0
+    print("   OK")
+
+
+def test_df_as_text_budget() -> None:
+    print("test_agent_helpers: df_as_text keeps an aggregate summary within max_tokens ...")
+    wide = functions.pd.DataFrame({f"measure_{i}": range(i, i + 200) for i in range(60)})
+    wide["site"] = [f"site_{i % 7}" for i in range(200)]
+    # Too wide to summarize every column in the budget: only the first columns are summarized
+    for format in functions.TEXT_FORMATS:
+        text = functions.df_as_text(wide, format=format, max_tokens=300, reduce="aggregate")
+        assert functions.estimate_tokens(text) <= 300, (format, functions.estimate_tokens(text))
+    text = functions.df_as_text(wide, max_tokens=300, reduce="aggregate")
+    assert text.startswith("(summarizing ") and "of 61 columns)" in text
+    # A summary that fits is left whole
+    narrow = wide[["measure_0", "site"]]
+    assert functions.df_as_text(narrow, max_tokens=120, reduce="aggregate").startswith("200 rows summarized.")
+    print("   OK")
+
+
+def test_response_cache() -> None:
+    print("test_agent_helpers: ResponseCache only serves deterministic requests ...")
+    server, host = start_mock_server()
+    old_url = functions.CHAT_URL
+    functions.CHAT_URL = f"{host}/api/chat"
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = functions.ResponseCache(str(Path(tmp) / "cache.db"))
+            assert cache.cacheable(chat_body(temperature=0)) and cache.cacheable(chat_body(seed=7))
+            assert not cache.cacheable(chat_body()) and not cache.cacheable(chat_body(temperature=0.7))
+            assert not cache.cacheable({**chat_body(temperature=0), "stream": True})
+            assert functions.ResponseCache(str(Path(tmp) / "random.db"), cache_random=True).cacheable(chat_body())
+
+            # End to end through post_chat(): repeats of a temperature-0 body are served from disk
+            functions.enable_cache(str(Path(tmp) / "agent.db"))
+            functions.METRICS.reset()
+            for _ in range(3):
+                assert functions.post_chat(chat_body(temperature=0))["message"]["content"] == "positive"
+            assert upstream_calls() == 1
+            # ...while a body that samples goes to the server every time
+            for _ in range(3):
+                functions.post_chat(chat_body())
+            assert upstream_calls() == 4
+            stats = functions.cache_stats()
+            assert stats["hits"] == 2 and stats["misses"] == 1 and stats["bypassed"] == 3 and stats["entries"] == 1
+
+            # agent_run() opts in with options: the second identical call never reaches the server
+            for _ in range(2):
+                assert functions.agent_run("Label it.", "great", model=MODEL, options={"temperature": 0}) == "positive"
+            assert upstream_calls() == 5 and functions.cache_stats()["hits"] == 3
+            functions.agent_run("Label it.", "great", model=MODEL)
+            assert upstream_calls() == 6
+    finally:
+        functions.disable_cache()
+        functions.CHAT_URL = old_url
+        server.shutdown()
+    print("   OK")
+
+
+def test_endpoint_failover() -> None:
+    print("test_agent_helpers: EndpointPool fails over and drains a failing host ...")
+    bad, bad_host = start_mock_server(error_rate=1.0, error_status=503)
+    good, good_host = start_mock_server()
+    try:
+        functions.use_endpoints([bad_host, good_host])
+        for _ in range(4):
+            assert functions.send_chat(chat_body()).json()["message"]["content"] == "positive"
+        status = {row["host"]: row for row in functions.endpoint_status().to_dict("records")}
+        assert not status[bad_host]["healthy"] and status[bad_host]["failures"] >= 1
+        assert status[good_host]["healthy"] and status[good_host]["calls"] >= 4
+        assert all(row["outstanding"] == 0 for row in status.values())
+
+        # A model that no host lists fails at once, without reserving a slot
+        pool = functions.use_endpoints([good_host])
+        try:
+            functions.send_chat({**chat_body(), "model": "not-a-model"})
+            raise AssertionError("expected RuntimeError for a model no host has")
+        except RuntimeError:
+            pass
+        assert pool.status()["outstanding"].sum() == 0
+    finally:
+        functions.use_endpoints([])
+        bad.shutdown()
+        good.shutdown()
+    print("   OK")
+
+
+def test_stream_releases_slot() -> None:
+    print("test_agent_helpers: AgentStream frees its host slot ...")
+    server, host = start_mock_server(token_rate=500)
+    try:
+        pool = functions.use_endpoints([host])
+        messages = [{"role": "user", "content": "hi"}]
+        stream = functions.agent_stream(messages, model=MODEL)
+        assert pool.status()["outstanding"].sum() == 1
+        del stream  # never iterated
+        gc.collect()
+        assert pool.status()["outstanding"].sum() == 0
+        with functions.agent_stream(messages, model=MODEL) as stream:
+            for _ in stream:
+                break
+        assert pool.status()["outstanding"].sum() == 0
+        stream = functions.agent_stream(messages, model=MODEL)
+        assert "".join(stream) == "positive" and pool.status()["outstanding"].sum() == 0
+
+        # Settings a stream can't honor are rejected before any request is sent
+        for kwargs in ({"all": True}, {"output": "tools"}):
+            try:
+                functions.agent(messages, model=MODEL, stream=True, **kwargs)
+                raise AssertionError(f"expected ValueError for stream=True with {kwargs}")
+            except ValueError:
+                pass
+        assert pool.status()["calls"].sum() == 3
+        with functions.agent(messages, model=MODEL, stream=True, format={"type": "string"}) as stream:
+            assert "".join(stream) == "positive"
+    finally:
+        functions.use_endpoints([])
+        server.shutdown()
+    print("   OK")
+
+
+def main() -> None:
+    test_is_deterministic()
+    test_single_flight_cancel()
+    test_df_as_text_budget()
+    test_response_cache()
+    test_endpoint_failover()
+    test_stream_releases_slot()
+    print("test_agent_helpers: all passed.")
+
+
+if __name__ == "__main__":
+    main()
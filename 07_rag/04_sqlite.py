@@ -33,7 +33,7 @@ _ = runpy.run_path(ollama_script_path)
 ## 0.2 Load Functions #################################
 
 # Load helper functions for agent orchestration
-from functions import agent_run
+from functions import agent_run, warm_models
 
 ## 0.3 Configuration #################################
 
@@ -43,6 +43,10 @@ PORT = 11434  # use this default port
 OLLAMA_HOST = f"http://localhost:{PORT}"  # use this default host
 DB_PATH = "data/papers.db"  # path to the SQLite database
 
+# Load the model into memory up front (and keep it loaded for 30 minutes),
+# so the first RAG answer doesn't wait for the model to load
+print(warm_models([MODEL], keep_alive="30m"))
+
 # 1. DATABASE CONNECTION ###################################
 
 # Connect to database
@@ -31,12 +31,20 @@
 # sentence-transformers will take a fair amount of space, fyi
 
 # Prefer local 07_rag/functions.py over the PyPI "functions" package (incompatible with Python 3).
+import glob      # for listing the plan files
+import hashlib   # for content hashes of chunks
 import json
 import os        # for file path operations
+import re        # for finding sentence boundaries
 import runpy     # for executing another Python script
+import threading # for a lock around the query cache
+import time      # for timing the index build
+import unicodedata  # for normalizing query text
+from collections import OrderedDict  # for the LRU query cache
 from dotenv import load_dotenv
 import requests  # for HTTP requests
 import sqlite3
+import numpy as np  # installed with sentence-transformers
 from sentence_transformers import SentenceTransformer
 from sqlite_vec import load as sqlite_vec_load, serialize_float32
 
@@ -67,12 +75,18 @@ except ImportError:
 # To find the path for use in R, in git bash run:
 # python -c "import sqlite_vec; print(sqlite_vec.loadable_path())"
 
-DB_PATH = "data/embed.db"  # path to your new vector embeddings database
-if os.path.exists(DB_PATH): os.remove(DB_PATH) 
+DB_PATH = "data/embed.db"  # path to your vector embeddings database (reused across runs)
+if os.path.exists(DB_PATH): print("Found existing database; only new or changed text will be embedded.")
 else: print("No database found, creating new one.")
 DOCUMENT = "data/lower_manhattan_recovery_plan.txt"  # path to text doc
+PLANS_DIR = "data/plans"  # folder of more NY Rising plans (.txt)
+INDEX_PLANS = False  # set to True to also index every plan in PLANS_DIR
 EMBED_MODEL = "all-MiniLM-L6-v2"  # model for embedding text into vectors
 VEC_DIM = 384   # all-MiniLM-L6-v2 output size
+EMBED_BATCH_SIZE = 64  # chunks per forward pass when building the index
+QUERY_CACHE_SIZE = 1024  # most recent query embeddings kept in memory
+CHUNK_TOKENS = None  # max tokens per chunk; None = the embedding model's limit
+CHUNK_OVERLAP = 32   # tokens of trailing sentences repeated at the start of the next chunk
 MODEL = "gpt-oss:20b-cloud"  # cloud model (Ollama Cloud; for RAG answer step)
 
 
@@ -143,39 +157,280 @@ def embed(text):
     vec = m.encode(text)
     return vec.tolist()  # numpy array -> list of floats
 
+# Encode many texts in one call; returns a float32 matrix with one row per text.
+# Batching lets the model run one forward pass per batch instead of one per sentence.
+def embed_many(texts, batch_size=EMBED_BATCH_SIZE):
+    m = get_embed_model()
+    vecs = m.encode(list(texts), batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    return np.asarray(vecs, dtype=np.float32)
+
+# Queries repeat a lot (fact-check loops, dashboards, templated questions), and
+# embedding the same text twice gives the same vector. So we keep the most recent
+# query vectors in a small LRU cache, keyed by model name + normalized query text.
+class QueryEmbeddingCache:
+    def __init__(self, maxsize=QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text, model=EMBED_MODEL):
+        # Unicode NFC + collapsed whitespace, so "flood  risk\n" and "flood risk" share an entry
+        return (model, " ".join(unicodedata.normalize("NFC", text).split()))
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)  # mark as most recently used
+            self.hits += 1
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)  # evict the least recently used
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self._items), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = 0
+
+QUERY_CACHE = QueryEmbeddingCache()
+
+# Embed a search query as a float32 blob, skipping the model when we've seen the query before.
+def embed_query(query, cache=QUERY_CACHE):
+    key = cache.key(query, EMBED_MODEL)
+    blob = cache.get(key)
+    if blob is None:
+        blob = serialize_float32(embed(key[1]))
+        cache.put(key, blob)
+    return blob
+
 # Write a function to read in the document into meaningful text chunks.
-def get_text(document_path):
-    # Split the document into chunks
-    with open(document_path, "r", encoding="UTF-8") as f:
-        raw = f.read()
-    # Concatenate the lines into a single string (already one string), split on period
-    parts = raw.replace("\n", " ").split(".")
-    # Trim whitespace and return only non-empty chunks
-    chunks = [p.strip() for p in parts if p.strip()]
-    return chunks
-
-# Embed each chunk and insert into vec_chunks (float32 blob + text).
-# R uses a single vec0 table with id, embedding, +text; Python sqlite_vec uses
-# a vec0 virtual table (rowid, embedding) plus a chunks table (id, text) for compatibility.
-def build_index_from_document(conn, chunks):
-    # Given a database connection 'conn' and a list of text chunks 'chunks',
-    # embed each chunk and insert into database (chunks table + vec_chunks virtual table).
-    n = len(chunks)
-    print(f"Embedding {n} chunks with {EMBED_MODEL}...")
-    for i, text in enumerate(chunks):
-        # Embed the chunk
-        vec = embed(text)
-        # Convert the vector to a float32 blob
-        blob = serialize_float32(vec)
-        # Insert the chunk into the chunks table
-        conn.execute("INSERT INTO chunks (id, text) VALUES (?, ?)", (i, text))
-        # Insert into vec_chunks (rowid aligns with chunks.id)
+# Splitting on every "." breaks "U.S. Army Corps" and "$1.5 million" apart and makes
+# thousands of tiny chunks. Instead we:
+# 1. read the file a block at a time and cut it into real sentences, and
+# 2. pack neighbouring sentences into chunks that fit the embedding model's token limit,
+#    repeating the last few sentences of each chunk at the start of the next (overlap).
+# Both steps are generators, so only a few sentences are in memory at once, and the
+# indexer can start embedding before the whole file has been read.
+
+# Words that end in a period without ending the sentence
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "ave", "blvd", "rd", "hwy", "mt", "ft",
+    "inc", "ltd", "co", "corp", "llc", "dept", "gov", "govt", "assn", "vs", "etc",
+    "e.g", "i.e", "cf", "al", "approx", "est", "u.s", "u.s.a", "n.y", "n.j", "d.c",
+    "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+}
+# ...and words that only abbreviate when a number follows ("No. 5" but not 'said "No." Then')
+NUMBER_ABBREVIATIONS = {"no", "nos", "fig", "figs", "p", "pp", "vol", "sec", "ch"}
+# A blank line (paragraph break, heading, list item), or sentence-ending punctuation plus
+# closing quotes/brackets, followed by whitespace and a capital letter or digit.
+# Decimals like 1.5 never match because no whitespace follows the period.
+SENTENCE_END = re.compile(r"\n[ \t]*\n\s*|[.!?]+[\"'\u201d\u2019)\]]*\s+(?=[\"'\u201c\u2018(\[]?[A-Z0-9])")
+MAX_SENTENCE_CHARS = 20_000  # cut a runaway "sentence" (e.g. a table with no punctuation)
+
+# Is this boundary a real sentence end, or the period of an abbreviation/initial?
+def _ends_sentence(text, match):
+    if not match.group().startswith("."):
+        return True  # blank line, "!" or "?"
+    words = text[max(0, match.start() - 12):match.start()].split()
+    if not words:
+        return True
+    word = words[-1].lstrip("(\"'\u201c").lower()
+    if word in NUMBER_ABBREVIATIONS and match.group().rstrip()[-1] == ".":
+        return not text[match.end():match.end() + 1].isdigit()
+    return not (word in ABBREVIATIONS or (len(word) == 1 and word.isalpha()))
+
+# Yield the sentences in a text file, reading it 'read_size' characters at a time.
+def iter_sentences(document_path, read_size=1 << 16):
+    buffer = ""
+    with open(document_path, "r", encoding="UTF-8", errors="replace") as f:
+        while True:
+            block = f.read(read_size)
+            buffer += block if block else "\n\n"  # at end of file, close the last sentence
+            start = 0
+            for match in SENTENCE_END.finditer(buffer):
+                if match.end() == len(buffer) and block:
+                    break  # boundary touches the end of the buffer; wait for more text
+                if _ends_sentence(buffer, match):
+                    sentence = " ".join(buffer[start:match.end()].split())
+                    if sentence:
+                        yield sentence
+                    start = match.end()
+            buffer = buffer[start:]
+            while len(buffer) > MAX_SENTENCE_CHARS:
+                cut = buffer.rfind(" ", 0, MAX_SENTENCE_CHARS) + 1 or MAX_SENTENCE_CHARS
+                yield " ".join(buffer[:cut].split())
+                buffer = buffer[cut:]
+            if not block:
+                return
+
+# Count tokens the way the embedding model will see them.
+def count_tokens(text):
+    return len(get_embed_model().tokenizer.tokenize(text))
+
+# Split a sentence that is too long for one chunk into pieces of at most 'limit' tokens.
+def _split_long(sentence, n_tokens, limit):
+    if n_tokens <= limit:
+        yield sentence, n_tokens
+        return
+    piece, size = [], 0
+    for word in sentence.split():
+        n = count_tokens(word)
+        if piece and size + n > limit:
+            yield " ".join(piece), size
+            piece, size = [], 0
+        piece.append(word)
+        size += n
+    if piece:
+        yield " ".join(piece), size
+
+# Stream a document as chunks of whole sentences, each at most 'max_tokens' tokens,
+# overlapping the previous chunk by up to 'overlap' tokens of its last sentences.
+def get_text(document_path, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    # Leave room for the [CLS] and [SEP] tokens the model adds to every input
+    limit = max_tokens or get_embed_model().max_seq_length - 2
+    window, size, fresh = [], 0, False  # window holds (sentence, n_tokens) pairs
+    for sentence in iter_sentences(document_path):
+        for piece, n in _split_long(sentence, count_tokens(sentence), limit):
+            if window and size + n > limit:
+                yield " ".join(s for s, _ in window)
+                fresh = False  # what's left is overlap, already part of a chunk
+                # Carry the last sentences (up to 'overlap' tokens) into the next chunk
+                keep = []
+                for s, k in reversed(window):
+                    if sum(x for _, x in keep) + k > overlap:
+                        break
+                    keep.insert(0, (s, k))
+                window, size = keep, sum(k for _, k in keep)
+                while window and size + n > limit:
+                    size -= window.pop(0)[1]
+            window.append((piece, n))
+            size += n
+            fresh = True
+    if window and fresh:
+        yield " ".join(s for s, _ in window)
+
+# Fingerprint a chunk's text, so later runs can tell which chunks are already embedded.
+def chunk_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Create the index tables if needed. The vectors are only comparable when made by the
+# same model at the same size, so if EMBED_MODEL or VEC_DIM changed since the last run
+# (or the database predates chunk hashes), drop both tables and start over.
+def prepare_index(conn, model=EMBED_MODEL, dim=VEC_DIM):
+    conn.execute("CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    meta = dict(conn.execute("SELECT key, value FROM index_meta").fetchall())
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+    changed = meta.get("embed_model") != model or meta.get("vec_dim") != str(dim)
+    outdated = bool(columns) and not {"hash", "source", "model"} <= columns
+    # An index made elsewhere (e.g. the R version: one vec_chunks table, no index_meta) counts too
+    has_vectors = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'vec_chunks'").fetchone() is not None
+    rebuild = (bool(meta) or bool(columns) or has_vectors) and (changed or outdated)
+    with conn:
+        if rebuild:
+            if outdated or not meta:
+                print(f"Existing index has no chunk hashes; rebuilding for {model} ({dim} dims).")
+            else:
+                print(f"Index was built with {meta['embed_model']} ({meta['vec_dim']} dims); "
+                      f"rebuilding for {model} ({dim} dims).")
+            conn.execute("DROP TABLE IF EXISTS chunks")
+            conn.execute("DROP TABLE IF EXISTS vec_chunks")
+        # vec0 virtual table: rowid, embedding (float32). Cosine distance for similarity search.
+        # We keep id, text, hash, source and model in chunks so we can join after MATCH.
         conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                text TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                source TEXT NOT NULL,
+                model TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS chunks_source_hash ON chunks (source, hash)")
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS vec_chunks USING vec0(embedding float[{dim}] distance_metric=cosine)")
+        conn.executemany(
+            "INSERT OR REPLACE INTO index_meta (key, value) VALUES (?, ?)",
+            [("embed_model", model), ("vec_dim", str(dim))]
+        )
+    return rebuild
+
+# Bring the index for one source document up to date, embedding new chunks in batches.
+# R uses a single vec0 table with id, embedding, +text; Python sqlite_vec uses
+# a vec0 virtual table (rowid, embedding) plus a chunks table (id, text, ...) for compatibility.
+def build_index_from_document(conn, chunks, source=DOCUMENT, batch_size=EMBED_BATCH_SIZE, write_every=1024):
+    # Given a database connection 'conn' and an iterable of text chunks 'chunks' from 'source':
+    # - chunks whose hash is already stored for this source are skipped (no embedding),
+    # - new chunks are embedded 'write_every' at a time (in model batches of 'batch_size')
+    #   and written with executemany,
+    # - stored chunks that no longer appear in the source are deleted from both tables.
+    # Everything happens in one transaction.
+    known = dict(conn.execute(
+        "SELECT hash, id FROM chunks WHERE source = ? AND model = ?", (source, EMBED_MODEL)
+    ).fetchall())
+    next_id = conn.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM chunks").fetchone()[0]
+    print(f"Indexing {source} with {EMBED_MODEL} ({len(known)} chunks already stored, batch size {batch_size})...")
+    start = time.perf_counter()
+    seen = set()
+    added = 0
+    block = []
+
+    def flush(block):
+        # Encode the whole block at once, then serialize every row of the float32 matrix
+        vecs = embed_many([text for _, text, _ in block], batch_size=batch_size)
+        blobs = [row.tobytes() for row in vecs]  # same layout as serialize_float32()
+        conn.executemany(
+            "INSERT INTO chunks (id, text, hash, source, model) VALUES (?, ?, ?, ?, ?)",
+            [(i, text, h, source, EMBED_MODEL) for i, text, h in block]
+        )
+        # rowid in vec_chunks aligns with chunks.id
+        conn.executemany(
             "INSERT INTO vec_chunks (rowid, embedding) VALUES (?, ?)",
-            (i, blob)
+            [(i, blob) for (i, _, _), blob in zip(block, blobs)]
         )
-    conn.commit()
-    print("Index built.\n")
+        return len(block)
+
+    with conn:  # one transaction: commits at the end, rolls back on error
+        for text in chunks:
+            h = chunk_hash(text)
+            if h in seen:
+                continue  # repeated text adds nothing to the index
+            seen.add(h)
+            if h in known:
+                continue  # unchanged chunk, already embedded
+            block.append((next_id, text, h))
+            next_id += 1
+            if len(block) >= write_every:
+                added += flush(block)
+                block = []
+                rate = added / (time.perf_counter() - start)
+                print(f"  {added} new chunks embedded ({rate:.0f} chunks/sec)")
+        if block:
+            added += flush(block)
+        # Drop chunks that were removed from (or changed in) the source
+        removed = [(i,) for h, i in known.items() if h not in seen]
+        conn.executemany("DELETE FROM chunks WHERE id = ?", removed)
+        conn.executemany("DELETE FROM vec_chunks WHERE rowid = ?", removed)
+    elapsed = time.perf_counter() - start
+    kept = len(known) - len(removed)
+    rate = added / elapsed if elapsed > 0 else float("inf")
+    print(f"Index updated in {elapsed:.2f}s: {added} embedded ({rate:.0f} chunks/sec), "
+          f"{kept} unchanged, {len(removed)} removed.\n")
+    return {"added": added, "unchanged": kept, "removed": len(removed)}
 
 
 # SEMANTIC SEARCH
@@ -183,28 +438,26 @@ def build_index_from_document(conn, chunks):
 # Create a function to perform semantic search on the vector embeddings database,
 # using the KNN search algorithm for similarity search with sqlite-vec.
 # KNN runs inside the DB: embed query, MATCH in SQL, return top k. Score = 1 - distance (higher = more similar).
-def search_embed_sql(conn, query, k=3):
-    query_vec = embed(query)
-    query_blob = serialize_float32(query_vec)
-    cur = conn.execute(
-        """
+# One statement does the whole lookup: the CTE finds the k nearest rowids in vec_chunks,
+# and the join on rowid pulls in each chunk's text, so a search is one round trip instead of k + 1.
+# Because the SQL is one constant string, sqlite3's per-connection statement cache
+# prepares it once and reuses it on every later search.
+SEARCH_SQL = """
+    WITH knn AS (
         SELECT rowid, distance
         FROM vec_chunks
-        WHERE embedding MATCH ?
-        ORDER BY distance
-        LIMIT ?
-        """,
-        (query_blob, k)
+        WHERE embedding MATCH ? AND k = ?
     )
-    rows = cur.fetchall()
-    if not rows:
-        return []
-    out = []
-    for rowid, distance in rows:
-        (text,) = conn.execute("SELECT text FROM chunks WHERE id = ?", (rowid,)).fetchone()
-        score = 1 - distance
-        out.append({"id": rowid, "score": score, "text": text})
-    return out
+    SELECT chunks.id, 1 - knn.distance AS score, chunks.text
+    FROM knn
+    JOIN chunks ON chunks.id = knn.rowid
+    ORDER BY knn.distance
+"""
+
+def search_embed_sql(conn, query, k=3):
+    query_blob = embed_query(query)  # cached: repeated queries skip the model
+    rows = conn.execute(SEARCH_SQL, (query_blob, k)).fetchall()
+    return [{"id": i, "score": score, "text": text} for i, score, text in rows]
 
 # Connect and load sqlite-vec.
 def connect_db(path=DB_PATH):
@@ -222,33 +475,27 @@ print("--------------------------------")
 
 # Finally, in this section, we'll put it all together and build the index from the document.
 
-# Read in the document into meaningful chunks, where each chunk is a sentence.
+# Read in the document as meaningful chunks of whole sentences.
+# get_text() is a generator: nothing is read until the indexer below asks for chunks.
 chunks = get_text(DOCUMENT)
-n = len(chunks)
-print(f"Found {n} chunks in the document.")
 
 
 
 conn = connect_db(DB_PATH)
 
-# Create the chunks table and vec_chunks virtual table.
-# vec0 virtual table: rowid, embedding (float32). Cosine distance for similarity search.
-# We keep id and text in chunks so we can join after MATCH.
-conn.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, text TEXT NOT NULL)")
-conn.execute("DROP TABLE IF EXISTS vec_chunks")
-conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS vec_chunks USING vec0(embedding float[{VEC_DIM}] distance_metric=cosine)")
-conn.commit()
-
-# Construct the embedding database (takes longer for larger text documents)
-n_chunks = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
-if n_chunks == 0:
-    import time
-    start = time.perf_counter()
-    build_index_from_document(conn, chunks)
-    elapsed = time.perf_counter() - start
-    print(f"Time taken to build index: {elapsed:.2f} seconds\n")
-else:
-    print("Using existing embedding index.\n")
+# Create the chunks table and vec_chunks virtual table
+# (dropped and rebuilt only if EMBED_MODEL or VEC_DIM changed since the last run).
+prepare_index(conn)
+
+# Construct the embedding database. The first run embeds everything (takes longer for
+# larger text documents); later runs only embed new or edited chunks and drop removed ones.
+build_index_from_document(conn, chunks, source=DOCUMENT)
+
+# Want the whole NY Rising corpus? Each plan streams through the same chunker and
+# indexer one file at a time, so memory stays flat however many plans there are.
+if INDEX_PLANS:
+    for path in sorted(glob.glob(os.path.join(PLANS_DIR, "*.txt"))):
+        build_index_from_document(conn, get_text(path), source=path)
 #
 # conn.execute("SELECT * FROM chunks LIMIT 3;").fetchall()
 # conn.execute("SELECT * FROM vec_chunks LIMIT 3;").fetchall()
@@ -328,5 +575,8 @@ result3 = agent_run(role=role, task=f"{query} | {context}", model=MODEL)
 print(result3)
 print(json.loads(result3))  # parse the JSON string!
 
+# How often did searches reuse a cached query vector instead of running the model?
+print(f"Query embedding cache: {QUERY_CACHE.stats()}")
+
 # Disconnect from the database
 conn.close()
@@ -0,0 +1,168 @@
+# bench_search.py
+# Benchmark: Semantic Search Latency in SQLite + sqlite-vec
+# Pairs with ../05_embed.py
+# Tim Fraser
+
+# How long does one semantic search take once the query is embedded?
+# We fill an in-memory database with random unit vectors (same tables as 05_embed.py),
+# then time two ways of getting the top-k chunks and their text:
+# - "lookup": KNN query, then one SELECT per hit for the text (k + 1 round trips)
+# - "join":   SEARCH_SQL from 05_embed.py, KNN + text in one prepared statement
+# For each k we report per-query p50/p95/p99 latency and the speedup.
+# No embedding model is needed; query vectors are random too.
+
+# Run from the repository root:
+# python 07_rag/bench/bench_search.py
+# python 07_rag/bench/bench_search.py --chunks 20000 --queries 500 --k 3 20 100
+
+# 0. SETUP ###################################
+
+## 0.1 Load Packages #################################
+
+import argparse  # for command-line options
+import ast  # for reading SEARCH_SQL without running 05_embed.py
+import json  # for --json output
+import sqlite3  # for the database
+import statistics  # for the mean
+import sys  # for exit codes
+import time  # for timing queries
+from pathlib import Path  # for file paths
+
+import numpy as np  # for random vectors
+from sqlite_vec import load as sqlite_vec_load, serialize_float32
+
+bench_dir = Path(__file__).resolve().parent
+EMBED_SCRIPT = bench_dir.parent / "05_embed.py"
+
+
+# 1. HELPERS ###################################
+
+
+def load_search_sql(path=EMBED_SCRIPT):
+    """Read the SEARCH_SQL constant from 05_embed.py (running the script would start Ollama)."""
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "SEARCH_SQL" for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError(f"SEARCH_SQL not found in {path}")
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile (q between 0 and 100)."""
+    values = sorted(values)
+    if not values: return float("nan")
+    if len(values) == 1: return values[0]
+    pos = (len(values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def summarize(name, k, latencies):
+    """Turn per-query latencies (seconds) into one result row."""
+    ms = [x * 1000 for x in latencies]
+    return {
+        "scenario": name,
+        "k": k,
+        "queries": len(latencies),
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "mean_ms": round(statistics.mean(ms), 3),
+    }
+
+
+def random_unit_vectors(n, dim, rng):
+    vecs = rng.standard_normal((n, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def build_db(n_chunks, dim, rng):
+    """In-memory copy of the 05_embed.py index filled with random vectors."""
+    conn = sqlite3.connect(":memory:")
+    conn.enable_load_extension(True)
+    sqlite_vec_load(conn)
+    conn.enable_load_extension(False)
+    conn.execute("CREATE TABLE chunks (id INTEGER PRIMARY KEY, text TEXT NOT NULL)")
+    conn.execute(f"CREATE VIRTUAL TABLE vec_chunks USING vec0(embedding float[{dim}] distance_metric=cosine)")
+    vecs = random_unit_vectors(n_chunks, dim, rng)
+    with conn:
+        conn.executemany("INSERT INTO chunks (id, text) VALUES (?, ?)",
+                         ((i, f"chunk {i} " + "text " * 40) for i in range(n_chunks)))
+        conn.executemany("INSERT INTO vec_chunks (rowid, embedding) VALUES (?, ?)",
+                         ((i, row.tobytes()) for i, row in enumerate(vecs)))
+    return conn
+
+
+# 2. SCENARIOS ###################################
+
+
+def search_lookup(conn, blob, k):
+    """The old search_embed_sql(): KNN, then one text lookup per hit."""
+    rows = conn.execute(
+        "SELECT rowid, distance FROM vec_chunks WHERE embedding MATCH ? ORDER BY distance LIMIT ?",
+        (blob, k)
+    ).fetchall()
+    out = []
+    for rowid, distance in rows:
+        (text,) = conn.execute("SELECT text FROM chunks WHERE id = ?", (rowid,)).fetchone()
+        out.append({"id": rowid, "score": 1 - distance, "text": text})
+    return out
+
+
+def search_join(conn, blob, k, sql):
+    """The current search_embed_sql(): one statement for KNN + text."""
+    rows = conn.execute(sql, (blob, k)).fetchall()
+    return [{"id": i, "score": score, "text": text} for i, score, text in rows]
+
+
+def bench(name, fn, queries, k):
+    latencies = []
+    for blob in queries:
+        start = time.perf_counter()
+        fn(blob, k)
+        latencies.append(time.perf_counter() - start)
+    return summarize(name, k, latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark semantic search queries in sqlite-vec.")
+    parser.add_argument("--chunks", type=int, default=5000, help="vectors in the index (default: 5000)")
+    parser.add_argument("--queries", type=int, default=200, help="queries per scenario (default: 200)")
+    parser.add_argument("--dim", type=int, default=384, help="vector size (default: 384, all-MiniLM-L6-v2)")
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 20, 100], help="top-k values to test")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    sql = load_search_sql()
+    conn = build_db(args.chunks, args.dim, rng)
+    queries = [serialize_float32(v.tolist()) for v in random_unit_vectors(args.queries, args.dim, rng)]
+
+    rows = []
+    for k in args.k:
+        # Both paths must return the same chunks before we compare their speed
+        for blob in queries[:5]:
+            a = [r["id"] for r in search_lookup(conn, blob, k)]
+            b = [r["id"] for r in search_join(conn, blob, k, sql)]
+            if a != b: sys.exit(f"k={k}: lookup and join returned different chunks")
+        search_join(conn, queries[0], k, sql)  # warm up the statement cache
+        rows.append(bench("lookup", lambda blob, k: search_lookup(conn, blob, k), queries, k))
+        rows.append(bench("join", lambda blob, k: search_join(conn, blob, k, sql), queries, k))
+    conn.close()
+
+    if args.json:
+        for row in rows: print(json.dumps(row))
+        return
+    print(f"Index: {args.chunks} chunks x {args.dim} dims, {args.queries} queries per scenario")
+    print(f"{'scenario':<10} {'k':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'speedup':>8}")
+    for lookup, join in zip(rows[::2], rows[1::2]):
+        speedup = lookup["p50_ms"] / join["p50_ms"] if join["p50_ms"] > 0 else float("nan")
+        for r in (lookup, join):
+            extra = f"{speedup:>7.2f}x" if r is join else ""
+            print(f"{r['scenario']:<10} {r['k']:>4} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {extra:>8}")
+
+
+if __name__ == "__main__":
+    main()
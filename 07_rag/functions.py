@@ -11,7 +11,14 @@
 
 import requests  # for HTTP requests
 import json      # for working with JSON
+import os        # for reading environment variables
+import threading # for a thread-safe shared session
+import hashlib   # for hashing cache keys
+import sqlite3   # for the on-disk response cache
+import time      # for cache timestamps
+from concurrent.futures import ThreadPoolExecutor  # for warming models in parallel
 import pandas as pd  # for data manipulation
+from urllib.parse import urlsplit  # for reading OLLAMA_HOST
 
 # If you haven't already, install these packages...
 # pip install requests pandas
@@ -21,12 +28,336 @@ import pandas as pd  # for data manipulation
 # Default model and Ollama connection
 DEFAULT_MODEL = "smollm2:135m"
 PORT = 11434
-OLLAMA_HOST = f"http://localhost:{PORT}"
+
+
+def ollama_host_from_env(default=f"http://localhost:{PORT}"):
+    """
+    Read OLLAMA_HOST as a URL, so every script can be pointed at another server (or a gateway)
+    without editing it. Ollama's own setting may be just "host" or "host:port" (e.g. "0.0.0.0"),
+    so, like Ollama's client: add http:// when it's missing, use port 11434 when no scheme or
+    port is given, and connect to localhost instead of 0.0.0.0.
+    """
+    host = os.getenv("OLLAMA_HOST", "").strip().rstrip("/")
+    if not host: return default
+    parts = urlsplit(host if "://" in host else f"http://{host}")
+    name = parts.hostname or "localhost"
+    if name in ("0.0.0.0", "::"): name = "localhost"
+    if ":" in name: name = f"[{name}]"  # IPv6 address
+    if parts.port: port = f":{parts.port}"
+    else: port = "" if "://" in host else f":{PORT}"  # "http://host" means port 80, as in Ollama
+    return f"{parts.scheme}://{name}{port}{parts.path}"
+
+
+OLLAMA_HOST = ollama_host_from_env()
 CHAT_URL = f"{OLLAMA_HOST}/api/chat"
 
+## 0.3 Pooled HTTP Session #################################
+
+# Opening a brand-new connection for every chat turn is slow.
+# A requests.Session keeps connections open ("keep-alive") and reuses them,
+# so repeated agent() calls skip the TCP (and, for Ollama Cloud, TLS) handshake.
+# Set OLLAMA_POOL_SIZE to change how many connections stay open per host.
+POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "20"))
+KEEP_ALIVE = True
+
+_session = None
+_session_lock = threading.Lock()  # so parallel threads share one session
+
+
+def _new_session():
+    """Build a requests.Session with a connection pool of POOL_SIZE."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Ask the server to close the socket after each request when keep-alive is off
+    if not KEEP_ALIVE: session.headers["Connection"] = "close"
+    return session
+
+
+def get_session():
+    """Return the shared pooled HTTP session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _new_session()
+        return _session
+
+
+def configure_session(pool_size=None, keep_alive=None):
+    """
+    Rebuild the shared HTTP session with new pool settings.
+    
+    Parameters:
+    -----------
+    pool_size : int, optional
+        Maximum number of open connections kept per host (default: POOL_SIZE)
+    keep_alive : bool, optional
+        If False, close each connection after its request (default: True)
+    
+    Returns:
+    --------
+    requests.Session
+        The new shared session
+    """
+    global _session, POOL_SIZE, KEEP_ALIVE
+    if pool_size is not None: POOL_SIZE = int(pool_size)
+    if keep_alive is not None: KEEP_ALIVE = bool(keep_alive)
+    with _session_lock:
+        old, _session = _session, _new_session()
+    if old is not None: old.close()
+    return _session
+
+## 0.4 Response Cache #################################
+
+# Re-running a script often sends the exact same request to Ollama again,
+# and we pay the full generation time every time. The (opt-in) response cache
+# saves each reply in a small SQLite file, keyed on a hash of the request body,
+# so an identical request is answered from disk instead. Only requests that ask for a
+# repeatable answer are cached, e.g. agent_run(role, task, options={"temperature": 0})
+# (or a seed); without options Ollama samples, and those requests always go to the server.
+# Turn it on with enable_cache(); see how much it saved with cache_stats().
+
+CACHE_PATH = os.getenv("AGENT_CACHE_PATH", ".agent_cache.db")
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of /api/chat replies.
+    
+    - Keys are a SHA-256 hash of the canonical JSON request body (model, messages, tools, options, ...)
+    - Entries older than ttl seconds are ignored and removed
+    - When the file grows past max_bytes, the least recently used entries are evicted
+    - Only deterministic requests are cached: options.temperature set to 0, or a seed.
+      Anything else (including no temperature at all, which means Ollama's default of 0.8)
+      gives different answers each time, so it skips the cache unless cache_random=True
+    """
+    
+    def __init__(self, path=CACHE_PATH, max_bytes=100_000_000, ttl=7 * 24 * 3600, cache_random=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_random = cache_random
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_seconds = 0.0  # Ollama time we did not have to spend
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, result TEXT NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+    
+    @staticmethod
+    def key(body):
+        """Hash the request body; sorted keys make the JSON text canonical."""
+        body = {k: v for k, v in body.items() if k not in ("stream", "keep_alive")}
+        text = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+    
+    def cacheable(self, body):
+        """Return True for requests that pin their sampling (temperature 0 or a seed), or any request if cache_random."""
+        if body.get("stream"): return False
+        if self.cache_random: return True
+        options = body.get("options") or {}
+        if options.get("seed") is not None: return True
+        return options.get("temperature") is not None and options["temperature"] == 0
+    
+    def get(self, body):
+        """Return the cached reply for this body, or None."""
+        if not self.cacheable(body):
+            with self._lock: self.bypassed += 1
+            return None
+        key = self.key(body)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT result, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None: self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            result = json.loads(row[0])
+            self.saved_seconds += (result.get("total_duration") or 0) / 1e9
+        return result
+    
+    def put(self, body, result):
+        """Save a reply, then evict expired and least recently used entries."""
+        if not self.cacheable(body): return
+        text = json.dumps(result, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, result, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (self.key(body), text, len(text), now, now)
+            )
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                # Walk from least to most recently used, dropping entries until we fit
+                stale = []
+                for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                    if total <= self.max_bytes: break
+                    stale.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+            self._conn.commit()
+    
+    def stats(self):
+        """Return hit/miss counters and the current cache size."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            hits, misses, bypassed, saved = self.hits, self.misses, self.bypassed, self.saved_seconds
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "bypassed": bypassed,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "saved_seconds": saved,
+            "entries": entries,
+            "size_bytes": size,
+        }
+    
+    def clear(self):
+        """Delete every cached reply."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+_cache = None  # the active ResponseCache, or None when caching is off
+
+
+def enable_cache(path=CACHE_PATH, max_bytes=100_000_000, ttl=7 * 24 * 3600, cache_random=False):
+    """
+    Turn on the response cache for agent() and agent_run().
+    
+    Parameters:
+    -----------
+    path : str
+        SQLite file for cached replies (default: ".agent_cache.db", or AGENT_CACHE_PATH)
+    max_bytes : int
+        Evict least recently used replies past this total size (default: 100 MB)
+    ttl : float
+        Seconds before a cached reply expires (default: 7 days)
+    cache_random : bool
+        If True, also cache sampled requests: no temperature (Ollama's default) or one above 0 (default: False)
+    
+    Returns:
+    --------
+    ResponseCache
+        The active cache
+    """
+    global _cache
+    _cache = ResponseCache(path=path, max_bytes=max_bytes, ttl=ttl, cache_random=cache_random)
+    return _cache
+
+
+def disable_cache():
+    """Turn off the response cache (the file on disk is kept)."""
+    global _cache
+    _cache = None
+
+
+def cache_stats():
+    """Return hits, misses, bypassed, hit_rate, saved_seconds, entries and size_bytes (or None if off)."""
+    return None if _cache is None else _cache.stats()
+
+
+# Set AGENT_CACHE=1 to turn the cache on for every script without editing it
+if os.getenv("AGENT_CACHE", "").strip().lower() in ("1", "true", "yes", "on"): enable_cache()
+
+
+def post_chat(body):
+    """
+    POST a non-streaming /api/chat request body and return the parsed JSON reply.
+    Uses the response cache when it is turned on.
+    """
+    if MODEL_KEEP_ALIVE is not None: body.setdefault("keep_alive", MODEL_KEEP_ALIVE)
+    cache = _cache
+    if cache is not None:
+        cached = cache.get(body)
+        if cached is not None: return cached
+    response = get_session().post(CHAT_URL, json=body)
+    response.raise_for_status()
+    result = response.json()
+    if cache is not None: cache.put(body, result)
+    return result
+
+## 0.5 Model Warm-Up #################################
+
+# Ollama loads a model into memory on its first request, and unloads it after
+# 5 idle minutes by default. That first call (and the first call after a break)
+# pays the model's load time. warm_models() loads models ahead of time, in parallel,
+# and "pins" them by sending a keep_alive duration with every later request too
+# (each request resets Ollama's unload timer to its own keep_alive value).
+
+def parse_keep_alive(value):
+    """Turn a keep_alive setting into what Ollama expects: a number of seconds ("-1" -> -1), a duration ("30m"), or None."""
+    if value is None or isinstance(value, (int, float)): return value
+    value = str(value).strip()
+    if not value: return None
+    try: return int(value)  # Ollama reads the string "-1" as a bad duration
+    except ValueError: pass
+    try: return float(value)
+    except ValueError: return value
+
+
+# e.g. "30m", "2h", or -1 (keep loaded until Ollama stops); None = Ollama's default
+MODEL_KEEP_ALIVE = parse_keep_alive(os.getenv("AGENT_MODEL_KEEP_ALIVE"))
+
+
+def warm_models(models, keep_alive="30m", pin=True):
+    """
+    Load models into Ollama's memory before the first real request.
+    
+    Parameters:
+    -----------
+    models : list
+        Model names, e.g. ["smollm2:1.7b", "smollm2:135m"]
+    keep_alive : str or int
+        How long Ollama should keep each model loaded, e.g. "30m" or -1 for forever (default: "30m")
+    pin : bool
+        If True, also send this keep_alive with every later agent() request,
+        so normal traffic doesn't shorten it back to the default (default: True)
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per model: model, ok, load_seconds (Ollama's load_duration), wall_seconds, error
+    """
+    global MODEL_KEEP_ALIVE
+    keep_alive = parse_keep_alive(keep_alive)
+    if pin: MODEL_KEEP_ALIVE = keep_alive
+    
+    def warm_one(model):
+        # A chat request with no messages just loads the model
+        start = time.perf_counter()
+        try:
+            response = get_session().post(CHAT_URL, json={"model": model, "messages": [], "keep_alive": keep_alive, "stream": False})
+            response.raise_for_status()
+            data = response.json()
+            return {"model": model, "ok": True, "load_seconds": (data.get("load_duration") or 0) / 1e9,
+                    "wall_seconds": time.perf_counter() - start, "error": None}
+        except Exception as e:
+            return {"model": model, "ok": False, "load_seconds": None,
+                    "wall_seconds": time.perf_counter() - start, "error": str(e)}
+    
+    models = list(dict.fromkeys(models))  # drop duplicates, keep order
+    with ThreadPoolExecutor(max_workers=max(1, len(models))) as executor:
+        rows = list(executor.map(warm_one, models))
+    return pd.DataFrame(rows, columns=["model", "ok", "load_seconds", "wall_seconds", "error"])
+
 # 1. AGENT FUNCTION ###################################
 
-def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
+def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False, options=None):
     """
     Agent wrapper function that runs a single agent, with or without tools.
     
@@ -43,6 +374,9 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
         List of tool metadata dictionaries for function calling
     all : bool
         If True, return all responses. If False, return only the last response.
+    options : dict, optional
+        Ollama model options, e.g. {"temperature": 0}. With temperature 0 (or a seed),
+        identical requests can share one call and be cached
     
     Returns:
     --------
@@ -57,10 +391,9 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
             "messages": messages,
             "stream": False
         }
+        if options: body["options"] = options
         
-        response = requests.post(CHAT_URL, json=body)
-        response.raise_for_status()
-        result = response.json()
+        result = post_chat(body)
         
         return result["message"]["content"]
     else:
@@ -71,10 +404,9 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
             "tools": tools,
             "stream": False
         }
+        if options: body["options"] = options
         
-        response = requests.post(CHAT_URL, json=body)
-        response.raise_for_status()
-        result = response.json()
+        result = post_chat(body)
         
         # For any given tool call, execute the tool call
         if "tool_calls" in result.get("message", {}):
@@ -100,7 +432,7 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
             return result["message"]["content"]
 
 
-def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL):
+def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL, options=None):
     """
     Run an agent with a specific role and task.
     
@@ -116,6 +448,9 @@ def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL):
         Output format (default: "text")
     model : str
         Model to use (default: DEFAULT_MODEL)
+    options : dict, optional
+        Ollama model options, e.g. {"temperature": 0}. With temperature 0 (or a seed),
+        identical requests can share one call and be cached
     
     Returns:
     --------
@@ -130,28 +465,150 @@ def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL):
     ]
     
     # Run the agent
-    resp = agent(messages=messages, model=model, output=output, tools=tools)
+    resp = agent(messages=messages, model=model, output=output, tools=tools, options=options)
     return resp
 
 
 # 2. DATA CONVERSION FUNCTION ###################################
 
-def df_as_text(df):
+# Markdown tables are easy to read, but the padding spaces, pipes and dashes
+# cost prompt tokens, and every token makes Ollama's prompt evaluation slower.
+# df_as_text() can also write more compact encodings:
+# - "csv" / "tsv": one line per row, no padding
+# - "json": column-oriented JSON, {"column": [values, ...], ...}
+# - "dict": TSV where repeated text values (like a category) are replaced by short codes,
+#   with a small dictionary of codes above the table
+# With max_tokens, rows are sampled (or summarized) until the text fits the budget.
+# df_text_report() compares the estimated tokens of every encoding for a DataFrame.
+
+TEXT_FORMATS = ("markdown", "csv", "tsv", "json", "dict")
+CHARS_PER_TOKEN = 4  # rough average for English text and numbers
+
+
+def estimate_tokens(text):
+    """Rough token count for a string (about 4 characters per token)."""
+    return -(-len(text) // CHARS_PER_TOKEN)  # round up
+
+
+def _dict_encode(df, max_share=0.5):
+    """Replace repeated text values with integer codes; return (code legend text, coded DataFrame)."""
+    coded = df.copy()
+    legend = []
+    for col in df.columns:
+        values = df[col]
+        if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)
+                or isinstance(values.dtype, pd.CategoricalDtype)):
+            continue
+        n_unique = values.nunique(dropna=True)
+        # Only worth it when values repeat
+        if n_unique == 0 or n_unique > max_share * len(values): continue
+        codes = {v: i for i, v in enumerate(pd.unique(values.dropna()))}
+        coded[col] = values.map(codes).astype("Int64")
+        legend.append(f"{col}: " + "; ".join(f"{i}={v}" for v, i in codes.items()))
+    return "\n".join(legend), coded
+
+
+def _encode(df, format):
+    """Write a DataFrame as text in one of TEXT_FORMATS."""
+    if format == "markdown": return df.to_markdown(index=False)
+    if format == "csv": return df.to_csv(index=False).strip()
+    if format == "tsv": return df.to_csv(index=False, sep="\t").strip()
+    if format == "json":
+        return json.dumps({col: df[col].tolist() for col in df.columns},
+                          default=str, ensure_ascii=False, separators=(",", ":"))
+    if format == "dict":
+        legend, coded = _dict_encode(df)
+        table = coded.to_csv(index=False, sep="\t").strip()
+        return f"Codes:\n{legend}\n\n{table}" if legend else table
+    raise ValueError(f"format must be one of {TEXT_FORMATS}, not {format!r}")
+
+
+def _summarize_df(df):
+    """Aggregate a DataFrame into a short summary: numeric statistics plus the top text values."""
+    parts = [f"{len(df)} rows summarized."]
+    numeric = df.select_dtypes("number")
+    if not numeric.empty:
+        parts.append(numeric.describe().T[["count", "mean", "min", "max"]].round(3).reset_index(names="column"))
+    for col in df.columns.drop(numeric.columns):
+        top = df[col].astype(str).value_counts().head(5)
+        parts.append(f"{col} (top values): " + "; ".join(f"{v} ({n})" for v, n in top.items()))
+    return parts
+
+
+def df_as_text(df, format="markdown", max_tokens=None, reduce="sample"):
     """
-    Convert a pandas DataFrame to a markdown table string.
+    Convert a pandas DataFrame to a text table for a prompt.
     
     Parameters:
     -----------
     df : pandas.DataFrame
         The DataFrame to convert to text
+    format : str
+        One of "markdown" (default), "csv", "tsv", "json" (column-oriented) or "dict" (coded categories)
+    max_tokens : int, optional
+        Estimated token budget for the text (default: no limit)
+    reduce : str
+        How to fit max_tokens: "sample" keeps evenly spaced rows, "aggregate" summarizes the columns
+        (only the first ones, if the summary of every column is still too long)
     
     Returns:
     --------
     str
-        A markdown-formatted table string
+        The table as text (with a note saying how many rows are shown, if it was reduced)
     """
     
-    # Convert DataFrame to markdown table
-    # pandas to_markdown() method creates markdown tables
-    tab = df.to_markdown(index=False)
-    return tab
+    text = _encode(df, format)
+    if max_tokens is None or estimate_tokens(text) <= max_tokens: return text
+    
+    if reduce == "aggregate":
+        # A wide frame's summary can itself be too long: then summarize only the first columns
+        def summarized(n):
+            parts = _summarize_df(df.iloc[:, :n])
+            summary = "\n".join(_encode(p, format) if isinstance(p, pd.DataFrame) else p for p in parts)
+            if n == len(df.columns): return summary
+            return f"(summarizing {n} of {len(df.columns)} columns)\n{summary}"
+        
+        summary = summarized(len(df.columns))
+        if estimate_tokens(summary) <= max_tokens: return summary
+        return _largest_fit(summarized, len(df.columns) - 1, max_tokens)
+    if reduce != "sample": raise ValueError("reduce must be 'sample' or 'aggregate'")
+    if len(df) < 2: return text
+    
+    def sampled(n):
+        rows = sorted({round(i * (len(df) - 1) / max(1, n - 1)) for i in range(n)}) if n > 1 else [0]
+        note = f"(showing {n} of {len(df)} rows, evenly sampled)"
+        return f"{note}\n{_encode(df.iloc[rows], format)}"
+    
+    return _largest_fit(sampled, len(df) - 1, max_tokens)
+
+
+def _largest_fit(build, n_max, max_tokens):
+    """Binary search for the largest n (1..n_max) whose build(n) fits max_tokens; build(1) if none does."""
+    lo, hi, best = 1, n_max, build(1)
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        candidate = build(mid)
+        if estimate_tokens(candidate) <= max_tokens:
+            best, lo = candidate, mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+
+def df_text_report(df, formats=TEXT_FORMATS):
+    """
+    Compare the estimated prompt tokens of each text encoding of a DataFrame.
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per format: format, chars, est_tokens, vs_markdown (share of the markdown tokens)
+    """
+    rows = []
+    for format in formats:
+        text = _encode(df, format)
+        rows.append({"format": format, "chars": len(text), "est_tokens": estimate_tokens(text)})
+    report = pd.DataFrame(rows)
+    base = estimate_tokens(_encode(df, "markdown"))
+    report["vs_markdown"] = (report["est_tokens"] / base).round(3) if base else None
+    return report.sort_values("est_tokens", ignore_index=True)
@@ -20,7 +20,7 @@ import pandas as pd  # for data manipulation
 ## 0.2 Load Functions #################################
 
 # Load helper functions for agent orchestration
-from functions import agent
+from functions import agent, register_tool
 
 ## 0.3 Configuration #################################
 
@@ -113,6 +113,11 @@ tool_get_table = {
     }
 }
 
+# Register each function with its metadata, so agent() can find the function by name
+# and check the model's arguments before running it
+register_tool(add_two_numbers, tool_add_two_numbers)
+register_tool(get_table, tool_get_table)
+
 # 3. EXAMPLE 1: STANDARD CHAT (NO TOOLS) ###################################
 
 # Trying to call a standard chat without tools
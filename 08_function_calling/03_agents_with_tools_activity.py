@@ -5,8 +5,7 @@
 # 0. SETUP ###################################
 
 import json
-import functions
-from functions import agent
+from functions import agent, register_tool
 
 # Select model
 MODEL = "smollm2:1.7b"
@@ -17,10 +16,6 @@ def calculate_average(numbers):
     """Calculate the average of a list of numbers."""
     return sum(numbers) / len(numbers)
 
-# Register the function in the functions module's global scope
-# so that agent() can find it via globals().get(func_name)
-functions.calculate_average = calculate_average
-
 # 2. DEFINE TOOL METADATA ###################################
 
 tool_calculate_average = {
@@ -42,6 +37,9 @@ tool_calculate_average = {
     }
 }
 
+# Register the function with its metadata, so agent() can find it by name
+register_tool(calculate_average, tool_calculate_average)
+
 # 3. TEST THE TOOL WITH AGENT ###################################
 
 messages = [
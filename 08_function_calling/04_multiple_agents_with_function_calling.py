@@ -21,7 +21,7 @@ from datetime import datetime  # for date parsing
 ## 0.2 Load Functions #################################
 
 # Load helper functions for agent orchestration
-from functions import agent_run, df_as_text
+from functions import agent_run, df_as_text, register_tool, Workflow
 
 ## 0.3 Configuration #################################
 
@@ -130,47 +130,73 @@ tool_get_shortages = {
     }
 }
 
+# Register the function with its metadata, so agent_run() can call it by name
+register_tool(get_shortages, tool_get_shortages)
+
 # 3. MULTI-AGENT WORKFLOW ###################################
 
 # Let's create an agentic workflow with function calling.
+# We declare it as a Workflow: a graph of steps, where each step names the results it needs.
+# Steps for different categories don't depend on each other, so they run at the same time;
+# within a category, fetch -> analyze still runs in order. Add categories to fan out.
+CATEGORIES = ["Psychiatry"]
+
+wf = Workflow()
 
 # Agent 1: Data Fetcher (with tools)
 # This agent uses the get_shortages tool to fetch data from the API
-task = "Get data on drug shortages for the category Psychiatry with limit 10"
 role1 = "I fetch information from the FDA Drug Shortages API"
-result1_calls = agent_run(role=role1, task=task, model=MODEL, output="tools", tools=[tool_get_shortages])
-
-# When output="tools", agent_run() returns a list of tool_calls.
-# The actual tool output is stored at tool_call["output"].
-result1_df = (
-    result1_calls[0].get("output")
-    if isinstance(result1_calls, list) and len(result1_calls) > 0
-    else None
-)
 
-# Convert it to text for the next agent (keep prompt small)
-result1_text = df_as_text(result1_df.head(10))
+
+def fetch(category):
+    task = f"Get data on drug shortages for the category {category} with limit 10"
+    calls = agent_run(role=role1, task=task, model=MODEL, output="tools", tools=[tool_get_shortages])
+    # When output="tools", agent_run() returns a list of tool_calls.
+    # The actual tool output is stored at tool_call["output"].
+    return calls[0].get("output") if isinstance(calls, list) and len(calls) > 0 else None
+
 
 # Agent 2: Data Analyst (no tools)
 # This agent analyzes the data and returns a markdown table
 role2 = "I analyze data in a table format and return a markdown table of currently ongoing shortages."
-result2 = agent_run(role=role2, task=result1_text, model=MODEL, output="text", tools=None)
+
+
+def analyze(df):
+    # Convert it to text for the next agent (keep prompt small)
+    return agent_run(role=role2, task=df_as_text(df.head(10)), model=MODEL, output="text", tools=None)
+
+
+for category in CATEGORIES:
+    wf.node(f"data_{category}", fetch, kwargs={"category": category})
+    wf.node(f"analysis_{category}", analyze, inputs=[f"data_{category}"])
 
 # Agent 3: Press Release Writer (no tools)
-# This agent writes a press release based on the analysis
+# This agent writes a press release based on the analysis (of every category)
 role3 = "I write a 1-page press release on the currently ongoing shortages."
-result3 = agent_run(role=role3, task=result2, model=MODEL, output="text", tools=None)
+wf.node(
+    "press_release",
+    lambda *analyses: agent_run(role=role3, task="\n\n".join(analyses), model=MODEL, output="text", tools=None),
+    inputs=[f"analysis_{category}" for category in CATEGORIES],
+)
+
+results = wf.run()
 
 # 4. VIEW RESULTS ###################################
 
-print("Agent 1 Result (Data Fetch):")
-print(f"Retrieved {len(result1_df)} records")
-print(result1_df.head())
-print()
+for category in CATEGORIES:
+    result1_df = results[f"data_{category}"]
+    print(f"Agent 1 Result (Data Fetch, {category}):")
+    print(f"Retrieved {len(result1_df)} records")
+    print(result1_df.head())
+    print()
 
-print("Agent 2 Result (Analysis):")
-print(result2)
-print()
+    print(f"Agent 2 Result (Analysis, {category}):")
+    print(results[f"analysis_{category}"])
+    print()
 
 print("Agent 3 Result (Press Release):")
-print(result3)
+print(results["press_release"])
+print()
+
+# How long each step took
+print(wf.timings())
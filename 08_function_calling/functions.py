@@ -11,9 +11,20 @@
 
 import requests  # for HTTP requests
 import json      # for working with JSON
+import os        # for reading environment variables
+import sys       # for finding tools defined in the running script
+import threading # for a thread-safe shared session
 import pandas as pd  # for data manipulation
-import sys       # for stack frame inspection
+import inspect   # for reading tool function signatures
 import time      # for simple polling/retry
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED  # for running workflow nodes concurrently
+from urllib.parse import urlsplit  # for reading OLLAMA_HOST
+
+# jsonschema is optional; without it, tool arguments are checked with a small built-in validator
+try:
+    import jsonschema
+except ImportError:
+    jsonschema = None
 
 # If you haven't already, install these packages...
 # pip install requests pandas
@@ -23,36 +34,440 @@ import time      # for simple polling/retry
 # Default model and Ollama connection
 DEFAULT_MODEL = "smollm2:1.7b"
 PORT = 11434
-OLLAMA_HOST = f"http://localhost:{PORT}"
+
+
+def ollama_host_from_env(default=f"http://localhost:{PORT}"):
+    """
+    Read OLLAMA_HOST as a URL, so every script can be pointed at another server (or a gateway)
+    without editing it. Ollama's own setting may be just "host" or "host:port" (e.g. "0.0.0.0"),
+    so, like Ollama's client: add http:// when it's missing, use port 11434 when no scheme or
+    port is given, and connect to localhost instead of 0.0.0.0.
+    """
+    host = os.getenv("OLLAMA_HOST", "").strip().rstrip("/")
+    if not host: return default
+    parts = urlsplit(host if "://" in host else f"http://{host}")
+    name = parts.hostname or "localhost"
+    if name in ("0.0.0.0", "::"): name = "localhost"
+    if ":" in name: name = f"[{name}]"  # IPv6 address
+    if parts.port: port = f":{parts.port}"
+    else: port = "" if "://" in host else f":{PORT}"  # "http://host" means port 80, as in Ollama
+    return f"{parts.scheme}://{name}{port}{parts.path}"
+
+
+OLLAMA_HOST = ollama_host_from_env()
 CHAT_URL = f"{OLLAMA_HOST}/api/chat"
 REQUEST_TIMEOUT = 300  # seconds; avoid hanging indefinitely on network/model issues
 OLLAMA_TAGS_URL = f"{OLLAMA_HOST}/api/tags"
 
+## 0.3 Pooled HTTP Session #################################
 
-def ensure_ollama_available(max_wait_seconds: int = 15, poll_interval_seconds: float = 0.5) -> None:
+# Opening a brand-new connection for every chat turn is slow.
+# A requests.Session keeps connections open ("keep-alive") and reuses them,
+# so repeated agent() calls skip the TCP (and, for Ollama Cloud, TLS) handshake.
+# Set OLLAMA_POOL_SIZE to change how many connections stay open per host.
+POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "20"))
+KEEP_ALIVE = True
+
+_session = None
+_session_lock = threading.Lock()  # so parallel threads share one session
+
+
+def _new_session():
+    """Build a requests.Session with a connection pool of POOL_SIZE."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Ask the server to close the socket after each request when keep-alive is off
+    if not KEEP_ALIVE: session.headers["Connection"] = "close"
+    return session
+
+
+def get_session():
+    """Return the shared pooled HTTP session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _new_session()
+        return _session
+
+
+def configure_session(pool_size=None, keep_alive=None):
     """
-    Fail fast with a helpful message if Ollama isn't reachable.
+    Rebuild the shared HTTP session with new pool settings.
+    
+    Parameters:
+    -----------
+    pool_size : int, optional
+        Maximum number of open connections kept per host (default: POOL_SIZE)
+    keep_alive : bool, optional
+        If False, close each connection after its request (default: True)
+    
+    Returns:
+    --------
+    requests.Session
+        The new shared session
     """
-    deadline = time.time() + max_wait_seconds
-    last_err = None
-    while time.time() < deadline:
+    global _session, POOL_SIZE, KEEP_ALIVE
+    if pool_size is not None: POOL_SIZE = int(pool_size)
+    if keep_alive is not None: KEEP_ALIVE = bool(keep_alive)
+    with _session_lock:
+        old, _session = _session, _new_session()
+    if old is not None: old.close()
+    return _session
+
+
+## 0.4 Ollama Health Check #################################
+
+# Checking /api/tags before every chat adds an extra round trip, and when Ollama is down
+# every call used to wait up to 15 seconds. Instead, we keep one process-wide health state
+# that works like a "circuit breaker":
+# - closed:    Ollama answered recently, so calls skip the check entirely
+# - open:      Ollama is down, so calls fail immediately (no waiting) until a cooldown passes
+# - half_open: the cooldown passed; one quick probe decides whether to close or re-open
+HEALTH_TTL = 60        # seconds a healthy check is trusted
+BREAKER_COOLDOWN = 10  # seconds to fail fast before probing Ollama again
+
+
+class OllamaHealth:
+    """Process-wide Ollama health state with a closed/open/half-open circuit breaker."""
+    
+    def __init__(self, ttl: float = HEALTH_TTL, cooldown: float = BREAKER_COOLDOWN):
+        self.ttl = ttl
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.last_ok = 0.0     # time.monotonic() of the last success (0 = never)
+        self.opened_at = 0.0   # time.monotonic() when the breaker opened
+        self.last_error = None
+        self._lock = threading.Lock()
+    
+    def record_success(self) -> None:
+        """Mark Ollama healthy (called after any successful request)."""
+        with self._lock:
+            self.state = "closed"
+            self.last_ok = time.monotonic()
+            self.last_error = None
+    
+    def record_failure(self, err) -> None:
+        """Open the breaker after a failed probe or connection error."""
+        with self._lock:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.last_error = err
+    
+    def error(self) -> RuntimeError:
+        wait = max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+        return RuntimeError(
+            f"Ollama is not reachable at {OLLAMA_HOST} (circuit {self.state}; next check in {wait:.0f}s). "
+            "Start it first with: `python 08_function_calling/01_ollama.py`.\n"
+            f"Last error: {self.last_error}"
+        )
+    
+    def _probe(self):
+        """One quick GET /api/tags; return None if healthy, else the error."""
         try:
-            r = requests.get(OLLAMA_TAGS_URL, timeout=5)
-            if r.ok:
+            r = get_session().get(OLLAMA_TAGS_URL, timeout=5)
+            return None if r.ok else RuntimeError(f"HTTP {r.status_code} from {OLLAMA_TAGS_URL}")
+        except requests.RequestException as e:
+            return e
+    
+    def check(self, max_wait_seconds: float = 15, poll_interval_seconds: float = 0.5) -> None:
+        """Return if Ollama is (recently known to be) up; raise RuntimeError otherwise."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "closed" and self.last_ok and now - self.last_ok < self.ttl:
                 return
-        except Exception as e:
-            last_err = e
-        time.sleep(poll_interval_seconds)
+            if self.state == "half_open" or (self.state == "open" and now - self.opened_at < self.cooldown):
+                raise self.error()
+            # Only the very first check waits for a server that may still be starting up;
+            # after that, a single quick probe decides.
+            wait = max_wait_seconds if (self.state == "closed" and not self.last_ok) else 0
+            if self.state == "open": self.state = "half_open"
+        
+        # Whatever happens from here (even Ctrl+C while polling), leave half_open behind
+        deadline = time.monotonic() + wait
+        try:
+            while True:
+                err = self._probe()
+                if err is None:
+                    self.record_success()
+                    return
+                if time.monotonic() + poll_interval_seconds >= deadline: break
+                time.sleep(poll_interval_seconds)
+        except BaseException as e:
+            self.record_failure(e)
+            raise
+        self.record_failure(err)
+        raise self.error()
+
+
+OLLAMA_HEALTH = OllamaHealth()
+
+
+def ensure_ollama_available(max_wait_seconds: int = 15, poll_interval_seconds: float = 0.5) -> None:
+    """
+    Fail fast with a helpful message if Ollama isn't reachable.
+    Uses the shared OLLAMA_HEALTH state, so it is free while Ollama is known to be up.
+    """
+    OLLAMA_HEALTH.check(max_wait_seconds, poll_interval_seconds)
+
+
+def post_chat(body):
+    """POST a non-streaming /api/chat request body, update OLLAMA_HEALTH, and return the parsed JSON."""
+    try:
+        response = get_session().post(CHAT_URL, json=body, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+    except requests.ConnectionError as e:
+        OLLAMA_HEALTH.record_failure(e)
+        raise
+    except requests.HTTPError as e:
+        # A 5xx means Ollama itself is in trouble; a 4xx is a problem with this request
+        if response.status_code >= 500: OLLAMA_HEALTH.record_failure(e)
+        raise
+    OLLAMA_HEALTH.record_success()
+    return response.json()
+
+# 1. TOOL REGISTRY ###################################
+
+# agent() needs to turn a tool name from the model (e.g. "get_shortages") into a Python function.
+# A ToolRegistry is a dictionary of name -> function, plus each tool's metadata.
+# Registering a tool once lets agent():
+# - find the function with one dictionary lookup
+# - check the model's arguments against the tool's JSON schema *before* running it
+# - build the `tools` metadata list that Ollama expects
+
+# Python type hints -> JSON schema types, for tools registered without metadata
+JSON_TYPES = {int: "integer", float: "number", str: "string", bool: "boolean", list: "array", dict: "object"}
+
+
+class ToolArgumentError(ValueError):
+    """Raised when a tool call's arguments do not match the tool's schema."""
+
+
+def _type_ok(value, kind):
+    """Check one value against a JSON schema type name."""
+    if kind == "integer": return isinstance(value, int) and not isinstance(value, bool) or (isinstance(value, float) and value.is_integer())
+    if kind == "number": return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind == "string": return isinstance(value, str)
+    if kind == "boolean": return isinstance(value, bool)
+    if kind == "array": return isinstance(value, list)
+    if kind == "object": return isinstance(value, dict)
+    if kind == "null": return value is None
+    return True  # unknown types are not checked
+
+
+def compile_validator(schema, root="value"):
+    """
+    Turn a JSON schema into a function that returns a list of error messages (empty = valid).
+    Uses the jsonschema package when it is installed; otherwise checks type, required,
+    properties, enum, minimum/maximum and items, which covers tool and output schemas.
+    `root` names the checked value in messages (e.g. "arguments" or "output").
+    The same validator is in 06_agents/functions.py; keep the two copies in sync.
+    """
+    if jsonschema is not None:
+        checker = jsonschema.validators.validator_for(schema)(schema)
+        return lambda value: [e.message for e in checker.iter_errors(value)]
+    
+    def build(sub, path):
+        checks = []
+        kinds = sub.get("type")
+        if kinds is not None:
+            kinds = kinds if isinstance(kinds, list) else [kinds]
+            checks.append(lambda v: [] if any(_type_ok(v, k) for k in kinds) else [f"{path}: expected {' or '.join(kinds)}, got {type(v).__name__}"])
+        if "enum" in sub:
+            options = sub["enum"]
+            checks.append(lambda v: [] if v in options else [f"{path}: {v!r} is not one of {options}"])
+        if "minimum" in sub or "maximum" in sub:
+            lo, hi = sub.get("minimum"), sub.get("maximum")
+            def check_range(v):
+                if not _type_ok(v, "number"): return []
+                if lo is not None and v < lo: return [f"{path}: {v} is less than the minimum of {lo}"]
+                if hi is not None and v > hi: return [f"{path}: {v} is greater than the maximum of {hi}"]
+                return []
+            checks.append(check_range)
+        required = sub.get("required") or []
+        props = {k: build(s, f"{path}.{k}") for k, s in (sub.get("properties") or {}).items()}
+        if required or props:
+            def check_object(v):
+                if not isinstance(v, dict): return []
+                errs = [f"{path}: missing required field '{k}'" for k in required if k not in v]
+                for k, check in props.items():
+                    if k in v: errs += check(v[k])
+                return errs
+            checks.append(check_object)
+        if "items" in sub:
+            check_item = build(sub["items"], f"{path}[]")
+            checks.append(lambda v: [e for item in v for e in check_item(item)] if isinstance(v, list) else [])
+        return lambda v: [e for check in checks for e in check(v)]
+    
+    return build(schema, root)
+
+
+def schema_from_signature(func):
+    """Build a JSON schema for a function's arguments from its signature and type hints."""
+    properties, required = {}, []
+    for name, param in inspect.signature(func).parameters.items():
+        if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD): continue
+        kind = JSON_TYPES.get(param.annotation)
+        properties[name] = {"type": kind} if kind else {}
+        if param.default is param.empty: required.append(name)
+    return {"type": "object", "required": required, "properties": properties}
+
+
+class ToolRegistry:
+    """
+    A dictionary of tools that agent() can call.
+    
+    Example:
+    --------
+    TOOLS.register(add_two_numbers, tool_add_two_numbers)  # existing metadata
+    
+    @TOOLS.register(description="Add two numbers")         # or build metadata from the signature
+    def add_two_numbers(x: float, y: float):
+        return x + y
+    
+    agent(messages, tools=TOOLS.metadata(["add_two_numbers"]))
+    """
+    
+    def __init__(self):
+        self._tools = {}  # name -> {"func", "metadata", "validate"}
+    
+    def register(self, func=None, metadata=None, name=None, description=None, parameters=None):
+        """
+        Register a function as a tool. Works as a plain call or as a decorator.
+        
+        Parameters:
+        -----------
+        func : function
+            The tool function
+        metadata : dict, optional
+            Ollama tool metadata ({"type": "function", "function": {...}}); built from func if missing
+        name, description, parameters : optional
+            Override the tool name, description, or JSON schema for its arguments
+        
+        Returns:
+        --------
+        function
+            func, unchanged (so it can be used as a decorator)
+        """
+        if func is None:
+            return lambda f: self.register(f, metadata=metadata, name=name, description=description, parameters=parameters)
+        if metadata is None:
+            doc = (inspect.getdoc(func) or "").strip().split("\n")[0]
+            metadata = {
+                "type": "function",
+                "function": {
+                    "name": name or func.__name__,
+                    "description": description or doc,
+                    "parameters": parameters or schema_from_signature(func),
+                },
+            }
+        spec = metadata["function"]
+        tool_name = name or spec["name"]
+        self._tools[tool_name] = {
+            "func": func,
+            "metadata": metadata,
+            # Compile the argument checker once, here, instead of on every call
+            "validate": compile_validator(spec.get("parameters") or {"type": "object"}, root="arguments"),
+        }
+        return func
+    
+    def get(self, name):
+        """Return the function registered under name, or None."""
+        entry = self._tools.get(name)
+        return entry["func"] if entry else None
+    
+    def validate(self, name, args):
+        """Return a list of problems with args for tool name (empty = valid)."""
+        entry = self._tools.get(name)
+        return entry["validate"](args) if entry else []
+    
+    def call(self, name, args):
+        """Validate args, then run the tool. Raises ToolArgumentError on bad arguments."""
+        errors = self.validate(name, args)
+        if errors: raise ToolArgumentError(f"Invalid arguments for tool '{name}': " + "; ".join(errors))
+        return self._tools[name]["func"](**args)
+    
+    def metadata(self, names=None):
+        """Return the Ollama `tools` list for the named tools (default: all of them)."""
+        names = list(self._tools) if names is None else names
+        return [self._tools[n]["metadata"] for n in names]
+    
+    def __contains__(self, name):
+        return name in self._tools
+    
+    def __len__(self):
+        return len(self._tools)
+
+
+# The default registry used by agent()
+TOOLS = ToolRegistry()
+
+
+def register_tool(func=None, metadata=None, **kwargs):
+    """Register a tool in the default TOOLS registry. See ToolRegistry.register()."""
+    return TOOLS.register(func, metadata=metadata, **kwargs)
+
 
-    raise RuntimeError(
-        "Ollama is not reachable at localhost:11434. "
-        "Start it first with: `python 08_function_calling/01_ollama.py`.\n"
-        f"Last error: {last_err}"
-    )
+def find_tool(name, registry=None):
+    """
+    Return the function for a tool name, or None. Looks in the registry first, then in this
+    module's global scope, then in the global scope of the script being run (__main__),
+    so a tool defined with a plain `def` in your script still works without register_tool().
+    
+    Only those places are searched: a tool defined in another module you import (or inside
+    a function) is not found unless you pass it to register_tool() or a ToolRegistry.
+    """
+    func = (registry or TOOLS).get(name) or globals().get(name)
+    if func is None:
+        main = sys.modules.get("__main__")
+        func = getattr(main, name, None) if main is not None else None
+    return func if callable(func) else None
+
+
+# 2. AGENT FUNCTION ###################################
+
+# When the model asks for several tools in one reply, we run them at the same time
+# on a small thread pool (up to TOOL_MAX_WORKERS threads per reply). Tools are usually
+# network calls (FDA, World Bank, ...), so the turn takes about as long as the slowest
+# tool instead of the sum of all of them.
+# Every reply gets its own pool, so a tool that itself calls agent() never waits for a
+# thread its caller is holding, and a stuck tool only ties up its own reply's pool.
+# Python cannot stop a running thread, so a tool that times out keeps running in the
+# background until it returns; its result is thrown away (and Python waits for it on exit).
+TOOL_TIMEOUT = 60  # seconds before a slow tool call is abandoned
+TOOL_MAX_WORKERS = 8  # tools run at the same time for one reply
+
+
+def run_tool_jobs(jobs, timeout=TOOL_TIMEOUT):
+    """
+    Run (tool_call, func, func_args) jobs concurrently and store each result in tool_call["output"].
+    
+    Every job is waited for (up to `timeout` seconds in total) before any output is stored.
+    A tool that raises, or is still running after `timeout`, gets an error message as its
+    output instead, so the model hears about it and the other tools' results are kept.
+    """
+    if not jobs: return jobs
+    executor = ThreadPoolExecutor(max_workers=min(TOOL_MAX_WORKERS, len(jobs)), thread_name_prefix="agent-tool")
+    try:
+        futures = [executor.submit(func, **func_args) for _, func, func_args in jobs]
+        wait(futures, timeout=timeout)
+    finally:
+        # Don't wait for abandoned tools; drop the ones that never started
+        executor.shutdown(wait=False, cancel_futures=True)
+    for (tool_call, _, _), future in zip(jobs, futures):
+        name = tool_call["function"]["name"]
+        if not future.done() or future.cancelled():  # still running, or never got a thread in time
+            tool_call["output"] = f"Error: tool '{name}' did not finish within {timeout} seconds."
+        elif future.exception() is not None:
+            err = future.exception()
+            tool_call["output"] = f"Error: tool '{name}' failed: {type(err).__name__}: {err}"
+        else:
+            tool_call["output"] = future.result()
+    return jobs
 
-# 1. AGENT FUNCTION ###################################
 
-def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
+def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False, tool_timeout=TOOL_TIMEOUT, registry=None):
     """
     Agent wrapper function that runs a single agent, with or without tools.
     
@@ -65,10 +480,14 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
         The model to be used for the agent (default: "smollm2:1.7b")
     output : str
         The output format (default: "text")
-    tools : list, optional
-        List of tool metadata dictionaries for function calling
+    tools : list or ToolRegistry, optional
+        List of tool metadata dictionaries for function calling, or a ToolRegistry to offer all of its tools
     all : bool
         If True, return all responses. If False, return only the last response.
+    registry : ToolRegistry, optional
+        Where to look up tool functions (default: TOOLS)
+    tool_timeout : float
+        Seconds each tool call may run before it is abandoned (default: TOOL_TIMEOUT)
     
     Returns:
     --------
@@ -76,6 +495,11 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
         The agent's response(s)
     """
     
+    # A registry can stand in for the tools list
+    if isinstance(tools, ToolRegistry):
+        registry, tools = tools, tools.metadata()
+    if registry is None: registry = TOOLS
+    
     # If the agent has NO tools, perform a standard chat
     if tools is None:
         ensure_ollama_available()
@@ -87,9 +511,7 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
             "options": {"num_predict": 500},
         }
         
-        response = requests.post(CHAT_URL, json=body, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        result = response.json()
+        result = post_chat(body)
         
         return result["message"]["content"]
     else:
@@ -103,39 +525,36 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
             "options": {"num_predict": 500},
         }
         
-        response = requests.post(CHAT_URL, json=body, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        result = response.json()
+        result = post_chat(body)
         
         # For any given tool call, execute the tool call
         if "tool_calls" in result.get("message", {}):
             tool_calls = result["message"]["tool_calls"]
+            jobs = []  # (tool_call, func, func_args) for every tool we can run
             for tool_call in tool_calls:
-                # Execute the tool function
-                # Note: Tool functions must be defined in the global scope
                 func_name = tool_call["function"]["name"]
                 raw_args = tool_call["function"].get("arguments", {})
                 # Ollama may return tool arguments either as a JSON string or as an already-parsed dict.
                 # Keep behavior consistent with the R examples (where arguments are already structured).
                 func_args = json.loads(raw_args) if isinstance(raw_args, str) else raw_args
                 
-                # Get the function from globals and execute it
-                func = globals().get(func_name)
-                # `agent()` lives in this module, but students typically define tool functions
-                # in the *calling script* (e.g. `03_agents_with_function_calling.py`).
-                # Search up the stack to find the function in caller globals.
+                # Look the tool up in the registry (one dictionary lookup),
+                # falling back to functions defined in this module or in your script
+                func = find_tool(func_name, registry)
                 if func is None:
-                    for depth in range(1, 6):  # reasonable small bound for examples
-                        try:
-                            frame = sys._getframe(depth)
-                            func = frame.f_globals.get(func_name)
-                            if func is not None:
-                                break
-                        except ValueError:
-                            break
-                if func:
-                    tool_output = func(**func_args)
-                    tool_call["output"] = tool_output
+                    tool_call["output"] = (f"Error: unknown tool '{func_name}'. "
+                                           "Register it with register_tool(), or define it at the top level "
+                                           "of the script you run.")
+                    continue
+                # Reject bad arguments before running the tool, and tell the model why
+                errors = registry.validate(func_name, func_args)
+                if errors:
+                    tool_call["output"] = f"Error: invalid arguments for tool '{func_name}': " + "; ".join(errors)
+                    continue
+                jobs.append((tool_call, func, func_args))
+            
+            # Execute the tool calls at the same time, keeping each output on its own tool_call
+            run_tool_jobs(jobs, timeout=tool_timeout)
         
         if all:
             return result
@@ -150,7 +569,7 @@ def agent(messages, model=DEFAULT_MODEL, output="text", tools=None, all=False):
             return result["message"]["content"]
 
 
-def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL):
+def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL, tool_timeout=TOOL_TIMEOUT, registry=None):
     """
     Run an agent with a specific role and task.
     
@@ -160,12 +579,16 @@ def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL):
         The system prompt defining the agent's role
     task : str
         The user message/task for the agent
-    tools : list, optional
-        List of tool metadata for function calling
+    tools : list or ToolRegistry, optional
+        List of tool metadata for function calling, or a ToolRegistry to offer all of its tools
     output : str
         Output format (default: "text")
     model : str
         Model to use (default: DEFAULT_MODEL)
+    tool_timeout : float
+        Seconds each tool call may run before it is abandoned (default: TOOL_TIMEOUT)
+    registry : ToolRegistry, optional
+        Where to look up tool functions (default: TOOLS)
     
     Returns:
     --------
@@ -180,28 +603,320 @@ def agent_run(role, task, tools=None, output="text", model=DEFAULT_MODEL):
     ]
     
     # Run the agent
-    resp = agent(messages=messages, model=model, output=output, tools=tools)
+    resp = agent(messages=messages, model=model, output=output, tools=tools,
+                 tool_timeout=tool_timeout, registry=registry)
     return resp
 
 
-# 2. DATA CONVERSION FUNCTION ###################################
+# 3. DATA CONVERSION FUNCTION ###################################
+
+# Markdown tables are easy to read, but the padding spaces, pipes and dashes
+# cost prompt tokens, and every token makes Ollama's prompt evaluation slower.
+# df_as_text() can also write more compact encodings:
+# - "csv" / "tsv": one line per row, no padding
+# - "json": column-oriented JSON, {"column": [values, ...], ...}
+# - "dict": TSV where repeated text values (like a category) are replaced by short codes,
+#   with a small dictionary of codes above the table
+# With max_tokens, rows are sampled (or summarized) until the text fits the budget.
+# df_text_report() compares the estimated tokens of every encoding for a DataFrame.
+
+TEXT_FORMATS = ("markdown", "csv", "tsv", "json", "dict")
+CHARS_PER_TOKEN = 4  # rough average for English text and numbers
+
+
+def estimate_tokens(text):
+    """Rough token count for a string (about 4 characters per token)."""
+    return -(-len(text) // CHARS_PER_TOKEN)  # round up
 
-def df_as_text(df):
+
+def _dict_encode(df, max_share=0.5):
+    """Replace repeated text values with integer codes; return (code legend text, coded DataFrame)."""
+    coded = df.copy()
+    legend = []
+    for col in df.columns:
+        values = df[col]
+        if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)
+                or isinstance(values.dtype, pd.CategoricalDtype)):
+            continue
+        n_unique = values.nunique(dropna=True)
+        # Only worth it when values repeat
+        if n_unique == 0 or n_unique > max_share * len(values): continue
+        codes = {v: i for i, v in enumerate(pd.unique(values.dropna()))}
+        coded[col] = values.map(codes).astype("Int64")
+        legend.append(f"{col}: " + "; ".join(f"{i}={v}" for v, i in codes.items()))
+    return "\n".join(legend), coded
+
+
+def _encode(df, format):
+    """Write a DataFrame as text in one of TEXT_FORMATS."""
+    if format == "markdown": return df.to_markdown(index=False)
+    if format == "csv": return df.to_csv(index=False).strip()
+    if format == "tsv": return df.to_csv(index=False, sep="\t").strip()
+    if format == "json":
+        return json.dumps({col: df[col].tolist() for col in df.columns},
+                          default=str, ensure_ascii=False, separators=(",", ":"))
+    if format == "dict":
+        legend, coded = _dict_encode(df)
+        table = coded.to_csv(index=False, sep="\t").strip()
+        return f"Codes:\n{legend}\n\n{table}" if legend else table
+    raise ValueError(f"format must be one of {TEXT_FORMATS}, not {format!r}")
+
+
+def _summarize_df(df):
+    """Aggregate a DataFrame into a short summary: numeric statistics plus the top text values."""
+    parts = [f"{len(df)} rows summarized."]
+    numeric = df.select_dtypes("number")
+    if not numeric.empty:
+        parts.append(numeric.describe().T[["count", "mean", "min", "max"]].round(3).reset_index(names="column"))
+    for col in df.columns.drop(numeric.columns):
+        top = df[col].astype(str).value_counts().head(5)
+        parts.append(f"{col} (top values): " + "; ".join(f"{v} ({n})" for v, n in top.items()))
+    return parts
+
+
+def df_as_text(df, format="markdown", max_tokens=None, reduce="sample"):
     """
-    Convert a pandas DataFrame to a markdown table string.
+    Convert a pandas DataFrame to a text table for a prompt.
     
     Parameters:
     -----------
     df : pandas.DataFrame
         The DataFrame to convert to text
+    format : str
+        One of "markdown" (default), "csv", "tsv", "json" (column-oriented) or "dict" (coded categories)
+    max_tokens : int, optional
+        Estimated token budget for the text (default: no limit)
+    reduce : str
+        How to fit max_tokens: "sample" keeps evenly spaced rows, "aggregate" summarizes the columns
+        (only the first ones, if the summary of every column is still too long)
     
     Returns:
     --------
     str
-        A markdown-formatted table string
+        The table as text (with a note saying how many rows are shown, if it was reduced)
     """
     
-    # Convert DataFrame to markdown table
-    # pandas to_markdown() method creates markdown tables
-    tab = df.to_markdown(index=False)
-    return tab
+    text = _encode(df, format)
+    if max_tokens is None or estimate_tokens(text) <= max_tokens: return text
+    
+    if reduce == "aggregate":
+        # A wide frame's summary can itself be too long: then summarize only the first columns
+        def summarized(n):
+            parts = _summarize_df(df.iloc[:, :n])
+            summary = "\n".join(_encode(p, format) if isinstance(p, pd.DataFrame) else p for p in parts)
+            if n == len(df.columns): return summary
+            return f"(summarizing {n} of {len(df.columns)} columns)\n{summary}"
+        
+        summary = summarized(len(df.columns))
+        if estimate_tokens(summary) <= max_tokens: return summary
+        return _largest_fit(summarized, len(df.columns) - 1, max_tokens)
+    if reduce != "sample": raise ValueError("reduce must be 'sample' or 'aggregate'")
+    if len(df) < 2: return text
+    
+    def sampled(n):
+        rows = sorted({round(i * (len(df) - 1) / max(1, n - 1)) for i in range(n)}) if n > 1 else [0]
+        note = f"(showing {n} of {len(df)} rows, evenly sampled)"
+        return f"{note}\n{_encode(df.iloc[rows], format)}"
+    
+    return _largest_fit(sampled, len(df) - 1, max_tokens)
+
+
+def _largest_fit(build, n_max, max_tokens):
+    """Binary search for the largest n (1..n_max) whose build(n) fits max_tokens; build(1) if none does."""
+    lo, hi, best = 1, n_max, build(1)
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        candidate = build(mid)
+        if estimate_tokens(candidate) <= max_tokens:
+            best, lo = candidate, mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+
+def df_text_report(df, formats=TEXT_FORMATS):
+    """
+    Compare the estimated prompt tokens of each text encoding of a DataFrame.
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per format: format, chars, est_tokens, vs_markdown (share of the markdown tokens)
+    """
+    rows = []
+    for format in formats:
+        text = _encode(df, format)
+        rows.append({"format": format, "chars": len(text), "est_tokens": estimate_tokens(text)})
+    report = pd.DataFrame(rows)
+    base = estimate_tokens(_encode(df, "markdown"))
+    report["vs_markdown"] = (report["est_tokens"] / base).round(3) if base else None
+    return report.sort_values("est_tokens", ignore_index=True)
+
+
+# 4. AGENT WORKFLOWS ###################################
+
+# Multi-agent pipelines are usually written one step after another.
+# But many steps don't depend on each other: fetching 3 categories of data,
+# or analyzing each category, could all happen at the same time.
+# A Workflow is a small graph ("DAG") of steps:
+# - each node is a function, with the names of the results it needs (inputs)
+#   and the names of the results it produces (outputs)
+# - nodes whose inputs are ready run at the same time, on a thread pool
+# - results are remembered, so running the workflow again only runs what's missing
+# - .timings() shows how long each node took
+
+
+class Workflow:
+    """
+    A graph of agent steps that runs independent steps in parallel.
+    
+    Example:
+    --------
+    wf = Workflow()
+    for cat in ["Oncology", "Psychiatry"]:
+        wf.node(f"data_{cat}", get_shortages, kwargs={"category": cat})
+    wf.node("table", lambda a, b: df_as_text(pd.concat([a, b])), inputs=["data_Oncology", "data_Psychiatry"])
+    wf.node("summary", lambda text: agent_run(role="Summarize this table.", task=text), inputs=["table"])
+    results = wf.run()
+    print(results["summary"])
+    print(wf.timings())
+    """
+    
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self.nodes = {}     # node name -> {"fn", "inputs", "outputs", "kwargs"}
+        self.producer = {}  # result name -> node name that produces it
+        self.results = {}   # result name -> value (memoized across runs)
+        self.times = {}     # node name -> {"seconds", "status", "error"}
+    
+    def node(self, name, fn, inputs=(), outputs=None, kwargs=None):
+        """
+        Add a step to the workflow.
+        
+        Parameters:
+        -----------
+        name : str
+            Unique name for this step
+        fn : function
+            Called as fn(*input_values, **kwargs)
+        inputs : list
+            Names of results this step needs, passed to fn in this order (default: none)
+        outputs : list, optional
+            Names for the results; with more than one, fn must return that many values (default: [name])
+        kwargs : dict, optional
+            Extra keyword arguments for fn
+        
+        Returns:
+        --------
+        Workflow
+            The workflow, so calls can be chained
+        """
+        if name in self.nodes: raise ValueError(f"Workflow already has a node named '{name}'")
+        outputs = [name] if outputs is None else list(outputs)
+        for out in outputs:
+            if out in self.producer: raise ValueError(f"Result '{out}' is already produced by node '{self.producer[out]}'")
+        self.nodes[name] = {"fn": fn, "inputs": list(inputs), "outputs": outputs, "kwargs": kwargs or {}}
+        for out in outputs: self.producer[out] = name
+        return self
+    
+    def _upstream(self, name):
+        """Node names that `name` needs (directly) to run."""
+        deps = []
+        for inp in self.nodes[name]["inputs"]:
+            if inp not in self.producer: raise ValueError(f"Node '{name}' needs '{inp}', which no node produces")
+            deps.append(self.producer[inp])
+        return deps
+    
+    def _needed(self, targets):
+        """All nodes required for targets (result or node names), checking for cycles."""
+        needed, visiting = set(), set()
+        
+        def visit(name):
+            if name in needed: return
+            if name in visiting: raise ValueError(f"Workflow has a cycle through node '{name}'")
+            visiting.add(name)
+            for dep in self._upstream(name): visit(dep)
+            visiting.discard(name)
+            needed.add(name)
+        
+        for target in targets: visit(self.producer.get(target, target))
+        return needed
+    
+    def invalidate(self, name):
+        """Forget the memoized results of a node and of every node downstream of it."""
+        stale = {name}
+        changed = True
+        while changed:
+            changed = False
+            for node in self.nodes:
+                if node not in stale and any(self.producer.get(i) in stale for i in self.nodes[node]["inputs"]):
+                    stale.add(node)
+                    changed = True
+        for node in stale:
+            for out in self.nodes[node]["outputs"]: self.results.pop(out, None)
+    
+    def _run_node(self, name):
+        spec = self.nodes[name]
+        args = [self.results[i] for i in spec["inputs"]]
+        start = time.perf_counter()
+        value = spec["fn"](*args, **spec["kwargs"])
+        return value, time.perf_counter() - start
+    
+    def run(self, targets=None):
+        """
+        Run every node needed for targets (default: all nodes), in parallel where possible.
+        Nodes whose results are already memoized are skipped.
+        
+        Returns:
+        --------
+        dict
+            Result name -> value, for every result computed so far
+        
+        Raises the first node error after the other branches finish;
+        nodes downstream of a failed node are skipped.
+        """
+        needed = self._needed(targets if targets is not None else list(self.nodes))
+        done = lambda n: all(out in self.results for out in self.nodes[n]["outputs"])
+        pending = {n for n in needed if not done(n)}
+        for n in needed - pending: self.times[n] = {"seconds": 0.0, "status": "cached", "error": None}
+        failed = set()
+        first_error = None
+        running = {}
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in sorted(pending):
+                    deps = self._upstream(name)
+                    if any(d in failed for d in deps):
+                        # Can't run: something it needs failed
+                        pending.discard(name)
+                        failed.add(name)
+                        self.times[name] = {"seconds": 0.0, "status": "skipped", "error": None}
+                    elif all(done(d) for d in deps):
+                        pending.discard(name)
+                        running[executor.submit(self._run_node, name)] = name
+                if not running: break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    outputs = self.nodes[name]["outputs"]
+                    try:
+                        value, seconds = future.result()
+                        values = [value] if len(outputs) == 1 else list(value)
+                        if len(values) != len(outputs):
+                            raise ValueError(f"Node '{name}' returned {len(values)} values for outputs {outputs}")
+                        self.results.update(zip(outputs, values))
+                        self.times[name] = {"seconds": seconds, "status": "ok", "error": None}
+                    except Exception as e:
+                        failed.add(name)
+                        first_error = first_error or e
+                        self.times[name] = {"seconds": None, "status": "error", "error": str(e)}
+        
+        if first_error is not None: raise first_error
+        return dict(self.results)
+    
+    def timings(self):
+        """Return a DataFrame with one row per node: node, inputs, status, seconds, error."""
+        rows = [{"node": n, "inputs": ", ".join(self.nodes[n]["inputs"]), **self.times[n]}
+                for n in self.nodes if n in self.times]
+        return pd.DataFrame(rows, columns=["node", "inputs", "status", "seconds", "error"])
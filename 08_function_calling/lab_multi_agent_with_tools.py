@@ -8,7 +8,7 @@ import requests
 import json
 import pandas as pd
 
-from functions import agent_run, df_as_text
+from functions import agent_run, df_as_text, register_tool
 
 MODEL = "smollm2:1.7b"
 
@@ -86,6 +86,9 @@ tool_get_world_bank_data = {
     }
 }
 
+# Register the function with its metadata, so agent_run() can call it by name
+register_tool(get_world_bank_data, tool_get_world_bank_data)
+
 # 3. MULTI-AGENT WORKFLOW ###################################
 
 # Agent 1: Data Fetcher (with tool)
@@ -107,7 +110,8 @@ else:
     result1_df = get_world_bank_data(country="CN", indicator="NY.GDP.MKTP.CD")
 
 # Convert DataFrame to text for Agent 2
-result1_text = df_as_text(result1_df)
+# CSV uses far fewer prompt tokens than a padded markdown table
+result1_text = df_as_text(result1_df, format="csv", max_tokens=1500)
 print(result1_text)
 print()
 
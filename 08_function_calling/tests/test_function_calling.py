@@ -0,0 +1,195 @@
+# Offline tests for functions.py: OllamaHealth circuit breaker + tool calls + tool timeouts (mock Ollama from 06_agents/bench, no network)
+# Run: python 08_function_calling/tests/test_function_calling.py
+
+from __future__ import annotations
+
+import socket
+import sys
+import time
+from pathlib import Path
+
+calling_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(calling_root))
+sys.path.insert(0, str(calling_root.parent / "06_agents" / "bench"))
+
+import functions
+from mock_ollama import start_mock_server
+
+TOOL_CALLS = [{"function": {"name": "add_two_numbers", "arguments": {"x": 1, "y": 2}}}]
+TOOLS_METADATA = [{
+    "type": "function",
+    "function": {
+        "name": "add_two_numbers",
+        "description": "Add two numbers",
+        "parameters": {"type": "object", "required": ["x", "y"],
+                       "properties": {"x": {"type": "number"}, "y": {"type": "number"}}},
+    },
+}]
+
+
+def closed_port_url() -> str:
+    """A localhost URL nothing is listening on."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def point_at(host: str) -> None:
+    functions.OLLAMA_HOST = host
+    functions.CHAT_URL = f"{host}/api/chat"
+    functions.OLLAMA_TAGS_URL = f"{host}/api/tags"
+
+
+def test_circuit_breaker() -> None:
+    print("test_function_calling: OllamaHealth closed -> open -> half_open -> closed ...")
+    server, host = start_mock_server()
+    old = (functions.OLLAMA_HOST, functions.CHAT_URL, functions.OLLAMA_TAGS_URL)
+    health = functions.OllamaHealth(ttl=60, cooldown=0.3)
+    try:
+        # Ollama down: one quick probe, then the breaker opens
+        point_at(closed_port_url())
+        try:
+            health.check(max_wait_seconds=0)
+            raise AssertionError("expected RuntimeError while Ollama is down")
+        except RuntimeError:
+            pass
+        assert health.state == "open" and health.last_error is not None
+
+        # While open, calls fail at once without probing, even once Ollama is back
+        point_at(host)
+        start = time.monotonic()
+        try:
+            health.check()
+            raise AssertionError("expected the open breaker to fail fast")
+        except RuntimeError as e:
+            assert "circuit open" in str(e)
+        assert time.monotonic() - start < 0.1
+
+        # After the cooldown, one probe (half_open) closes it again
+        time.sleep(0.35)
+        health.check()
+        assert health.state == "closed" and health.last_ok > 0
+
+        # Closed and recently checked: no probe at all, even if Ollama goes away
+        point_at(closed_port_url())
+        health.check()
+        assert health.state == "closed"
+
+        # A request that cannot connect opens the shared breaker
+        old_health, functions.OLLAMA_HEALTH = functions.OLLAMA_HEALTH, health
+        try:
+            functions.post_chat({"model": functions.DEFAULT_MODEL, "messages": [], "stream": False})
+            raise AssertionError("expected a connection error")
+        except functions.requests.ConnectionError:
+            pass
+        finally:
+            functions.OLLAMA_HEALTH = old_health
+        assert health.state == "open"
+
+        # A probe that blows up unexpectedly opens the breaker instead of leaving it half_open
+        time.sleep(0.35)
+        health._probe = lambda: 1 / 0
+        try:
+            health.check()
+            raise AssertionError("expected the probe's error")
+        except ZeroDivisionError:
+            pass
+        assert health.state == "open"
+    finally:
+        functions.OLLAMA_HOST, functions.CHAT_URL, functions.OLLAMA_TAGS_URL = old
+        server.shutdown()
+
+    # Only a 2xx reply counts as healthy; a 5xx opens the breaker
+    failing, failing_host = start_mock_server(error_rate=1.0, error_status=503)
+    old_health, functions.OLLAMA_HEALTH = functions.OLLAMA_HEALTH, functions.OllamaHealth()
+    point_at(failing_host)
+    try:
+        functions.post_chat({"model": functions.DEFAULT_MODEL, "messages": [], "stream": False})
+        raise AssertionError("expected an HTTP error")
+    except functions.requests.HTTPError:
+        pass
+    finally:
+        health, functions.OLLAMA_HEALTH = functions.OLLAMA_HEALTH, old_health
+        functions.OLLAMA_HOST, functions.CHAT_URL, functions.OLLAMA_TAGS_URL = old
+        failing.shutdown()
+    assert health.state == "open" and health.last_ok == 0
+    print("   OK")
+
+
+def test_tool_calls() -> None:
+    print("test_function_calling: agent() runs registered tools and checks arguments ...")
+    server, host = start_mock_server(tool_calls=TOOL_CALLS)
+    old = (functions.OLLAMA_HOST, functions.CHAT_URL, functions.OLLAMA_TAGS_URL)
+    old_health, functions.OLLAMA_HEALTH = functions.OLLAMA_HEALTH, functions.OllamaHealth()
+    point_at(host)
+    try:
+        registry = functions.ToolRegistry()
+        registry.register(lambda x, y: x + y, metadata=TOOLS_METADATA[0])
+        messages = [{"role": "user", "content": "What is 1 + 2?"}]
+        assert functions.agent(messages, tools=registry) == 3
+        assert functions.agent_run("Use the tools.", "What is 1 + 2?", tools=TOOLS_METADATA, registry=registry) == 3
+
+        # Arguments that break the schema are reported to the model, not passed to the tool
+        strict = functions.ToolRegistry()
+        schema = {**TOOLS_METADATA[0]["function"]["parameters"], "required": ["x", "y", "z"]}
+        strict.register(lambda x, y, z: x + y + z, name="add_two_numbers", parameters=schema)
+        output = functions.agent(messages, tools=strict)
+        assert output.startswith("Error: invalid arguments") and "'z'" in output
+
+        # Unknown tools are reported, not raised
+        output = functions.agent(messages, tools=TOOLS_METADATA, registry=functions.ToolRegistry())
+        assert "add_two_numbers" in output and output.startswith("Error: unknown tool")
+    finally:
+        functions.OLLAMA_HEALTH = old_health
+        functions.OLLAMA_HOST, functions.CHAT_URL, functions.OLLAMA_TAGS_URL = old
+        server.shutdown()
+    print("   OK")
+
+
+def test_tool_timeouts_do_not_block() -> None:
+    print("test_function_calling: timed-out tools do not block later calls ...")
+
+    def slow():
+        time.sleep(0.5)
+        return "late"
+
+    start = time.monotonic()
+    for i in range(12):  # more stuck tools than TOOL_MAX_WORKERS
+        jobs = [({"function": {"name": "slow"}}, slow, {}), ({"function": {"name": "double"}}, lambda x: 2 * x, {"x": i})]
+        functions.run_tool_jobs(jobs, timeout=0.05)
+        assert jobs[0][0]["output"].startswith("Error: tool 'slow' did not finish")
+        assert jobs[1][0]["output"] == 2 * i
+    assert time.monotonic() - start < 1.5
+
+    # A tool that raises gets its own error output; the other tools' outputs are kept
+    def broken():
+        raise ValueError("no data")
+
+    jobs = [({"function": {"name": "broken"}}, broken, {}), ({"function": {"name": "double"}}, lambda x: 2 * x, {"x": 4})]
+    functions.run_tool_jobs(jobs)
+    assert jobs[0][0]["output"] == "Error: tool 'broken' failed: ValueError: no data"
+    assert jobs[1][0]["output"] == 8
+
+    # More jobs than TOOL_MAX_WORKERS still all run, a few at a time
+    jobs = [({"function": {"name": "double"}}, lambda x: 2 * x, {"x": i}) for i in range(3 * functions.TOOL_MAX_WORKERS)]
+    assert [job[0]["output"] for job in functions.run_tool_jobs(jobs, timeout=5)] == [2 * i for i in range(len(jobs))]
+
+    # A tool may itself run tools without waiting on its own slot
+    def outer():
+        inner = functions.run_tool_jobs([({"function": {"name": "double"}}, lambda x: 2 * x, {"x": 5})])
+        return inner[0][0]["output"]
+
+    assert functions.run_tool_jobs([({"function": {"name": "outer"}}, outer, {})], timeout=1)[0][0]["output"] == 10
+    print("   OK")
+
+
+def main() -> None:
+    test_circuit_breaker()
+    test_tool_calls()
+    test_tool_timeouts_do_not_block()
+    print("test_function_calling: all passed.")
+
+
+if __name__ == "__main__":
+    main()
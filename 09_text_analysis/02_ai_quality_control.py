@@ -26,6 +26,12 @@ except ImportError:
     def load_dotenv():
         return False
 
+# jsonschema is optional; without it, results are checked with the simple checks below
+try:
+    import jsonschema
+except ImportError:
+    jsonschema = None
+
 ## 0.2 Configuration #################################
 
 # Choose your AI provider: "ollama" or "openai"
@@ -41,6 +47,9 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = "gpt-4o-mini"  # Low-cost model
 
+# How many more times to ask for a report whose reply doesn't match QC_SCHEMA
+QC_RETRIES = 2
+
 ## 0.3 Load Sample Data #################################
 
 # Load sample report text for quality control
@@ -179,6 +188,24 @@ Return JSON in this exact structure:
 
 ## 1.2 Query AI Function #################################
 
+# JSON schema for the quality control results. Ollama takes it as `format` and
+# constrains the model to write JSON with exactly these fields and ranges.
+LIKERT = {"type": "integer", "minimum": 1, "maximum": 5}
+QC_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "accurate": {"type": "boolean"},
+        "accuracy": LIKERT,
+        "formality": LIKERT,
+        "faithfulness": LIKERT,
+        "clarity": LIKERT,
+        "succinctness": LIKERT,
+        "relevance": LIKERT,
+        "details": {"type": "string"},
+    },
+    "required": ["accurate", "accuracy", "formality", "faithfulness", "clarity", "succinctness", "relevance", "details"],
+}
+
 # Function to query AI and get quality control results
 def query_ai_quality_control(prompt, provider=AI_PROVIDER):
     if provider == "ollama":
@@ -193,7 +220,7 @@ def query_ai_quality_control(prompt, provider=AI_PROVIDER):
                     "content": prompt
                 }
             ],
-            "format": "json",  # Request JSON output
+            "format": QC_SCHEMA,  # Request JSON output that follows our schema
             "stream": False
         }
         
@@ -255,6 +282,45 @@ EXPECTED_FIELDS = [
 ]
 
 
+# Python types each JSON schema "type" accepts (bool is an int in Python, so exclude it)
+JSON_TYPE_CHECKS = {
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool) or isinstance(v, float) and v.is_integer(),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "string": lambda v: isinstance(v, str),
+}
+
+
+def compile_qc_validator(schema):
+    """Build the checker once: returns a function that lists problems with a result (empty = valid)."""
+    if jsonschema is not None:
+        checker = jsonschema.validators.validator_for(schema)(schema)
+        return lambda data: [e.message for e in checker.iter_errors(data)]
+
+    # Each field is checked by what its schema says (type, minimum, maximum), not by its name
+    fields = schema["properties"].items()
+
+    def check(data):
+        if not isinstance(data, dict):
+            return ["result is not a JSON object"]
+        errors = [f"missing field '{field}'" for field in schema["required"] if field not in data]
+        for field, spec in fields:
+            if field not in data:
+                continue
+            value = data[field]
+            type_ok = JSON_TYPE_CHECKS.get(spec.get("type"), lambda v: True)
+            if not type_ok(value):
+                errors.append(f"{field} must be of type {spec['type']}, got {value!r}")
+            elif value < spec.get("minimum", value) or value > spec.get("maximum", value):
+                errors.append(f"{field} must be from {spec.get('minimum')} to {spec.get('maximum')}, got {value!r}")
+        return errors
+
+    return check
+
+
+validate_quality_control = compile_qc_validator(QC_SCHEMA)
+
+
 def parse_quality_control_results(json_response):
     # Try to parse JSON
     # Sometimes AI returns text with JSON, so we extract JSON if needed
@@ -265,22 +331,10 @@ def parse_quality_control_results(json_response):
     # Parse JSON
     quality_data = json.loads(json_response)
 
-    missing_fields = [field for field in EXPECTED_FIELDS if field not in quality_data]
-    if missing_fields:
-        raise ValueError(f"Missing expected fields: {missing_fields}")
-
-    numeric_fields = [
-        "accuracy",
-        "formality",
-        "faithfulness",
-        "clarity",
-        "succinctness",
-        "relevance",
-    ]
-    for field in numeric_fields:
-        quality_data[field] = int(quality_data[field])
-        if quality_data[field] < 1 or quality_data[field] > 5:
-            raise ValueError(f"{field} must be between 1 and 5")
+    # Check the result against QC_SCHEMA
+    errors = validate_quality_control(quality_data)
+    if errors:
+        raise ValueError(f"Result does not match the schema: {'; '.join(errors)}")
 
     quality_data["accurate"] = bool(quality_data["accurate"])
     quality_data["details"] = str(quality_data["details"]).strip()
@@ -290,6 +344,27 @@ def parse_quality_control_results(json_response):
     return results
 
 
+def retry_prompt(prompt, error):
+    """Ask again, telling the model what was wrong with its last reply."""
+    return (
+        f"{prompt}\n\nYour previous reply was rejected: {error}\n"
+        "Return only JSON in the exact structure above."
+    )
+
+
+def run_quality_control(report_text, source_data=None, prompt_version="refined", retries=QC_RETRIES):
+    """Query the AI and parse its results, asking again (up to `retries` times) if the reply is invalid."""
+    prompt = create_quality_control_prompt(report_text, source_data, prompt_version=prompt_version)
+    for attempt in range(retries + 1):
+        response = query_ai_quality_control(prompt, provider=AI_PROVIDER)
+        try:
+            return response, add_overall_score(parse_quality_control_results(response))
+        except ValueError as e:  # json.JSONDecodeError is a ValueError too
+            if attempt == retries:
+                raise
+            prompt = retry_prompt(prompt, e)
+
+
 def add_overall_score(results_df):
     likert_columns = [
         "accuracy",
@@ -339,9 +414,7 @@ def compare_prompt_versions(report_text, source_data=None):
     comparison_rows = []
 
     for version in ["baseline", "refined"]:
-        prompt = create_quality_control_prompt(report_text, source_data, prompt_version=version)
-        response = query_ai_quality_control(prompt, provider=AI_PROVIDER)
-        parsed = add_overall_score(parse_quality_control_results(response))
+        _, parsed = run_quality_control(report_text, source_data, prompt_version=version)
         parsed["prompt_version"] = version
         comparison_rows.append(parsed)
 
@@ -351,17 +424,15 @@ def compare_prompt_versions(report_text, source_data=None):
 
 ## 2.1 Create Quality Control Prompt #################################
 
-quality_prompt = create_quality_control_prompt(report, source_data, prompt_version="refined")
-
 print("🤖 Querying AI for quality control with the refined prompt...\n")
 
-ai_response = query_ai_quality_control(quality_prompt, provider=AI_PROVIDER)
+# run_quality_control() builds the prompt, queries the AI, and checks the reply against QC_SCHEMA
+ai_response, quality_results = run_quality_control(report, source_data, prompt_version="refined")
 
 print("📥 AI Response (raw JSON):")
 print(ai_response)
 print()
 
-quality_results = add_overall_score(parse_quality_control_results(ai_response))
 print_submission_summary("Quality Control Results", quality_results, "refined")
 
 print("📋 Manual Quality Snapshot:")
@@ -406,34 +477,55 @@ print(
 ## 3.1 Batch Quality Control Function #################################
 
 # Function to check multiple reports
-def check_multiple_reports(reports, source_data=None, prompt_version="refined"):
+# Every report is checked once; reports whose reply doesn't match QC_SCHEMA go back
+# in the queue (with the error) for up to `retries` more rounds. Good results are kept as they are.
+def check_multiple_reports(reports, source_data=None, prompt_version="refined", retries=QC_RETRIES):
+    import time
+
     print(f"🔄 Performing quality control on {len(reports)} reports...\n")
     
     all_results = []
+    prompts = {
+        i: create_quality_control_prompt(report_text, source_data, prompt_version=prompt_version)
+        for i, report_text in enumerate(reports, 1)
+    }
+    queue = list(prompts)
     
-    for i, report_text in enumerate(reports, 1):
-        print(f"Checking report {i} of {len(reports)}...")
+    for attempt in range(retries + 1):
+        invalid = []
+        for i in queue:
+            print(f"Checking report {i} of {len(reports)}...")
+            
+            # Query AI
+            try:
+                response = query_ai_quality_control(prompts[i], provider=AI_PROVIDER)
+                results = add_overall_score(parse_quality_control_results(response))
+                results["report_id"] = i
+                all_results.append(results)
+            except ValueError as e:
+                # Invalid reply: re-queue this report with the error
+                print(f"⚠️ Invalid result for report {i}: {e}")
+                prompts[i] = retry_prompt(prompts[i], e)
+                invalid.append(i)
+            except Exception as e:
+                print(f"❌ Error checking report {i}: {e}")
+            
+            # Small delay to avoid rate limiting
+            time.sleep(1)
         
-        # Create prompt
-        prompt = create_quality_control_prompt(report_text, source_data, prompt_version=prompt_version)
-        
-        # Query AI
-        try:
-            response = query_ai_quality_control(prompt, provider=AI_PROVIDER)
-            results = add_overall_score(parse_quality_control_results(response))
-            results["report_id"] = i
-            all_results.append(results)
-        except Exception as e:
-            print(f"❌ Error checking report {i}: {e}")
-        
-        # Small delay to avoid rate limiting
-        import time
-        time.sleep(1)
+        queue = invalid
+        if not queue:
+            break
+        if attempt < retries:
+            print(f"🔁 Re-checking {len(queue)} report(s) with invalid results...")
+    
+    if queue:
+        print(f"❌ Gave up on report(s) {queue} after {retries} retries")
     
-    # Combine all results
+    # Combine all results, in report order
     if all_results:
         combined_results = pd.concat(all_results, ignore_index=True)
-        return combined_results
+        return combined_results.sort_values("report_id", ignore_index=True)
     else:
         return pd.DataFrame()
 
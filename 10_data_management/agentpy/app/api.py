@@ -16,6 +16,7 @@ from pydantic import BaseModel, ConfigDict, Field, field_validator
 from .guardrails import MAX_AUTONOMOUS_TURNS, clamp_turns, min_completion_turns
 from .loop import run_research_loop
 from .logging_setup import configure_agent_logging
+from .metrics import METRICS
 
 # 0. CONFIGURATION ############################################################
 
@@ -261,6 +262,16 @@ async def health() -> dict[str, Any]:
     }
 
 
+@app.get("/metrics", tags=["health"], summary="Ollama call latency and token metrics")
+async def metrics() -> dict[str, Any]:
+    """
+    Per (model, call site): call count, prompt/eval token totals, mean/p50/p95 seconds for
+    wall time, Ollama `total`, model `load`, `prompt_eval` and `eval` phases, and generation tokens/sec.
+    Histogram percentiles are approximate (bucket upper bounds).
+    """
+    return {"ok": True, "calls": METRICS.summary()}
+
+
 @app.post(
     "/hooks/control",
     tags=["agent"],
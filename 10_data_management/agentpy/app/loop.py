@@ -6,6 +6,7 @@ import json
 import logging
 import os
 import re
+import time
 import uuid
 from typing import Any
 
@@ -21,6 +22,7 @@ from .guardrails import (
     task_size_ok,
 )
 from .logging_setup import configure_agent_logging
+from .metrics import METRICS
 from .tools import (
     ollama_tool_definitions,
     parse_function_arguments,
@@ -203,9 +205,11 @@ def _chat_once(
     if max_tokens is not None:
         body["options"] = {"num_predict": max_tokens}
     url = base_url.rstrip("/") + "/api/chat"
+    t0 = time.perf_counter()
     resp = client.post(url, headers=headers, json=body, timeout=120.0)
     resp.raise_for_status()
     data = resp.json()
+    METRICS.record(data, model=model, site="loop._chat_once", wall_seconds=time.perf_counter() - t0)
     msg = data.get("message") or {}
     content = (msg.get("content") or "")
     if isinstance(content, str):
@@ -0,0 +1,135 @@
+# metrics.py
+# Per-call Ollama latency + token metrics (in-memory histograms, optional JSONL sink; see AGENT_METRICS_FILE).
+# Tim Fraser
+
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from .guardrails import agent_root
+
+# Histogram bucket upper bounds (seconds) for Ollama call latencies.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, float("inf"))
+# wall = client-measured round trip; the rest come from Ollama's *_duration fields (ns).
+PHASES = ("wall", "total", "load", "prompt_eval", "eval")
+
+
+class OllamaMetrics:
+    """In-memory latency histograms + token counts for /api/chat calls, grouped by (model, site); optional JSONL sink.
+
+    Each app ships on its own, so 10_data_management/fixer/functions.py has the same class; keep the two in sync.
+    """
+
+    def __init__(self, jsonl_path: str | None = None) -> None:
+        self.jsonl_path = jsonl_path
+        self._groups: dict[tuple[str, str], dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # keeps JSONL lines whole without blocking record()/summary()
+
+    def record(self, data: dict[str, Any], model: str, site: str, wall_seconds: float | None = None) -> dict[str, Any]:
+        """Fold one /api/chat response body into the histograms; returns the stored sample."""
+
+        def ns(key: str) -> float:
+            return (data.get(key) or 0) / 1e9
+
+        sample: dict[str, Any] = {
+            "ts": time.time(),
+            "model": model,
+            "site": site,
+            "wall_s": wall_seconds,
+            "total_s": ns("total_duration"),
+            "load_s": ns("load_duration"),
+            "prompt_eval_s": ns("prompt_eval_duration"),
+            "eval_s": ns("eval_duration"),
+            "prompt_tokens": data.get("prompt_eval_count") or 0,
+            "eval_tokens": data.get("eval_count") or 0,
+        }
+        with self._lock:
+            group = self._groups.get((model, site))
+            if group is None:
+                group = {
+                    "calls": 0,
+                    "prompt_tokens": 0,
+                    "eval_tokens": 0,
+                    "phases": {p: {"n": 0, "sum": 0.0, "max": 0.0, "counts": [0] * len(LATENCY_BUCKETS)} for p in PHASES},
+                }
+                self._groups[(model, site)] = group
+            group["calls"] += 1
+            group["prompt_tokens"] += sample["prompt_tokens"]
+            group["eval_tokens"] += sample["eval_tokens"]
+            for phase in PHASES:
+                value = sample[f"{phase}_s"]
+                if value is None:
+                    continue
+                hist = group["phases"][phase]
+                hist["n"] += 1
+                hist["sum"] += value
+                hist["max"] = max(hist["max"], value)
+                hist["counts"][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        # Write to disk after releasing the lock, so a slow disk never stalls other calls' bookkeeping
+        if self.jsonl_path:
+            line = json.dumps(sample) + "\n"
+            with self._write_lock, open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return sample
+
+    @staticmethod
+    def _percentile(hist: dict[str, Any], q: float) -> float | None:
+        """Approximate percentile: upper bound of the bucket holding the q-th value (capped at the max seen)."""
+        if hist["n"] == 0:
+            return None
+        target, seen = q * hist["n"], 0
+        for bound, count in zip(LATENCY_BUCKETS, hist["counts"]):
+            seen += count
+            if seen >= target:
+                return min(bound, hist["max"])
+        return hist["max"]
+
+    def summary(self) -> list[dict[str, Any]]:
+        """One row per (model, site): calls, token totals, mean/p50/p95 seconds per phase, generation tokens/sec."""
+        rows: list[dict[str, Any]] = []
+        with self._lock:
+            for (model, site), group in self._groups.items():
+                row: dict[str, Any] = {
+                    "model": model,
+                    "site": site,
+                    "calls": group["calls"],
+                    "prompt_tokens": group["prompt_tokens"],
+                    "eval_tokens": group["eval_tokens"],
+                }
+                for phase in PHASES:
+                    hist = group["phases"][phase]
+                    row[f"{phase}_mean_s"] = hist["sum"] / hist["n"] if hist["n"] else None
+                    row[f"{phase}_p50_s"] = self._percentile(hist, 0.50)
+                    row[f"{phase}_p95_s"] = self._percentile(hist, 0.95)
+                eval_s = group["phases"]["eval"]["sum"]
+                row["eval_tokens_per_s"] = group["eval_tokens"] / eval_s if eval_s else None
+                rows.append(row)
+        return rows
+
+    def reset(self) -> None:
+        with self._lock:
+            self._groups = {}
+
+
+def _metrics_path() -> str | None:
+    """
+    **AGENT_METRICS_FILE** unset/empty/0/off: in-memory only.
+    Otherwise a JSONL path; relative paths are resolved under activity root.
+    """
+    raw = (os.getenv("AGENT_METRICS_FILE") or "").strip()
+    if raw.lower() in ("", "0", "off", "false", "no"):
+        return None
+    path = Path(raw)
+    if not path.is_absolute():
+        path = agent_root() / path
+    return str(path)
+
+
+METRICS = OllamaMetrics(_metrics_path())
@@ -16,7 +16,8 @@ import matplotlib.pyplot as plt
 import pandas as pd
 from dotenv import load_dotenv
 
-from functions import ollama_chat_once, parse_function_arguments, split_df_into_row_chunks
+import functions
+from functions import chunk_workers_from_env, ollama_chat_once, parse_function_arguments, split_df_into_row_chunks
 
 print()
 print("=================================================================")
@@ -66,7 +67,7 @@ def read_env_digits(name: str, default: int) -> int:
 
 
 ROWS_PER_BATCH = read_env_digits("ROWS_PER_BATCH", 10)
-FIXER_CHUNK_WORKERS = read_env_digits("FIXER_CHUNK_WORKERS", 1)
+FIXER_CHUNK_WORKERS = chunk_workers_from_env(1)  # "auto" = adaptive concurrency (see functions.LIMITER)
 print(f"📊 ROWS_PER_BATCH = {ROWS_PER_BATCH} (env ROWS_PER_BATCH)")
 print(f"📊 FIXER_CHUNK_WORKERS = {FIXER_CHUNK_WORKERS} (env FIXER_CHUNK_WORKERS)\n")
 
@@ -503,6 +504,7 @@ def call_context_chunk_ollama(
             tools=tools,
             format=None,
             max_output_tokens=max_output_tokens,
+            site="fixer_spatial_context",
         )
     except Exception as e:
         return {"chunk_index": chunk_index, "tool_calls": [], "error": str(e), "content": ""}
@@ -559,6 +561,11 @@ with ThreadPoolExecutor(max_workers=FIXER_CHUNK_WORKERS) as ex:
         tmp[cr["chunk_index"]] = cr
     chunk_results = [tmp[i] for i in range(1, n_chunks + 1)]
 
+if functions.LIMITER is not None:
+    lim = functions.LIMITER.stats()
+    print(f"   👷 Adaptive concurrency settled at {lim['settled_limit']} of {FIXER_CHUNK_WORKERS} workers "
+          f"(latency {lim['recent_ms']} ms vs baseline {lim['baseline_ms']} ms, {lim['overloads']} overloads)")
+
 # 5. APPLY TOOL CALLS ON MAIN PROCESS (CHUNK ORDER) ###################################
 
 print("-----------------------------------------------------------------")
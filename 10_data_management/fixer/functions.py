@@ -1,12 +1,17 @@
 # functions.py
-# Shared fixer helpers: Ollama /api/chat (httpx) + tool-call JSON parsing + table chunking.
+# Shared fixer helpers: Ollama /api/chat (httpx) + call metrics + tool-call JSON parsing + table chunking.
 # Imported by fixer_csv.py, fixer_parcels.py, fixer_pois.py, fixer_spatial_context.py, testme.py.
 # Tim Fraser
 
 from __future__ import annotations
 
+import bisect
+import copy
+import hashlib
 import json
 import os
+import threading
+import time
 from pathlib import Path
 from typing import Any
 
@@ -48,6 +53,306 @@ def split_df_into_row_chunks(df: pd.DataFrame, n_rows: int) -> list[pd.DataFrame
     return out
 
 
+# Histogram bucket upper bounds (seconds) for Ollama call latencies.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, float("inf"))
+# wall = client-measured round trip; the rest come from Ollama's *_duration fields (ns).
+PHASES = ("wall", "total", "load", "prompt_eval", "eval")
+
+
+class OllamaMetrics:
+    """In-memory latency histograms + token counts for /api/chat calls, grouped by (model, site); optional JSONL sink.
+
+    Each app ships on its own, so 10_data_management/agentpy/app/metrics.py has the same class; keep the two in sync.
+    """
+
+    def __init__(self, jsonl_path: str | None = None) -> None:
+        self.jsonl_path = jsonl_path
+        self._groups: dict[tuple[str, str], dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # keeps JSONL lines whole without blocking record()/summary()
+
+    def record(self, data: dict[str, Any], model: str, site: str, wall_seconds: float | None = None) -> dict[str, Any]:
+        """Fold one /api/chat response body into the histograms; returns the stored sample."""
+
+        def ns(key: str) -> float:
+            return (data.get(key) or 0) / 1e9
+
+        sample: dict[str, Any] = {
+            "ts": time.time(),
+            "model": model,
+            "site": site,
+            "wall_s": wall_seconds,
+            "total_s": ns("total_duration"),
+            "load_s": ns("load_duration"),
+            "prompt_eval_s": ns("prompt_eval_duration"),
+            "eval_s": ns("eval_duration"),
+            "prompt_tokens": data.get("prompt_eval_count") or 0,
+            "eval_tokens": data.get("eval_count") or 0,
+        }
+        with self._lock:
+            group = self._groups.get((model, site))
+            if group is None:
+                group = {
+                    "calls": 0,
+                    "prompt_tokens": 0,
+                    "eval_tokens": 0,
+                    "phases": {p: {"n": 0, "sum": 0.0, "max": 0.0, "counts": [0] * len(LATENCY_BUCKETS)} for p in PHASES},
+                }
+                self._groups[(model, site)] = group
+            group["calls"] += 1
+            group["prompt_tokens"] += sample["prompt_tokens"]
+            group["eval_tokens"] += sample["eval_tokens"]
+            for phase in PHASES:
+                value = sample[f"{phase}_s"]
+                if value is None:
+                    continue
+                hist = group["phases"][phase]
+                hist["n"] += 1
+                hist["sum"] += value
+                hist["max"] = max(hist["max"], value)
+                hist["counts"][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        # Write to disk after releasing the lock, so a slow disk never stalls other calls' bookkeeping
+        if self.jsonl_path:
+            line = json.dumps(sample) + "\n"
+            with self._write_lock, open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return sample
+
+    @staticmethod
+    def _percentile(hist: dict[str, Any], q: float) -> float | None:
+        """Approximate percentile: upper bound of the bucket holding the q-th value (capped at the max seen)."""
+        if hist["n"] == 0:
+            return None
+        target, seen = q * hist["n"], 0
+        for bound, count in zip(LATENCY_BUCKETS, hist["counts"]):
+            seen += count
+            if seen >= target:
+                return min(bound, hist["max"])
+        return hist["max"]
+
+    def summary(self) -> list[dict[str, Any]]:
+        """One row per (model, site): calls, token totals, mean/p50/p95 seconds per phase, generation tokens/sec."""
+        rows: list[dict[str, Any]] = []
+        with self._lock:
+            for (model, site), group in self._groups.items():
+                row: dict[str, Any] = {
+                    "model": model,
+                    "site": site,
+                    "calls": group["calls"],
+                    "prompt_tokens": group["prompt_tokens"],
+                    "eval_tokens": group["eval_tokens"],
+                }
+                for phase in PHASES:
+                    hist = group["phases"][phase]
+                    row[f"{phase}_mean_s"] = hist["sum"] / hist["n"] if hist["n"] else None
+                    row[f"{phase}_p50_s"] = self._percentile(hist, 0.50)
+                    row[f"{phase}_p95_s"] = self._percentile(hist, 0.95)
+                eval_s = group["phases"]["eval"]["sum"]
+                row["eval_tokens_per_s"] = group["eval_tokens"] / eval_s if eval_s else None
+                rows.append(row)
+        return rows
+
+    def reset(self) -> None:
+        with self._lock:
+            self._groups = {}
+
+
+# Set FIXER_METRICS_PATH to also append one JSON line per Ollama call.
+METRICS = OllamaMetrics(os.environ.get("FIXER_METRICS_PATH", "").strip() or None)
+
+
+_client: httpx.Client | None = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> httpx.Client:
+    """Shared keep-alive httpx client (thread-safe); reuses connections across chunks and worker threads."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(timeout=120.0)
+    return _client
+
+
+class SingleFlight:
+    """Share one upstream call among identical requests in flight at the same time (callers get copies)."""
+
+    def __init__(self) -> None:
+        self.upstream = 0
+        self.coalesced = 0
+        self._calls: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Any) -> Any:
+        """Return fn(), or the result of an identical call (same key) that is already running."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+                self.upstream += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return copy.deepcopy(call["result"])
+        try:
+            call["result"] = fn()
+            return copy.deepcopy(call["result"])
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+    def stats(self) -> dict[str, Any]:
+        """upstream_calls, saved_calls (answered by another caller's request), saved_rate."""
+        total = self.upstream + self.coalesced
+        return {
+            "upstream_calls": self.upstream,
+            "saved_calls": self.coalesced,
+            "saved_rate": self.coalesced / total if total else 0.0,
+        }
+
+
+# Identical deterministic /api/chat requests from concurrent chunk workers share one call.
+# Only requests that pin their sampling (temperature=0 or a seed) count as deterministic;
+# Ollama's default temperature is 0.8. Set FIXER_COALESCE=0 to turn this off.
+SINGLE_FLIGHT = SingleFlight()
+COALESCE = os.environ.get("FIXER_COALESCE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def is_deterministic(body: dict[str, Any]) -> bool:
+    """True if the request sets a seed or options.temperature == 0 (a missing temperature samples)."""
+    options = body.get("options") or {}
+    if options.get("seed") is not None:
+        return True
+    return options.get("temperature") is not None and options["temperature"] == 0
+
+
+def is_overload(err: BaseException) -> bool:
+    """True for errors that mean Ollama is overloaded: timeout, 429, 503 or 504."""
+    if isinstance(err, httpx.TimeoutException):
+        return True
+    if isinstance(err, httpx.HTTPStatusError):
+        return err.response.status_code in (429, 503, 504)
+    return False
+
+
+class AdaptiveLimiter:
+    """
+    Adaptive cap on concurrent Ollama calls (gradient/AIMD, like TCP congestion control).
+    Latency is averaged per window of calls: the cap grows by ~sqrt(cap) while the window average
+    stays within tolerance x the fastest window, shrinks in proportion as latency rises,
+    and halves on a timeout / 429 / 503 / 504.
+    """
+
+    def __init__(
+        self,
+        initial: int = 2,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        tolerance: float = 1.3,
+        smoothing: float = 0.5,
+        backoff: float = 0.5,
+        window: int = 10,
+    ) -> None:
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.window = window
+        self.inflight = 0
+        self.min_latency: float | None = None
+        self.avg_latency: float | None = None
+        self.completed = 0
+        self.overloads = 0
+        self.history: list[float] = []
+        self._samples: list[float] = []
+        self._peak = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.inflight >= max(self.min_limit, int(self.limit)):
+                self._cond.wait()
+            self.inflight += 1
+            self._peak = max(self._peak, self.inflight)
+
+    def release(self, seconds: float, error: BaseException | None = None) -> None:
+        with self._cond:
+            self.inflight -= 1
+            if error is not None:
+                if is_overload(error):
+                    self.overloads += 1
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._samples, self._peak = [], self.inflight
+                    self.history.append(self.limit)
+            else:
+                self.completed += 1
+                self._samples.append(seconds)
+                if len(self._samples) >= max(self.window, int(self.limit)):
+                    self._update()
+            self._cond.notify_all()
+
+    def _update(self) -> None:
+        avg = sum(self._samples) / len(self._samples)
+        self.avg_latency = avg
+        # Baseline drifts up slowly so it can follow a server that got slower
+        self.min_latency = avg if self.min_latency is None else min(avg, self.min_latency * 1.002)
+        gradient = max(0.5, min(1.0, self.tolerance * self.min_latency / avg))
+        target = self.limit * gradient + self.limit**0.5
+        if self._peak < self.limit / 2:
+            target = min(target, self.limit)  # don't grow a limit we aren't using
+        self.limit += self.smoothing * (target - self.limit)
+        self.limit = min(self.max_limit, max(self.min_limit, self.limit))
+        self.history.append(self.limit)
+        self._samples, self._peak = [], self.inflight
+
+    def stats(self) -> dict[str, Any]:
+        """limit, settled_limit (median of the last 20 windows), baseline/recent ms, completed, overloads."""
+        with self._cond:
+            recent = sorted(self.history[-20:])
+            return {
+                "limit": int(self.limit),
+                "settled_limit": int(recent[len(recent) // 2]) if recent else int(self.limit),
+                "max_limit_seen": int(max(self.history)) if self.history else int(self.limit),
+                "baseline_ms": None if self.min_latency is None else round(self.min_latency * 1000, 1),
+                "recent_ms": None if self.avg_latency is None else round(self.avg_latency * 1000, 1),
+                "completed": self.completed,
+                "overloads": self.overloads,
+            }
+
+
+# Set by chunk_workers_from_env() when FIXER_CHUNK_WORKERS=auto; ollama_chat_once() then runs inside it.
+LIMITER: AdaptiveLimiter | None = None
+
+
+def chunk_workers_from_env(default: int = 1) -> int:
+    """
+    Thread-pool size from FIXER_CHUNK_WORKERS. A positive integer is used as-is.
+    'auto' turns on LIMITER (adaptive concurrency, at most FIXER_MAX_CHUNK_WORKERS, default 16)
+    and returns that maximum as the pool size.
+    """
+    global LIMITER
+    s = os.environ.get("FIXER_CHUNK_WORKERS", str(default)).strip().lower()
+    if s == "auto":
+        m = os.environ.get("FIXER_MAX_CHUNK_WORKERS", "16").strip()
+        max_workers = int(m) if m.isdigit() and int(m) >= 1 else 16
+        LIMITER = AdaptiveLimiter(max_limit=max_workers)
+        return max_workers
+    if s.isdigit() and int(s) >= 1:
+        return int(s)
+    return default
+
+
 def ollama_chat_once(
     base_url: str,
     api_key: str | None,
@@ -56,8 +361,12 @@ def ollama_chat_once(
     tools: list[dict[str, Any]] | None = None,
     format: str | None = None,
     max_output_tokens: int | None = None,
+    site: str = "ollama_chat_once",
+    temperature: float | None = None,
 ) -> dict[str, Any]:
-    """Single chat completion. Pass tools for tool-calling; pass format='json' for JSON mode."""
+    """Single chat completion. Pass tools for tool-calling; pass format='json' for JSON mode; site tags METRICS.
+    temperature=None keeps Ollama's default. With temperature=0, identical concurrent calls are
+    coalesced into one request (see SINGLE_FLIGHT)."""
     url = base_url.rstrip("/") + "/api/chat"
     body: dict[str, Any] = {
         "model": model,
@@ -68,18 +377,44 @@ def ollama_chat_once(
         body["tools"] = tools
     if format is not None and str(format).strip():
         body["format"] = str(format)
+    options: dict[str, Any] = {}
     if max_output_tokens is not None:
-        body["options"] = {"num_predict": int(max_output_tokens)}
+        options["num_predict"] = int(max_output_tokens)
+    if temperature is not None:
+        options["temperature"] = float(temperature)
+    if options:
+        body["options"] = options
 
     headers = {"Content-Type": "application/json"}
     ak = (api_key or "").strip()
     if ak:
         headers["Authorization"] = f"Bearer {ak}"
 
-    with httpx.Client(timeout=120.0) as client:
-        resp = client.post(url, json=body, headers=headers)
-        resp.raise_for_status()
-        data = resp.json()
+    def call() -> dict[str, Any]:
+        limiter = LIMITER
+        if limiter is not None:
+            limiter.acquire()
+        t0 = time.perf_counter()
+        try:
+            resp = get_http_client().post(url, json=body, headers=headers)
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception as e:
+            if limiter is not None:
+                limiter.release(time.perf_counter() - t0, e)
+            raise
+        wall = time.perf_counter() - t0
+        if limiter is not None:
+            limiter.release(wall)
+        METRICS.record(data, model=model, site=site, wall_seconds=wall)
+        return data
+
+    if COALESCE and is_deterministic(body):
+        # Same body and temperature 0 (or a seed): the reply would be the same, so share it
+        key = hashlib.sha256(json.dumps([url, ak, body], sort_keys=True).encode("utf-8")).hexdigest()
+        data = SINGLE_FLIGHT.do(key, call)
+    else:
+        data = call()
 
     msg = data.get("message") or {}
     content = msg.get("content")
@@ -1,4 +1,4 @@
-# Offline tests for fixer chunking + set_cell semantics + parse_function_arguments (no Ollama / no network)
+# Offline tests for fixer chunking + set_cell semantics + parse_function_arguments + OllamaMetrics + SingleFlight + AdaptiveLimiter (no Ollama / no network)
 # Run: python 10_data_management/fixer/tests/test_fixer_csv_helpers.py
 
 from __future__ import annotations
@@ -11,7 +11,7 @@ import pandas as pd
 fixer_root = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(fixer_root))
 
-from functions import parse_function_arguments, split_df_into_row_chunks
+from functions import AdaptiveLimiter, OllamaMetrics, SingleFlight, parse_function_arguments, split_df_into_row_chunks
 
 
 def apply_set_cell(df: pd.DataFrame, args: dict) -> pd.DataFrame:
@@ -66,6 +66,69 @@ def main() -> None:
     assert p["row_id"] == 2 and p["column_name"] == "qty" and p["new_value"] == "7"
     print("   OK")
 
+    print("test_fixer_csv_helpers: OllamaMetrics ...")
+    m = OllamaMetrics()
+    raw = {"total_duration": 2_000_000_000, "load_duration": 500_000_000, "prompt_eval_count": 40,
+           "prompt_eval_duration": 300_000_000, "eval_count": 60, "eval_duration": 1_200_000_000}
+    m.record(raw, model="m1", site="fixer_csv", wall_seconds=2.1)
+    m.record(raw, model="m1", site="fixer_csv", wall_seconds=2.3)
+    m.record({}, model="m2", site="fixer_pois")
+    rows = {(r["model"], r["site"]): r for r in m.summary()}
+    r1 = rows[("m1", "fixer_csv")]
+    assert r1["calls"] == 2 and r1["prompt_tokens"] == 80 and r1["eval_tokens"] == 120
+    assert abs(r1["load_mean_s"] - 0.5) < 1e-9 and abs(r1["eval_tokens_per_s"] - 50.0) < 1e-9
+    assert r1["total_p95_s"] == 2.0 and r1["wall_p50_s"] == 2.3
+    assert rows[("m2", "fixer_pois")]["wall_mean_s"] is None
+    print("   OK")
+
+    print("test_fixer_csv_helpers: SingleFlight coalesces concurrent duplicates ...")
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    sf = SingleFlight()
+    started = threading.Event()
+
+    def slow() -> dict:
+        started.set()
+        time.sleep(0.2)
+        return {"message": {"content": "ok"}}
+
+    with ThreadPoolExecutor(max_workers=5) as ex:
+        first = ex.submit(sf.do, "k", slow)
+        started.wait()
+        rest = [ex.submit(sf.do, "k", slow) for _ in range(4)]
+        out = [first.result()] + [f.result() for f in rest]
+    assert all(o == {"message": {"content": "ok"}} for o in out)
+    assert out[0] is not out[1]  # each caller gets its own copy
+    st = sf.stats()
+    assert st["upstream_calls"] == 1 and st["saved_calls"] == 4
+    assert sf.do("k", lambda: 1) == 1 and sf.stats()["upstream_calls"] == 2  # finished calls are not reused
+    print("   OK")
+
+    print("test_fixer_csv_helpers: AdaptiveLimiter grows on flat latency, shrinks on overload ...")
+    import httpx
+
+    lim = AdaptiveLimiter(initial=2, max_limit=16, window=4)
+    for _ in range(40):  # full use of the limit, latency flat
+        for _ in range(int(lim.limit)):
+            lim.acquire()
+        for _ in range(int(lim.inflight)):
+            lim.release(0.1)
+    assert lim.stats()["limit"] == 16
+    for _ in range(40):  # latency 4x the baseline: queueing
+        for _ in range(int(lim.limit)):
+            lim.acquire()
+        for _ in range(int(lim.inflight)):
+            lim.release(0.4)
+    assert lim.stats()["limit"] < 16
+    before = lim.limit
+    req = httpx.Request("POST", "http://x/api/chat")
+    lim.acquire()
+    lim.release(0.1, httpx.HTTPStatusError("busy", request=req, response=httpx.Response(503, request=req)))
+    assert lim.limit == max(1, before * 0.5) and lim.stats()["overloads"] == 1
+    print("   OK")
+
     print("test_fixer_csv_helpers: parcels WKT parses as GeoDataFrame ...")
     parcels_path = fixer_root / "data" / "parcels_zoning_raw.csv"
     if parcels_path.is_file():
@@ -25,6 +25,12 @@ We replace it with 5 task-specific dimensions on heterogeneous scales:
 
     Composite = mean of (Fidelity, Compliance, 100-Penalty, 10*Actionable, Adherence)
               -> single 0-100 overall score for ANOVA
+
+Structured output:
+    VALIDATOR_SCHEMA is sent as Ollama's `format`, so the model is constrained to
+    JSON with these fields and ranges. Each reply is checked with a validator that
+    is compiled once; a reply that still doesn't match raises InvalidValidatorOutput
+    (strict=True) so the caller can re-queue just that report.
 """
 from __future__ import annotations
 
@@ -34,9 +40,15 @@ from typing import Optional
 
 import requests
 
+try:  # optional: full JSON-schema validation; otherwise a required-fields/range check
+    import jsonschema
+except ImportError:  # pragma: no cover - depends on the environment
+    jsonschema = None
+
 OLLAMA_HOST = "http://localhost:11434"
 OLLAMA_CHAT_URL = f"{OLLAMA_HOST}/api/chat"
 MODEL = "gemma3:latest"
+MAX_SCHEMA_RETRIES = 2  # extra requests for a reply that doesn't match VALIDATOR_SCHEMA
 
 
 # Source data summary the AI evaluator can cross-check against.
@@ -124,6 +136,78 @@ Return JSON in this EXACT structure (no markdown fences, no commentary):
 """
 
 
+def _int_field(lo: int, hi: int) -> dict:
+    return {"type": "integer", "minimum": lo, "maximum": hi}
+
+
+VALIDATOR_SCHEMA: dict = {
+    "type": "object",
+    "properties": {
+        "numerical_fidelity": _int_field(0, 100),
+        "structural_compliance": _int_field(0, 100),
+        "hallucination_penalty": _int_field(0, 100),
+        "recommendation_actionable": _int_field(0, 10),
+        "constraint_adherence": {"type": "integer", "enum": [0, 100]},
+        "composite_score": {"type": "number", "minimum": 0, "maximum": 100},
+        "reasoning": {"type": "string"},
+    },
+    "required": [
+        "numerical_fidelity",
+        "structural_compliance",
+        "hallucination_penalty",
+        "recommendation_actionable",
+        "constraint_adherence",
+        "composite_score",
+        "reasoning",
+    ],
+}
+
+
+class InvalidValidatorOutput(ValueError):
+    """The validator model's reply did not match VALIDATOR_SCHEMA."""
+
+    def __init__(self, errors: list[str], raw: str):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+        self.raw = raw
+
+
+def _compile_validator(schema: dict):
+    """Compile the schema once; returns a function listing problems (empty = valid)."""
+    if jsonschema is not None:
+        checker = jsonschema.validators.validator_for(schema)(schema)
+        return lambda value: [e.message for e in checker.iter_errors(value)]
+
+    # Python types each JSON schema "type" accepts (bool is an int in Python, so exclude it)
+    type_checks = {
+        "integer": lambda v: isinstance(v, int) and not isinstance(v, bool) or isinstance(v, float) and v.is_integer(),
+        "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+        "boolean": lambda v: isinstance(v, bool),
+        "string": lambda v: isinstance(v, str),
+    }
+
+    def check(value) -> list[str]:
+        if not isinstance(value, dict):
+            return ["reply is not a JSON object"]
+        errors = [f"missing '{k}'" for k in schema["required"] if k not in value]
+        for key, spec in schema["properties"].items():
+            if key not in value:
+                continue
+            v = value[key]
+            if not type_checks.get(spec.get("type"), lambda _: True)(v):
+                errors.append(f"'{key}' is not of type {spec['type']}: {v!r}")
+            elif "enum" in spec and v not in spec["enum"]:
+                errors.append(f"'{key}' must be one of {spec['enum']}: {v!r}")
+            elif not spec.get("minimum", v) <= v <= spec.get("maximum", v):
+                errors.append(f"'{key}' out of range: {v!r}")
+        return errors
+
+    return check
+
+
+_schema_errors = _compile_validator(VALIDATOR_SCHEMA)
+
+
 def build_validator_prompt(report_text: str) -> str:
     return VALIDATOR_PROMPT_TEMPLATE.format(
         source_digest=SOURCE_DATA_DIGEST.strip(),
@@ -164,20 +248,49 @@ def _coerce_int(value, lo: int, hi: int, default: int = 0) -> int:
     return max(lo, min(hi, v))
 
 
-def validate_report(report_text: str) -> dict:
-    """Call the AI validator on one report; return the 5 scores + composite + raw JSON."""
-    prompt = build_validator_prompt(report_text)
+def _ask_validator(messages: list[dict]) -> str:
     body = {
         "model": MODEL,
-        "messages": [{"role": "user", "content": prompt}],
+        "messages": messages,
         "stream": False,
         "options": {"temperature": 0.1},  # low temp for stable scoring
-        "format": "json",  # Ollama supports JSON-mode
+        "format": VALIDATOR_SCHEMA,  # Ollama structured output: reply must follow the schema
     }
     response = requests.post(OLLAMA_CHAT_URL, json=body, timeout=180)
     response.raise_for_status()
-    raw = ((response.json().get("message") or {}).get("content") or "").strip()
-    parsed = _extract_json(raw) or {}
+    return ((response.json().get("message") or {}).get("content") or "").strip()
+
+
+def validate_report(
+    report_text: str,
+    retries: int = MAX_SCHEMA_RETRIES,
+    strict: bool = False,
+    previous: Optional[InvalidValidatorOutput] = None,
+) -> dict:
+    """Call the AI validator on one report; return the 5 scores + composite + raw JSON.
+
+    A reply that doesn't match VALIDATOR_SCHEMA is sent back with its errors, up
+    to `retries` more times. If it still doesn't match, strict=True raises
+    InvalidValidatorOutput (pass it back as `previous` to resume from that reply);
+    otherwise the fields are coerced into range as a last resort.
+    """
+    messages = [{"role": "user", "content": build_validator_prompt(report_text)}]
+    if previous is not None:
+        messages += _repair_turn(previous)
+
+    for attempt in range(retries + 1):
+        raw = _ask_validator(messages)
+        # _extract_json stays as a fallback for servers that ignore `format`
+        parsed = _extract_json(raw)
+        errors = _schema_errors(parsed) if parsed is not None else ["reply is not valid JSON"]
+        if not errors:
+            break
+        failure = InvalidValidatorOutput(errors, raw)
+        messages += _repair_turn(failure)
+    else:
+        if strict:
+            raise failure
+    parsed = parsed or {}
 
     nf = _coerce_int(parsed.get("numerical_fidelity"), 0, 100)
     sc = _coerce_int(parsed.get("structural_compliance"), 0, 100)
@@ -201,6 +314,15 @@ def validate_report(report_text: str) -> dict:
     }
 
 
+def _repair_turn(failure: InvalidValidatorOutput) -> list[dict]:
+    """The bad reply plus a request to fix it, appended to the conversation."""
+    return [
+        {"role": "assistant", "content": failure.raw},
+        {"role": "user", "content": f"Your JSON did not match the required structure ({failure}). "
+                                    "Return the corrected JSON only."},
+    ]
+
+
 # Quick sanity test if run directly
 if __name__ == "__main__":
     import sys
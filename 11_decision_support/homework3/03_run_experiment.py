@@ -15,6 +15,10 @@ CSV columns:
     numerical_fidelity, structural_compliance, hallucination_penalty,
     recommendation_actionable, constraint_adherence, composite_score,
     reasoning
+
+Reports whose validator reply doesn't match the JSON schema are re-queued
+(with the bad reply and its errors) after the first pass, for at most
+MAX_SCHEMA_RETRIES more rounds; valid scores are never re-generated.
 """
 from __future__ import annotations
 
@@ -32,6 +36,8 @@ validator_mod = importlib.util.module_from_spec(spec)
 sys.modules["validator_mod"] = validator_mod
 spec.loader.exec_module(validator_mod)
 validate_report = validator_mod.validate_report
+InvalidValidatorOutput = validator_mod.InvalidValidatorOutput
+MAX_SCHEMA_RETRIES = validator_mod.MAX_SCHEMA_RETRIES
 
 REPORTS_ROOT = HERE / "reports"
 OUTPUT_CSV = HERE / "results" / "validation_scores.csv"
@@ -79,42 +85,68 @@ def main() -> None:
     start_time = time.time()
     rows: list[dict] = []
     failures = 0
+    attempts = 0
+    # (item, last InvalidValidatorOutput); round 0 sends every report once
+    queue: list[tuple[dict, object]] = [(item, None) for item in items]
 
     with OUTPUT_CSV.open("w", newline="", encoding="utf-8") as f:
         writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
         writer.writeheader()
 
-        for idx, item in enumerate(items, 1):
-            text = item["path"].read_text(encoding="utf-8").strip()
-            print(f"[{idx:>3}/{len(items)}] validating {item['prompt_id']}/"
-                  f"report_{item['report_id']:03d} ...", end="", flush=True)
-
-            try:
-                scores = validate_report(text)
-                row = {
-                    "prompt_id": item["prompt_id"],
-                    "report_id": item["report_id"],
-                    "file_path": str(item["path"].relative_to(HERE)),
-                    "numerical_fidelity": scores["numerical_fidelity"],
-                    "structural_compliance": scores["structural_compliance"],
-                    "hallucination_penalty": scores["hallucination_penalty"],
-                    "recommendation_actionable": scores["recommendation_actionable"],
-                    "constraint_adherence": scores["constraint_adherence"],
-                    "composite_score": scores["composite_score"],
-                    "reasoning": scores["reasoning"],
-                }
-                writer.writerow(row)
-                f.flush()  # progress is durable if interrupted
-                rows.append(row)
-                elapsed = time.time() - start_time
-                eta_min = (elapsed / idx) * (len(items) - idx) / 60.0
-                print(f" composite={row['composite_score']:.1f}  [ETA ~{eta_min:.1f} min]")
-            except Exception as exc:
-                failures += 1
-                print(f" FAILED: {exc}")
+        for round_no in range(MAX_SCHEMA_RETRIES + 1):
+            if not queue:
+                break
+            if round_no:
+                print(f"[INFO] retry round {round_no}: re-validating "
+                      f"{len(queue)} report(s) with schema-invalid replies")
+            invalid: list[tuple[dict, object]] = []
+
+            for item, previous in queue:
+                attempts += 1
+                text = item["path"].read_text(encoding="utf-8").strip()
+                print(f"[{len(rows) + 1:>3}/{len(items)}] validating {item['prompt_id']}/"
+                      f"report_{item['report_id']:03d} ...", end="", flush=True)
+
+                try:
+                    # retries=0: a schema-invalid reply is re-queued for the next
+                    # round (resuming from that reply) instead of retried in place
+                    scores = validate_report(text, retries=0, strict=True, previous=previous)
+                    row = {
+                        "prompt_id": item["prompt_id"],
+                        "report_id": item["report_id"],
+                        "file_path": str(item["path"].relative_to(HERE)),
+                        "numerical_fidelity": scores["numerical_fidelity"],
+                        "structural_compliance": scores["structural_compliance"],
+                        "hallucination_penalty": scores["hallucination_penalty"],
+                        "recommendation_actionable": scores["recommendation_actionable"],
+                        "constraint_adherence": scores["constraint_adherence"],
+                        "composite_score": scores["composite_score"],
+                        "reasoning": scores["reasoning"],
+                    }
+                    writer.writerow(row)
+                    f.flush()  # progress is durable if interrupted
+                    rows.append(row)
+                    elapsed = time.time() - start_time
+                    remaining = len(items) - len(rows) - failures
+                    eta_min = (elapsed / attempts) * remaining / 60.0
+                    print(f" composite={row['composite_score']:.1f}  [ETA ~{eta_min:.1f} min]")
+                except InvalidValidatorOutput as exc:
+                    invalid.append((item, exc))
+                    print(f" INVALID: {exc}")
+                except Exception as exc:
+                    failures += 1
+                    print(f" FAILED: {exc}")
+
+            queue = invalid
+
+    for item, exc in queue:
+        failures += 1
+        print(f"[WARN] {item['prompt_id']}/report_{item['report_id']:03d} still "
+              f"schema-invalid after {MAX_SCHEMA_RETRIES} retries: {exc}")
 
     print(f"\n[DONE] wrote {len(rows)} rows to {OUTPUT_CSV}")
     print(f"[DONE] failures: {failures}")
+    print(f"[DONE] validator calls: {attempts} ({attempts - len(items)} schema retries)")
     print(f"[DONE] total time: {(time.time() - start_time)/60:.1f} minutes")
 
 